@@ -0,0 +1,285 @@
+"""Сквозной бенчмарк bot.py против локального Bot API (fake_telegram.py).
+
+Что меряем:
+  commands   — пропускная способность команд через getUpdates → ответ
+  broadcast  — рассылка одной записи расписания по многим группам
+  fire_lag   — опоздание реальной отправки от времени записи (ждёт начала
+               следующей минуты, до 60 с; --skip-fire-lag отключает)
+  week       — память процесса за симулированную неделю срабатываний
+
+Результат — JSON в benchmarks/results/ (или --out), с --compare печатается
+сравнение с прошлым прогоном:
+
+    python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --compare benchmarks/results/старый.json
+
+Бот работает во временном каталоге (DATA_DIR), файлы расписания
+репозитория не трогаются.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram  # noqa: E402
+
+COMMANDS = ('/status', '/show_week', '/show_daily', '/get_group', '/get_scheduled', '/help')
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса (Linux), иначе максимальный RSS."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def git_version() -> str:
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def bench_commands(app, fake: FakeTelegram, count: int, chats: int) -> dict:
+    fake.reset()
+    started = time.perf_counter()
+    for i in range(count):
+        fake.push_message(1000 + i % chats, COMMANDS[i % len(COMMANDS)])
+    done = fake.wait_sent(count, timeout=300)
+    elapsed = time.perf_counter() - started
+    stats = app.update_stats.summary()
+    return {
+        'commands': count,
+        'completed': done,
+        'seconds': round(elapsed, 3),
+        'commands_per_sec': round(count / elapsed, 1),
+        'handler_p50_ms': stats['p50_ms'],
+        'handler_p99_ms': stats['p99_ms'],
+    }
+
+
+def bench_broadcast(app, fake: FakeTelegram, groups: int) -> dict:
+    fake.reset()
+    app.store.set('groups', [-1000000 - i for i in range(groups)])
+    started = time.perf_counter()
+    app.send_scheduled(('daily', '09:00'), 'benchmark', time.time(), '')
+    done = fake.wait_sent(groups, timeout=600)
+    elapsed = time.perf_counter() - started
+    return {
+        'groups': groups,
+        'completed': done,
+        'seconds': round(elapsed, 3),
+        'sends_per_sec': round(groups / elapsed, 1),
+    }
+
+
+def bench_fire_lag(app, fake: FakeTelegram, groups: int) -> dict:
+    """Одноразовая запись на начало следующей минуты, реальный планировщик."""
+    app.store.set('groups', [-2000000 - i for i in range(groups)])
+    slot = (datetime.now() + timedelta(minutes=1)).replace(second=0, microsecond=0)
+    key = ('one_off', slot.strftime('%Y-%m-%d'), slot.strftime('%H:%M'))
+    fake.reset()
+    app.store.add(key, 'fire lag')
+    app.scheduler.reschedule(added=[key])
+    done = fake.wait_sent(groups, timeout=180)
+    lags = [(ts - slot.timestamp()) * 1000 for ts, _, _ in fake.sent]
+    return {
+        'groups': groups,
+        'completed': done,
+        'first_ms': round(min(lags), 1) if lags else None,
+        'p50_ms': round(percentile(lags, 50), 1),
+        'p99_ms': round(percentile(lags, 99), 1),
+        'last_ms': round(max(lags), 1) if lags else None,
+    }
+
+
+def make_schedule(app, entries: int, start: datetime) -> None:
+    """entries записей: треть недельных, треть ежедневных, остальное — одноразовые на неделю."""
+    from schedule_index import WEEKDAYS
+
+    rnd = random.Random(entries)
+    for i in range(entries):
+        time_str = f"{rnd.randrange(24):02d}:{rnd.randrange(60):02d}"
+        kind = i % 3
+        if kind == 0:
+            app.store.add(('weekly', rnd.choice(WEEKDAYS), time_str), f"w{i}")
+        elif kind == 1:
+            app.store.add(('daily', time_str), f"d{i}")
+        else:
+            date_str = (start + timedelta(days=rnd.randrange(7))).strftime('%Y-%m-%d')
+            app.store.add(('one_off', date_str, time_str), f"o{i}")
+
+
+def bench_week(app, fake: FakeTelegram, entries: int, groups: int) -> dict:
+    """Неделя срабатываний на виртуальных часах, без ожидания реального времени.
+
+    Отдельный экземпляр Scheduler с `VirtualClock` перескакивает от
+    срабатывания к срабатыванию и отдаёт записи в настоящую рассылку;
+    после каждых суток снимается RSS процесса.
+    """
+    from clock import VirtualClock
+    from scheduler import Scheduler
+
+    app.scheduler.stop()
+    app.store.clear('weekly')
+    app.store.clear('daily')
+    app.store.clear('one_off')
+    app.store.set('groups', [-3000000 - i for i in range(groups)])
+    # догонять «пропущенное» до начала симуляции не нужно
+    app.store.set('scheduler_hwm', None)
+    start = (datetime.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    make_schedule(app, entries, start)
+
+    clock = VirtualClock(start)
+    sim = Scheduler(app.store, misfire_policy='skip', checkpoint=float('inf'), clock=clock)
+    end_ts = start.timestamp() + 7 * 86400
+    day_end = start.timestamp() + 86400
+    fake.reset()
+    fired = 0
+    rss = [rss_bytes()]
+    started = time.perf_counter()
+    while clock.time() < end_ts:
+        due, delay = sim.step()
+        for key, slot_ts, zone in due:
+            text = app.store.text(key)
+            if text is not None:
+                app.send_scheduled(key, text, slot_ts, zone)
+                fired += 1
+            sim.done(key)
+        if not due:
+            clock.advance(delay)
+        while day_end <= min(clock.time(), end_ts):
+            fake.wait_sent(fired * groups, timeout=600)
+            rss.append(rss_bytes())
+            day_end += 86400
+    elapsed = time.perf_counter() - started
+    return {
+        'entries': entries,
+        'groups': groups,
+        'fired': fired,
+        'sends': len(fake.sent),
+        'seconds': round(elapsed, 3),
+        'rss_start_mb': round(rss[0] / 2**20, 2),
+        'rss_end_mb': round(rss[-1] / 2**20, 2),
+        # рост после первых суток (разогрев кэшей и пулов не считаем)
+        'rss_growth_mb': round((rss[-1] - rss[1]) / 2**20, 2),
+        'rss_by_day_mb': [round(r / 2**20, 2) for r in rss],
+    }
+
+
+def compare(old: dict, new: dict) -> None:
+    """Печатает изменение числовых показателей относительно прошлого прогона."""
+    print(f"\nСравнение с {old.get('version')} ({old.get('timestamp')}):")
+    for name, section in new['results'].items():
+        before = old.get('results', {}).get(name, {})
+        for metric, value in section.items():
+            prev = before.get(metric)
+            if isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and isinstance(prev, (int, float)) and prev:
+                print(f"  {name}.{metric}: {prev} → {value} ({(value - prev) / prev * 100:+.1f}%)")
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description='Сквозной бенчмарк бота')
+    parser.add_argument('--commands', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--week-entries', type=int, default=1000)
+    parser.add_argument('--week-groups', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа Bot API, с')
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--global-rate', type=float, default=10000,
+                        help='общий лимит отправки; 30 — как у настоящего Telegram')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--skip-fire-lag', action='store_true')
+    parser.add_argument('--out', help='куда записать JSON с результатами')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args(argv)
+
+    fake = FakeTelegram(latency=args.latency, rate_429=args.rate_429,
+                        error_rate=args.error_rate, seed=1).start()
+    data_dir = tempfile.mkdtemp(prefix='bench-e2e-')
+    os.environ.update({
+        'BOT_TOKEN': '123456:BENCHMARK',
+        'DATA_DIR': data_dir,
+        'STORAGE_BACKEND': args.storage,
+        'GLOBAL_RATE_PER_SEC': str(args.global_rate),
+        'CHAT_RATE_PER_MIN': str(args.global_rate * 60),
+        'CHAT_BURST': str(args.global_rate),
+        'RETRY_BASE_DELAY': '0.05',
+        'METRICS_PORT': '0',
+        'RUN_MODE': 'polling',
+        'TIMEZONE': '',
+    })
+
+    import telebot
+    telebot.apihelper.API_URL = fake.api_url
+    import bot as app
+
+    polling = threading.Thread(target=app.bot.infinity_polling,
+                               kwargs={'timeout': 10, 'long_polling_timeout': 1}, daemon=True)
+    polling.start()
+    scheduler_thread = threading.Thread(target=app.scheduled_sender, daemon=True)
+    scheduler_thread.start()
+
+    results = {'commands': bench_commands(app, fake, args.commands, args.chats)}
+    print(f"commands: {results['commands']}")
+    results['broadcast'] = bench_broadcast(app, fake, args.groups)
+    print(f"broadcast: {results['broadcast']}")
+    if not args.skip_fire_lag:
+        print("fire_lag: ждём начала следующей минуты...")
+        results['fire_lag'] = bench_fire_lag(app, fake, min(args.groups, 100))
+        print(f"fire_lag: {results['fire_lag']}")
+    results['week'] = bench_week(app, fake, args.week_entries, args.week_groups)
+    print(f"week: {results['week']}")
+
+    app.bot.stop_polling()
+    app.delivery.shutdown()
+    app.store.close()
+    fake.stop()
+
+    report = {
+        'version': git_version(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': vars(args),
+        'results': results,
+    }
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results',
+                                   f"e2e-{datetime.now():%Y%m%d-%H%M%S}-{report['version']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты: {out}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
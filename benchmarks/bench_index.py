@@ -0,0 +1,72 @@
+"""Микробенчмарк: стоимость одного «тика» — поиска записей на текущую минуту.
+
+Сравнивает старый построчный перебор `time_slot == current_time` по трём
+расписаниям со скомпилированным `ScheduleIndex`.
+
+Запуск: python benchmarks/bench_index.py
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedule_index import WEEKDAYS, ScheduleIndex  # noqa: E402
+
+SIZES = (10, 100, 1_000, 10_000, 100_000)
+NOW = datetime(2026, 10, 19, 9, 0)
+
+
+def make_storage(n: int) -> dict:
+    """Расписание из n записей: треть недельных, треть ежедневных, остальное — одноразовые."""
+    rnd = random.Random(n)
+    storage = {'weekly_schedule': {d: {} for d in WEEKDAYS}, 'daily_schedule': {}, 'one_off': {}}
+    for i in range(n):
+        time_str = f"{rnd.randrange(24):02d}:{rnd.randrange(60):02d}"
+        kind = i % 3
+        if kind == 0:
+            storage['weekly_schedule'][rnd.choice(WEEKDAYS)][time_str] = f"w{i}"
+        elif kind == 1:
+            storage['daily_schedule'][time_str] = f"d{i}"
+        else:
+            date_str = (NOW + timedelta(days=rnd.randrange(60))).strftime('%Y-%m-%d')
+            storage['one_off'].setdefault(date_str, {})[time_str] = f"o{i}"
+    return storage
+
+
+def linear_tick(storage: dict, now: datetime) -> list:
+    """Старый способ: сравнение строк по всем записям на сегодня."""
+    current_time = now.strftime('%H:%M')
+    due = []
+    for time_slot in storage['weekly_schedule'].get(WEEKDAYS[now.weekday()], {}):
+        if time_slot == current_time:
+            due.append(time_slot)
+    for time_slot in storage['daily_schedule']:
+        if time_slot == current_time:
+            due.append(time_slot)
+    for time_slot in storage['one_off'].get(now.strftime('%Y-%m-%d'), {}):
+        if time_slot == current_time:
+            due.append(time_slot)
+    return due
+
+
+def bench(stmt, number: int) -> float:
+    """Лучшее время одного вызова в микросекундах."""
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def main() -> None:
+    print(f"{'записей':>8} {'сборка, мс':>11} {'перебор, мкс':>13} {'индекс, мкс':>12}")
+    for n in SIZES:
+        storage = make_storage(n)
+        build_ms = bench(lambda: ScheduleIndex.build(storage), 1) / 1000
+        index = ScheduleIndex.build(storage)
+        linear_us = bench(lambda: linear_tick(storage, NOW), 200)
+        index_us = bench(lambda: index.due(NOW), 20_000)
+        print(f"{n:>8} {build_ms:>11.2f} {linear_us:>13.2f} {index_us:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
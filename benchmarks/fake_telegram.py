@@ -0,0 +1,388 @@
+"""Локальная замена Bot API для тестов и бенчмарков.
+
+Поддерживает getMe, getUpdates (с long polling), setWebhook,
+deleteWebhook, sendMessage, а также sendPhoto, sendDocument и
+sendMediaGroup (файлом или file_id; загруженные файлы — в `uploads`),
+getFile и скачивание файлов (присланных `push_document` или загруженных),
+нажатия inline-кнопок (`push_callback`), editMessageText (в `edits`) и
+answerCallbackQuery.
+Задержку ответа, долю ответов 429 и долю ошибок 5xx можно настроить. Бот направляется на сервер так:
+
+    telebot.apihelper.API_URL = fake.api_url          # TeleBot
+    telebot.apihelper.FILE_URL = fake.file_url
+    telebot.asyncio_helper.API_URL = fake.api_url     # AsyncTeleBot
+    telebot.asyncio_helper.FILE_URL = fake.file_url
+
+Отдельно: python benchmarks/fake_telegram.py --port 8081 --latency 0.05
+"""
+import argparse
+import email.parser
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def parse_multipart(body: bytes, content_type: str):
+    """(поля, файлы) из тела multipart/form-data; файлы — {имя поля: байты}."""
+    message = email.parser.BytesParser().parsebytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+    fields, files = {}, {}
+    for part in message.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        data = part.get_payload(decode=True)
+        if part.get_filename() is not None:
+            files[name] = data
+        else:
+            fields[name] = data.decode('utf-8')
+    return fields, files
+
+
+class FakeTelegram:
+    """Сервер в фоновом потоке; `sent` — [(time.time() отправки, chat_id, text)] по порядку
+    (для вложений text — подпись), `uploads` — [(chat_id, метод, размер файла)]."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, rate_429: float = 0.0, retry_after: int = 1,
+                 error_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.webhook_url = ''
+        self.sent = []
+        self.uploads = []
+        self.edits = []
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._files = set()  # выданные file_id
+        self._contents = {}  # file_id -> байты файла (для getFile)
+        self._cond = threading.Condition()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/bot{{0}}/{{1}}'
+
+    @property
+    def file_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/file/bot{{0}}/{{1}}'
+
+    def start(self) -> 'FakeTelegram':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # --- входящие обновления -------------------------------------------
+
+    def push_message(self, chat_id: int, text: str, chat_type: str = 'private') -> int:
+        """Добавляет обновление с сообщением (команды размечаются как bot_command)."""
+        update_id = next(self._update_ids)
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': chat_type},
+            'from': {'id': abs(chat_id), 'is_bot': False, 'first_name': 'fake'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        with self._cond:
+            self._updates.append({'update_id': update_id, 'message': message})
+            self._cond.notify_all()
+        return update_id
+
+    def push_document(self, chat_id: int, data: bytes, file_name: str, caption: str = '',
+                      chat_type: str = 'private') -> int:
+        """Добавляет обновление с документом (подпись-команда размечается как bot_command)."""
+        update_id = next(self._update_ids)
+        file_id = f'file{next(self._file_ids)}'
+        with self._cond:
+            self._files.add(file_id)
+            self._contents[file_id] = data
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': chat_type},
+            'from': {'id': abs(chat_id), 'is_bot': False, 'first_name': 'fake'},
+            'document': {'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_name,
+                         'file_size': len(data)},
+        }
+        if caption:
+            message['caption'] = caption
+            if caption.startswith('/'):
+                message['caption_entities'] = [{'type': 'bot_command', 'offset': 0,
+                                                'length': len(caption.split()[0])}]
+        with self._cond:
+            self._updates.append({'update_id': update_id, 'message': message})
+            self._cond.notify_all()
+        return update_id
+
+    def push_callback(self, chat_id: int, message_id: int, data: str) -> int:
+        """Добавляет обновление с нажатием inline-кнопки под сообщением бота."""
+        update_id = next(self._update_ids)
+        query = {
+            'id': str(update_id),
+            'from': {'id': abs(chat_id), 'is_bot': False, 'first_name': 'fake'},
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'fake'},
+                'text': '',
+            },
+        }
+        with self._cond:
+            self._updates.append({'update_id': update_id, 'callback_query': query})
+            self._cond.notify_all()
+        return update_id
+
+    def content(self, file_id: str) -> bytes:
+        """Содержимое файла, присланного или загруженного ботом."""
+        return self._contents[file_id]
+
+    def wait_sent(self, count: int, timeout: float = 60) -> bool:
+        """Ждёт, пока наберётся `count` отправленных сообщений."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.sent) < count:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def reset(self) -> None:
+        with self._cond:
+            self.sent = []
+            self.uploads = []
+            self.edits = []
+            self.calls = {}
+
+    # --- методы API ----------------------------------------------------
+
+    def _call(self, method: str, params: dict):
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        handler = getattr(self, f'_api_{method}', None)
+        if handler is None:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}
+        return handler(params)
+
+    def _api_getMe(self, params):
+        return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'fake', 'username': 'fake_bot'}}
+
+    def _api_setWebhook(self, params):
+        self.webhook_url = params.get('url', '')
+        return 200, {'ok': True, 'result': True, 'description': 'Webhook was set'}
+
+    def _api_deleteWebhook(self, params):
+        self.webhook_url = ''
+        return 200, {'ok': True, 'result': True}
+
+    def _api_getUpdates(self, params):
+        if self.webhook_url:
+            return 409, {'ok': False, 'error_code': 409,
+                         'description': "Conflict: can't use getUpdates method while webhook is active"}
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self._cond:
+            # подтверждённые (update_id < offset) больше не нужны
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            return 200, {'ok': True, 'result': self._updates[:limit]}
+
+    def _failure(self):
+        """Задержка и, по настройкам, ответ с ошибкой (None — отправка удалась)."""
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.uniform(0, self.jitter))
+        roll = self._random.random()
+        if roll < self.rate_429:
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        if roll < self.rate_429 + self.error_rate:
+            return 502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}
+        return None
+
+    def _message(self, chat_id: int, logged: str, **fields) -> dict:
+        with self._cond:
+            self.sent.append((time.time(), chat_id, logged))
+            self._cond.notify_all()
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            **fields,
+        }
+
+    def _file(self, chat_id: int, method: str, value, files: dict):
+        """file_id вложения: загруженный файл получает новый, чужой file_id — None."""
+        name = value[len('attach://'):] if value.startswith('attach://') else value
+        if name in files:
+            file_id = f'file{next(self._file_ids)}'
+            with self._cond:
+                self._files.add(file_id)
+                self._contents[file_id] = files[name]
+                self.uploads.append((chat_id, method, len(files[name])))
+            return file_id
+        return value if value in self._files else None
+
+    def _api_editMessageText(self, params):
+        markup = params.get('reply_markup')
+        with self._cond:
+            self.edits.append((int(params['chat_id']), int(params['message_id']), params.get('text', ''),
+                               json.loads(markup) if isinstance(markup, str) else markup))
+            self._cond.notify_all()
+        return 200, {'ok': True, 'result': True}
+
+    def _api_answerCallbackQuery(self, params):
+        return 200, {'ok': True, 'result': True}
+
+    def _api_getFile(self, params):
+        file_id = params.get('file_id', '')
+        if file_id not in self._contents:
+            return self._WRONG_FILE
+        return 200, {'ok': True, 'result': {'file_id': file_id, 'file_unique_id': file_id,
+                                            'file_size': len(self._contents[file_id]),
+                                            'file_path': f'documents/{file_id}'}}
+
+    _WRONG_FILE = 400, {'ok': False, 'error_code': 400,
+                        'description': 'Bad Request: wrong file identifier/HTTP URL specified'}
+
+    def _api_sendMessage(self, params):
+        failure = self._failure()
+        if failure is not None:
+            return failure
+        chat_id = int(params['chat_id'])
+        text = params.get('text', '')
+        return 200, {'ok': True, 'result': self._message(chat_id, text, text=text)}
+
+    def _send_file(self, params, method: str, field: str):
+        failure = self._failure()
+        if failure is not None:
+            return failure
+        chat_id = int(params['chat_id'])
+        files = params.get('_files', {})
+        # загружаемый файл приходит частью multipart с именем поля
+        file_id = self._file(chat_id, method, field if field in files else params.get(field, ''), files)
+        if file_id is None:
+            return self._WRONG_FILE
+        if field == 'photo':
+            media = {'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1}]}
+        else:
+            media = {'document': {'file_id': file_id, 'file_unique_id': file_id}}
+        caption = params.get('caption', '')
+        return 200, {'ok': True, 'result': self._message(chat_id, caption, caption=caption, **media)}
+
+    def _api_sendPhoto(self, params):
+        return self._send_file(params, 'sendPhoto', 'photo')
+
+    def _api_sendDocument(self, params):
+        return self._send_file(params, 'sendDocument', 'document')
+
+    def _api_sendMediaGroup(self, params):
+        failure = self._failure()
+        if failure is not None:
+            return failure
+        chat_id = int(params['chat_id'])
+        items = params['media']
+        items = json.loads(items) if isinstance(items, str) else items
+        file_ids = [self._file(chat_id, 'sendMediaGroup', item['media'], params.get('_files', {}))
+                    for item in items]
+        if None in file_ids:
+            return self._WRONG_FILE
+        messages = []
+        for item, file_id in zip(items, file_ids):
+            if item['type'] == 'photo':
+                media = {'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1}]}
+            else:
+                media = {'document': {'file_id': file_id, 'file_unique_id': file_id}}
+            caption = item.get('caption', '')
+            messages.append(self._message(chat_id, caption, caption=caption, **media))
+        return 200, {'ok': True, 'result': messages}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                url = urlsplit(self.path)
+                if url.path.startswith('/file/'):
+                    return self._download(url.path.rsplit('/', 1)[-1])
+                method = url.path.rsplit('/', 1)[-1]
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    content_type = self.headers.get('Content-Type') or ''
+                    if 'json' in content_type:
+                        params.update(json.loads(body))
+                    elif content_type.startswith('multipart/'):
+                        fields, files = parse_multipart(body, content_type)
+                        params.update(fields, _files=files)
+                    else:
+                        params.update(parse_qsl(body.decode('utf-8')))
+                code, payload = fake._call(method, params)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _download(self, file_id):
+                data = fake._contents.get(file_id)
+                self.send_response(404 if data is None else 200)
+                self.send_header('Content-Length', str(len(data or b'')))
+                self.end_headers()
+                self.wfile.write(data or b'')
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальная замена Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeTelegram(args.host, args.port, args.latency, args.jitter,
+                        rate_429=args.rate_429, error_rate=args.error_rate).start()
+    print(f"Fake Bot API: {fake.api_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,128 @@
+"""Нагрузочный «Telegram»: шлёт записанные обновления в вебхук бота.
+
+Бот запускается отдельно в режиме вебхука, например:
+
+    RUN_MODE=webhook WEBHOOK_PORT=8443 WEBHOOK_SECRET=test python bot.py
+
+и затем:
+
+    python benchmarks/webhook_replay.py --url http://127.0.0.1:8443/webhook \\
+        --secret test --updates updates.jsonl --concurrency 8
+
+Файл обновлений — по одному JSON-обновлению Telegram в строке. Без
+--updates генерируются синтетические команды (/status, /show_week, ...).
+Как и Telegram, на 503 скрипт ждёт Retry-After и повторяет запрос. В
+конце печатает пропускную способность со стороны клиента и /stats бота.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+COMMANDS = ('/status', '/show_week', '/show_daily', '/get_group', '/server_time', '/help')
+
+
+def synthetic_updates(count: int, chats: int = 50):
+    """Команды от `chats` разных пользователей в личных чатах."""
+    for i in range(count):
+        chat_id = 100000 + i % chats
+        text = COMMANDS[i % len(COMMANDS)]
+        yield {
+            'update_id': i + 1,
+            'message': {
+                'message_id': i + 1,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private', 'first_name': 'bench'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'bench'},
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+            },
+        }
+
+
+def load_updates(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Replayer:
+    def __init__(self, url: str, secret: str):
+        self.url = url
+        self.secret = secret
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.retried = 0
+        self.failed = 0
+
+    def post(self, update: dict) -> None:
+        body = json.dumps(update).encode()
+        while True:
+            request = urllib.request.Request(self.url, data=body, method='POST', headers={
+                'Content-Type': 'application/json',
+                SECRET_HEADER: self.secret,
+            })
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    response.read()
+                with self._lock:
+                    self.accepted += 1
+                return
+            except urllib.error.HTTPError as e:
+                if e.code != 503:
+                    with self._lock:
+                        self.failed += 1
+                    return
+                with self._lock:
+                    self.retried += 1
+                time.sleep(float(e.headers.get('Retry-After', '1')))
+
+
+def fetch_stats(url: str, secret: str) -> dict:
+    parts = urlsplit(url)
+    stats_url = urlunsplit((parts.scheme, parts.netloc, '/stats', '', ''))
+    request = urllib.request.Request(stats_url, headers={SECRET_HEADER: secret})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8443/webhook')
+    parser.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET', ''))
+    parser.add_argument('--updates', help='файл JSONL с записанными обновлениями')
+    parser.add_argument('--count', type=int, default=1000, help='сколько синтетических обновлений')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    updates = load_updates(args.updates) if args.updates else list(synthetic_updates(args.count))
+    replayer = Replayer(args.url, args.secret)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(replayer.post, updates))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        'sent': len(updates),
+        'accepted': replayer.accepted,
+        'retried_503': replayer.retried,
+        'failed': replayer.failed,
+        'seconds': round(elapsed, 3),
+        'accepted_per_sec': round(replayer.accepted / elapsed, 2),
+    }
+    try:
+        result['bot'] = fetch_stats(args.url, args.secret)
+    except OSError as e:
+        print(f"⚠️ Не удалось получить /stats: {e}", file=sys.stderr)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    main()
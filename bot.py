@@ -1,11 +1,27 @@
 import logging
-from datetime import datetime, timedelta
-from threading import Thread
+import secrets
+import signal
 import time
+from concurrent.futures import wait
+from threading import Thread
 import telebot
 
 # Импортируем токен и хранилище
-from config import BOT_TOKEN, messages_storage, save_schedule
+from config import (BOT_TOKEN, CHAT_BURST, CHAT_RATE_PER_MIN, COALESCE_SAME_MINUTE, DELIVERY_WORKERS,
+                    DISPATCH_OVERLOAD, DISPATCH_QUEUE_SIZE, DISPATCH_WORKERS, FILE_ID_CACHE_SIZE,
+                    GLOBAL_RATE_PER_SEC, MEDIA_DIR, METRICS_HOST, METRICS_PORT, RETRY_BASE_DELAY,
+                    RETRY_MAX_ATTEMPTS, RETRY_MAX_DELAY, RUN_DIR, RUN_MODE, SHARD_AUTHKEY,
+                    SHARD_INDEX, SHARDS, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT,
+                    WEBHOOK_QUEUE_SIZE, WEBHOOK_SECRET, WEBHOOK_URL, WEBHOOK_WORKERS, store)
+import bulk
+import handlers
+import metrics
+from delivery import DeliveryEngine, RetryPolicy
+from dispatcher import ChatDispatcher, chat_of
+from media import FileIdCache, MediaSender
+from handlers import (HANDLER_SECONDS, Broadcast, Document, Download, Resend, due_broadcast,
+                      due_broadcasts, log_delivery, page_callback, remember_chat, router, scheduler)
+from webhook import UpdateStats, WebhookServer
 
 # Настройка логирования
 logging.basicConfig(
@@ -14,678 +30,268 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Создаём бота
-bot = telebot.TeleBot(BOT_TOKEN)
-
-# Хранилище chat_id для отправки сообщений
-user_chats = set()
-
-# Флаг для остановки потока
-stop_scheduler = False
-# Дни недели
-DAYS_RU = {
-    0: 'monday',
-    1: 'tuesday',
-    2: 'wednesday',
-    3: 'thursday',
-    4: 'friday',
-    5: 'saturday',
-    6: 'sunday'
-}
-
-DAYS_NAME_RU = {
-    'monday': 'Понедельник',
-    'tuesday': 'Вторник',
-    'wednesday': 'Среда',
-    'thursday': 'Четверг',
-    'friday': 'Пятница',
-    'saturday': 'Суббота',
-    'sunday': 'Воскресенье'
-}
-
-
-@bot.message_handler(commands=['start'])
-def start(message):
-    """Команда /start - показывает список доступных команд"""
-    user_chats.add(message.chat.id)
-    
-    help_text = """
-🤖 *Добро пожаловать в бот!*
-
-Доступные команды:
 
-*📤 /send* - Отправить текстовое сообщение (текущее значение)
-    Используется для отправки заготовленного текста
+# Шард этого процесса при запуске через shard.py (SHARDS > 1)
+node = None
 
-*⏰ /set_schedule* - Установить время и текст для автоотправки
-    Пример: `/set_schedule 10:30 Привет, это автоматическое сообщение`
 
-*📝 /get_scheduled* - Показать текущее запланированное сообщение и время
+class Bot(telebot.TeleBot):
+    """TeleBot, у которого обновления обрабатывает `ChatDispatcher`
+    (очереди по чатам), а не общий пул потоков. При работе шардами
+    обновление уходит процессу, которому принадлежит чат."""
 
-*✏️ /edit_text* - Изменить текст для отправки
-    Пример: `/edit_text Новый текст сообщения`
+    def process_new_updates(self, updates):
+        for update in updates:
+            # polling запрашивает обновления после last_update_id
+            self.last_update_id = max(self.last_update_id, update.update_id)
+            if node is None:
+                dispatcher.submit(update)
+            else:
+                node.route(chat_of(update), 'update', update)
 
-*🕐 /edit_time* - Изменить время отправки
-    Пример: `/edit_time 15:45`
+    def handle_update(self, update) -> None:
+        super().process_new_updates([update])
 
-*📅 /week_schedule* - Управление расписанием на неделю
 
-*📆 /add_daily* - Добавить ежедневную отправку (каждый день в указанное время)
-    Пример: `/add_daily 09:00 Доброе утро!`
+# Создаём бота; обработчики выполняются в потоках dispatcher
+bot = Bot(BOT_TOKEN, threaded=False)
+dispatcher = ChatDispatcher(bot.handle_update, workers=DISPATCH_WORKERS,
+                            queue_size=DISPATCH_QUEUE_SIZE, overload=DISPATCH_OVERLOAD)
 
-*🗑️ /remove_daily* - Удалить ежедневную отправку
-    Пример: `/remove_daily 09:00`
+# Текст или вложение; загруженные файлы отправляются повторно по file_id
+sender = MediaSender(bot, FileIdCache(store, limit=FILE_ID_CACHE_SIZE), MEDIA_DIR)
 
-*📊 /show_daily* - Показать ежедневное расписание
+# Все отправки в группы (/send и расписание) идут через общий движок рассылки.
+# Общий лимит Telegram действует на весь бот, поэтому делится между шардами
+delivery = DeliveryEngine(
+    sender.send,
+    workers=DELIVERY_WORKERS,
+    global_rate=GLOBAL_RATE_PER_SEC / SHARDS,
+    chat_per_minute=CHAT_RATE_PER_MIN,
+    chat_burst=CHAT_BURST,
+    retry=RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY),
+)
 
-*📋 /status* - Показать статус всех настроек
+# Время обработки команд — одинаково считается при polling и вебхуке
+update_stats = UpdateStats()
+# Обновления, ждущие обработчика (во всех очередях; при вебхуке — и в его очереди)
+update_queue = metrics.Gauge('update_queue_depth', 'Обновления в очереди на обработку',
+                             fn=dispatcher.depth)
 
-*ℹ️ /help* - Показать эту справку
-    """
-    
-    bot.reply_to(message, help_text, parse_mode='Markdown')
 
+def execute(message, result):
+    """Выполняет то, что вернул обработчик команды"""
+    if result is None:
+        return
 
+    if isinstance(result, Download):
+        result = read_document(result)
 
-@bot.message_handler(commands=['set_group'])
-def set_group(message):
-    """Команда /set_group - Установить ID группы для отправки"""
-    args = message.text.split(maxsplit=1)
-    
-    if len(args) < 2:
-        bot.reply_to(message, 
-            "❌ Пожалуйста, укажите ID группы!\n\n"
-            "Используйте: `/set_group -1001234567890`\n\n"
-            "📖 Как получить ID группы:\n"
-            "1. Добавьте бота в группу\n"
-            "2. Напишите в группе: `/get_group_id`\n"
-            "3. Бот покажет ID группы",
-            parse_mode='Markdown')
+    if isinstance(result, Document):
+        with bulk.spool(result.write) as f:
+            bot.send_document(message.chat.id, f, visible_file_name=result.file_name, caption=result.caption)
         return
-    
-    group_id_str = args[1]
-    
-    try:
-        group_id = int(group_id_str)
-        messages_storage['group_id'] = group_id
-        save_schedule(messages_storage)  # СОХРАНЯЕМ!
-        
-        bot.reply_to(message, 
-            f"✅ Группа установлена!\n\n"
-            f"📋 ID группы: `{group_id}`",
-            parse_mode='Markdown')
-        logger.info(f"Группа установлена: {group_id}")
-    except ValueError:
-        bot.reply_to(message, 
-            "❌ Неправильный ID группы!\n\n"
-            "ID должен быть числом (например: -1001234567890)",
-            parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['get_group_id'])
-def get_group_id(message):
-    """Команда /get_group_id - Показать ID текущей группы"""
-    bot.send_message(
-        chat_id=message.chat.id,
-        text=f"🆔 ID этой группы/чата: `{message.chat.id}`\n\n"
-             f"Используйте эту команду:\n`/set_group {message.chat.id}`",
-        parse_mode='Markdown'
-    )
 
-
-@bot.message_handler(commands=['get_group'])
-def get_group(message):
-    """Команда /get_group - Показать текущую установленную группу"""
-    if messages_storage['group_id'] is None:
-        bot.reply_to(message, 
-            "❌ Группа не установлена!\n\n"
-            "Используйте: `/set_group -1001234567890`",
-            parse_mode='Markdown')
+    if isinstance(result, Resend):
+        futures = [delivery.submit(letter['chat_id'], letter['text'], parse_mode=letter['parse_mode'],
+                                   media=letter.get('media'))
+                   for letter in result.letters]
+        wait(futures)
+        result = result.report([f.exception() for f in futures])
+
+    if isinstance(result, Broadcast):
+        futures = delivery.broadcast(result.groups, result.text, parse_mode=result.parse_mode, media=result.media)
+        wait(futures)
+        if result.report is None:
+            return
+        result = result.report([f.exception() for f in futures if f.exception() is not None])
+
+    if result.quote:
+        bot.reply_to(message, result.text, parse_mode=result.parse_mode, reply_markup=result.markup)
     else:
-        bot.reply_to(message, 
-            f"📋 Текущая группа для отправки:\n`{messages_storage['group_id']}`",
-            parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['send'])
-def send_message_cmd(message):
-    """Команда /send - Отправить заготовленное сообщение"""
-    if messages_storage['group_id'] is None:
-        bot.reply_to(message, 
-            "❌ Группа не установлена!\n\n"
-            "Используйте команду `/set_group` чтобы установить группу",
-            parse_mode='Markdown')
-        return
-    
-    message_text = messages_storage['send_message_text']
-    try:
-        bot.send_message(
-            chat_id=messages_storage['group_id'],
-            text=f"📤 {message_text}",
-            parse_mode='Markdown'
-        )
-        bot.reply_to(message, f"✅ Сообщение отправлено в группу!\n\n{message_text}", 
-                     parse_mode='Markdown')
-        logger.info(f"Сообщение отправлено в группу {messages_storage['group_id']}")
-    except Exception as e:
-        bot.reply_to(message, f"❌ Ошибка при отправке: {str(e)}", parse_mode='Markdown')
-        logger.error(f"Ошибка при отправке: {e}")
+        bot.send_message(chat_id=message.chat.id, text=result.text, parse_mode=result.parse_mode,
+                         reply_markup=result.markup)
 
 
-@bot.message_handler(commands=['set_schedule'])
-def set_schedule(message):
-    """Команда /set_schedule - Установить время и текст для автоотправки"""
-    args = message.text.split(maxsplit=2)
-    
-    if len(args) < 3:
-        bot.reply_to(message, 
-            "❌ Неправильный формат!\n\n"
-            "Используйте: `/set_schedule ВремяВ:МИН Текст сообщения`\n\n"
-            "Пример: `/set_schedule 10:30 Привет, это автоматическое сообщение`",
-            parse_mode='Markdown')
-        return
-    
-    time_str = args[1]
-    message_text = args[2]
-    
-    # Проверка формата времени
+def read_document(download):
+    """Скачивает документ потоком и отдаёт его обработчику"""
     try:
-        datetime.strptime(time_str, '%H:%M')
-        messages_storage['scheduled_time'] = time_str
-        messages_storage['scheduled_text'] = message_text
-        
-        bot.reply_to(message, 
-            f"✅ Запланировано!\n\n"
-            f"⏰ Время: {time_str}\n"
-            f"📝 Текст: {message_text}",
-            parse_mode='Markdown')
-        logger.info(f"Расписание установлено: {time_str} - {message_text}")
-    except ValueError:
-        bot.reply_to(message, 
-            "❌ Неправильный формат времени!\n\n"
-            "Используйте формат: `ЧЧ:МИН` (например: `10:30`)",
-            parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['get_scheduled'])
-def get_scheduled(message):
-    """Команда /get_scheduled - Показать текущее запланированное сообщение"""
-    scheduled_time = messages_storage['scheduled_time']
-    scheduled_text = messages_storage['scheduled_text']
-    
-    bot.reply_to(message, 
-        f"📋 *Текущее расписание:*\n\n"
-        f"⏰ Время: `{scheduled_time}`\n"
-        f"📝 Текст:\n`{scheduled_text}`",
-        parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['edit_text'])
-def edit_text(message):
-    """Команда /edit_text - Изменить текст для отправки"""
-    args = message.text.split(maxsplit=1)
-    
-    if len(args) < 2:
-        bot.reply_to(message, 
-            "❌ Пожалуйста, укажите новый текст!\n\n"
-            "Используйте: `/edit_text Новый текст`",
-            parse_mode='Markdown')
-        return
-    
-    new_text = args[1]
-    messages_storage['send_message_text'] = new_text
-    
-    bot.reply_to(message, 
-        f"✅ Текст обновлён!\n\n"
-        f"📝 Новый текст для `/send`:\n`{new_text}`",
-        parse_mode='Markdown')
-    logger.info(f"Текст изменён на: {new_text}")
+        with bulk.open_document(BOT_TOKEN, bot.get_file(download.file_id).file_path) as stream:
+            return download.then(stream)
+    except Exception as e:
+        logger.error(f"❌ Не удалось прочитать файл {download.file_id}: {e}")
+        return handlers.Reply(f"❌ Не удалось скачать файл: {e}", parse_mode=None)
 
 
-@bot.message_handler(commands=['edit_time'])
-def edit_time(message):
-    """Команда /edit_time - Изменить время отправки"""
-    args = message.text.split(maxsplit=1)
-    
-    if len(args) < 2:
-        bot.reply_to(message, 
-            "❌ Пожалуйста, укажите время!\n\n"
-            "Используйте: `/edit_time 14:30`",
-            parse_mode='Markdown')
+def handle_command(message):
+    """Единственный обработчик сообщений: обработчик команды берётся из router"""
+    remember_chat(message.chat)
+    handler, args = router.resolve(message)
+    if handler is None:
         return
-    
-    time_str = args[1]
-    
-    # Проверка формата времени
+    started = time.perf_counter()
+    version = store.version
+    ok = False
     try:
-        datetime.strptime(time_str, '%H:%M')
-        messages_storage['scheduled_time'] = time_str
-        
-        bot.reply_to(message, 
-            f"✅ Время обновлено!\n\n"
-            f"⏰ Новое время отправки: `{time_str}`",
-            parse_mode='Markdown')
-        logger.info(f"Время изменено на: {time_str}")
-    except ValueError:
-        bot.reply_to(message, 
-            "❌ Неправильный формат времени!\n\n"
-            "Используйте формат: `ЧЧ:МИН` (например: `14:30`)",
-            parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['status'])
-def status(message):
-    """Команда /status - Показать статус всех настроек"""
-    status_text = (
-        f"📊 *Статус бота:*\n\n"
-        f"📝 *Текст для /send:*\n`{messages_storage['send_message_text']}`\n\n"
-        f"⏰ *Время автоотправки:* `{messages_storage['scheduled_time']}`\n"
-        f"📤 *Текст при автоотправке:*\n`{messages_storage['scheduled_text']}`"
-    )
-    bot.reply_to(message, status_text, parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['help'])
-def help_command(message):
-    """Команда /help - Показать справку"""
-    help_text = """
-🤖 *Справка по командам:*
-
-*📤 /send* - Отправить текстовое сообщение
-Отправляет текст, установленный через `/edit_text`
-
-*⏰ /set_schedule <ВремяВ:МИН> <Текст>* 
-Установить время и текст для автоотправки
-Пример: `/set_schedule 10:30 Доброе утро!`
-
-*📝 /get_scheduled* - Показать запланированное сообщение
-
-*✏️ /edit_text <Текст>* - Изменить текст отправки
-Пример: `/edit_text Новое сообщение`
-
-*🕐 /edit_time <ВремяВ:МИН>* - Изменить время
-Пример: `/edit_time 18:00`
-
-*📅 /week_schedule* - Управление расписанием на неделю
-
-Ежедневные отправки (одни и те же времена каждый день):
-*➕ /add_daily <Время> <Текст>* - Добавить ежедневную отправку
-*❌ /remove_daily <Время>* - Удалить время из ежедневного расписания
-*📊 /show_daily* - Показать ежедневное расписание
-
-*📋 /status* - Показать все текущие настройки
-
-*ℹ️ /help* - Показать эту справку
-    """
-    bot.reply_to(message, help_text, parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['week_schedule'])
-def week_schedule_menu(message):
-    """Команда /week_schedule - Управление расписанием на неделю"""
-    help_text = """
-📅 *Управление расписанием на неделю*
+        execute(message, handler(message, args))
+        ok = True
+    finally:
+        elapsed = time.perf_counter() - started
+        update_stats.record(elapsed, ok)
+        HANDLER_SECONDS.labels(handler.__name__).observe(elapsed)
+        if node is not None and store.version != version:
+            # остальные шарды перечитают расписание из базы
+            store.sync()
+            node.publish('changed')
 
-Доступные команды:
 
-*➕ /add_schedule* - Добавить время отправки для дня
-Пример: `/add_schedule monday 09:00 Доброе утро!`
+bot.register_message_handler(handle_command, content_types=['text', 'document'], func=lambda message: True)
 
-*❌ /remove_schedule* - Удалить время отправки
-Пример: `/remove_schedule monday 09:00`
 
-*📊 /show_week* - Показать всё расписание на неделю
-
-*🔄 /clear_week* - Очистить всё расписание
-
-Дни недели: monday, tuesday, wednesday, thursday, friday, saturday, sunday
-
-Также, если нужно одно и то же время каждый день, используйте ежедневные команды:
-*➕ /add_daily <Время> <Текст>* — добавить ежедневную отправку
-*❌ /remove_daily <Время>* — удалить ежедневную отправку
-*📊 /show_daily* — показать ежедневное расписание
-    """
-    bot.reply_to(message, help_text, parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['add_schedule'])
-def add_schedule(message):
-    """Команда /add_schedule - Добавить время для дня недели"""
-    args = message.text.split(maxsplit=3)
-    
-    if len(args) < 4:
-        bot.reply_to(message, 
-            "❌ Неправильный формат!\n\n"
-            "Используйте: `/add_schedule день время текст`\n\n"
-            "Пример: `/add_schedule monday 09:00 Доброе утро!`\n\n"
-            "Дни: monday, tuesday, wednesday, thursday, friday, saturday, sunday",
-            parse_mode='Markdown')
-        return
-    
-    day = args[1].lower()
-    time_str = args[2]
-    schedule_text = args[3]
-    
-    # Проверка дня
-    valid_days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-    if day not in valid_days:
-        bot.reply_to(message, 
-            f"❌ Неправильный день недели!\n\n"
-            f"Допустимые дни: {', '.join(valid_days)}",
-            parse_mode='Markdown')
-        return
-    
+def handle_callback(call):
+    """Нажатие inline-кнопки (листание страниц): меняем текст сообщения с кнопками"""
+    started = time.perf_counter()
     try:
-        datetime.strptime(time_str, '%H:%M')
-    except ValueError:
-        bot.reply_to(message, 
-            "❌ Неправильный формат времени!\n\n"
-            "Используйте формат: `ЧЧ:МИН` (например: `10:30`)",
-            parse_mode='Markdown')
-        return
-    
-    # Добавляем в расписание (повтор по неделям)
-    messages_storage['weekly_schedule'][day][time_str] = schedule_text
-
-    # Создаём одноразовые отправки на ближайшие N дней (включая сегодня)
-    N = 3
-    now = datetime.now()
-    for i in range(N):
-        dt = now + timedelta(days=i)
-        date_str = dt.strftime('%Y-%m-%d')
-        # создаём запись для даты
-        messages_storage.setdefault('one_off', {}).setdefault(date_str, {})[time_str] = schedule_text
-
-    save_schedule(messages_storage)  # СОХРАНЯЕМ!
-
-    # Вычисляем, будет ли первая отправка сегодня или позже (по серверному времени)
-    today_day = DAYS_RU[now.weekday()]
-    first_send_note = ''
-    try:
-        send_time_obj = datetime.strptime(time_str, '%H:%M').time()
-        if day == today_day and send_time_obj >= now.time():
-            first_send_note = f"\n\nℹ️ Первая отправка: сегодня ({DAYS_NAME_RU[day]}) в {time_str}."
-        else:
-            first_send_note = f"\n\nℹ️ Первая отправка: в следующую {DAYS_NAME_RU[day]} в {time_str}."
-    except Exception:
-        first_send_note = ''
-
-    bot.reply_to(message, 
-        f"✅ Добавлено!\n\n"
-        f"📅 День: {DAYS_NAME_RU[day]}\n"
-        f"⏰ Время: {time_str}\n"
-        f"📝 Текст: {schedule_text}{first_send_note}\n\n"
-        f"ℹ️ Также запланировано на ближайшие {N} дней (одноразово).",
-        parse_mode='Markdown')
-    logger.info(f"Добавлено расписание: {day} {time_str} - {schedule_text}")
-
-
-@bot.message_handler(commands=['remove_schedule'])
-def remove_schedule(message):
-    """Команда /remove_schedule - Удалить время для дня"""
-    args = message.text.split(maxsplit=2)
-    
-    if len(args) < 3:
-        bot.reply_to(message, 
-            "❌ Неправильный формат!\n\n"
-            "Используйте: `/remove_schedule день время`\n\n"
-            "Пример: `/remove_schedule monday 09:00`",
-            parse_mode='Markdown')
-        return
-    
-    day = args[1].lower()
-    time_str = args[2]
-    
-    # Проверка дня
-    valid_days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-    if day not in valid_days:
-        bot.reply_to(message, 
-            "❌ Неправильный день недели!",
-            parse_mode='Markdown')
-        return
-    
-    # Удаляем из расписания
-    if time_str in messages_storage['weekly_schedule'][day]:
-        del messages_storage['weekly_schedule'][day][time_str]
-        save_schedule(messages_storage)  # СОХРАНЯЕМ!
-        bot.reply_to(message, 
-            f"✅ Удалено!\n\n"
-            f"📅 День: {DAYS_NAME_RU[day]}\n"
-            f"⏰ Время: {time_str}",
-            parse_mode='Markdown')
-        logger.info(f"Удалено расписание: {day} {time_str}")
-    else:
-        bot.reply_to(message, 
-            "❌ Время не найдено для этого дня!",
-            parse_mode='Markdown')
+        result = page_callback(call)
+        if result is not None and call.message is not None:
+            try:
+                bot.edit_message_text(result.text, call.message.chat.id, call.message.message_id,
+                                      parse_mode=result.parse_mode, reply_markup=result.markup)
+            except telebot.apihelper.ApiTelegramException as e:
+                # нажали на текущую страницу — текст тот же
+                if 'message is not modified' not in e.description:
+                    raise
+    finally:
+        bot.answer_callback_query(call.id)
+        HANDLER_SECONDS.labels('page_callback').observe(time.perf_counter() - started)
 
 
-@bot.message_handler(commands=['show_week'])
-def show_week(message):
-    """Команда /show_week - Показать расписание на неделю"""
-    schedule_text = "📅 *РАСПИСАНИЕ НА НЕДЕЛЮ:*\n\n"
-    
-    has_schedule = False
-    for day_eng, day_ru in DAYS_NAME_RU.items():
-        day_schedule = messages_storage['weekly_schedule'][day_eng]
-        if day_schedule:
-            has_schedule = True
-            schedule_text += f"*📌 {day_ru}:*\n"
-            for time, text in sorted(day_schedule.items()):
-                schedule_text += f"   ⏰ {time} → {text}\n"
-            schedule_text += "\n"
-    
-    if not has_schedule:
-        schedule_text = "📅 *Расписание пусто!*\n\nДобавьте расписание с помощью `/add_schedule`"
-    
-    bot.reply_to(message, schedule_text, parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['clear_week'])
-def clear_week(message):
-    """Команда /clear_week - Очистить расписание"""
-    messages_storage['weekly_schedule'] = {
-        'monday': {},
-        'tuesday': {},
-        'wednesday': {},
-        'thursday': {},
-        'friday': {},
-        'saturday': {},
-        'sunday': {}
-    }
-    save_schedule(messages_storage)  # СОХРАНЯЕМ!
-    bot.reply_to(message, "✅ Расписание очищено!", parse_mode='Markdown')
-
-
-@bot.message_handler(func=lambda message: True)
-def handle_message(message):
-    """Обработка текстовых сообщений - только в личном чате"""
-    if message.chat.type != 'private':
-        return
-    
-    bot.reply_to(message, 
-        "👋 Привет! Используйте команду `/help` чтобы узнать доступные команды.",
-        parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['add_daily'])
-def add_daily(message):
-    """Команда /add_daily <Время> <Текст> - Добавить время для ежедневной отправки"""
-    args = message.text.split(maxsplit=2)
-    if len(args) < 3:
-        bot.reply_to(message,
-            "❌ Неправильный формат!\n\nИспользуйте: `/add_daily 09:00 Текст сообщения`",
-            parse_mode='Markdown')
-        return
-
-    time_str = args[1]
-    schedule_text = args[2]
-    try:
-        datetime.strptime(time_str, '%H:%M')
-    except ValueError:
-        bot.reply_to(message,
-            "❌ Неправильный формат времени!\n\nИспользуйте формат: `ЧЧ:МИН` (например: `09:00`)",
-            parse_mode='Markdown')
-        return
-
-    messages_storage.setdefault('daily_schedule', {})[time_str] = schedule_text
-    save_schedule(messages_storage)
-    bot.reply_to(message, f"✅ Ежедневная отправка добавлена: {time_str} → {schedule_text}", parse_mode='Markdown')
-    logger.info(f"Добавлено ежедневное расписание: {time_str} - {schedule_text}")
-
-
-@bot.message_handler(commands=['remove_daily'])
-def remove_daily(message):
-    """Команда /remove_daily <Время> - Удалить время из ежедневного расписания"""
-    args = message.text.split(maxsplit=1)
-    if len(args) < 2:
-        bot.reply_to(message,
-            "❌ Укажите время!\n\nПример: `/remove_daily 09:00`",
-            parse_mode='Markdown')
-        return
+bot.register_callback_query_handler(handle_callback, func=lambda call: True)
 
-    time_str = args[1]
-    daily = messages_storage.get('daily_schedule', {})
-    if time_str in daily:
-        del daily[time_str]
-        save_schedule(messages_storage)
-        bot.reply_to(message, f"✅ Ежедневная отправка {time_str} удалена.", parse_mode='Markdown')
-        logger.info(f"Удалено ежедневное время: {time_str}")
-    else:
-        bot.reply_to(message, "❌ Время не найдено в ежедневном расписании.", parse_mode='Markdown')
 
+def send_scheduled(key, schedule_text, slot_ts, zone):
+    """Ставит запись расписания в рассылку по группам пояса `zone`, когда подошло её время"""
+    broadcast = due_broadcast(key, schedule_text, zone, slot_ts)
+    if broadcast is not None:
+        deliver_scheduled(key, broadcast, slot_ts)
 
-@bot.message_handler(commands=['show_daily'])
-def show_daily(message):
-    """Показать ежедневное расписание"""
-    daily = messages_storage.get('daily_schedule', {})
-    if not daily:
-        bot.reply_to(message, "📅 Ежедневное расписание пусто.", parse_mode='Markdown')
-        return
 
-    text = "📅 *Ежедневное расписание:*\n\n"
-    for t, txt in sorted(daily.items()):
-        text += f"   ⏰ {t} → {txt}\n"
-    bot.reply_to(message, text, parse_mode='Markdown')
+def send_scheduled_batch(items):
+    """То же для всех записей, сработавших вместе: одно сообщение на группу и минуту"""
+    for key, slot_ts, broadcast in due_broadcasts(items):
+        deliver_scheduled(key, broadcast, slot_ts)
 
 
-@bot.message_handler(commands=['server_time'])
-def server_time(message):
-    """Показать текущее серверное время (полезно для проверки таймзоны)."""
-    now = datetime.now()
-    day = DAYS_NAME_RU[DAYS_RU[now.weekday()]]
-    bot.reply_to(message, f"🕒 Серверное время: {now.strftime('%Y-%m-%d %H:%M:%S')} ({day})", parse_mode='Markdown')
+def deliver_scheduled(key, broadcast, slot_ts):
+    """Ставит рассылку по расписанию в очередь; итог каждой доставки — в log_delivery"""
+    futures = [delivery.submit(group_id, broadcast.text_for(group_id), parse_mode=broadcast.parse_mode,
+                               media=broadcast.media)
+               for group_id in broadcast.groups]
+    for group_id, future in zip(broadcast.groups, futures):
+        future.add_done_callback(lambda f, g=group_id: log_delivery(key, g, broadcast, slot_ts, f))
 
 
 def scheduled_sender():
     """Функция для отправки сообщений по расписанию"""
-    global stop_scheduler
-    last_sent_times = set()  # Хранит уже отправленные времена
-    
-    while not stop_scheduler:
-        try:
-            group_id = messages_storage['group_id']
-            
-            # Получаем текущий день и время
-            now = datetime.now()
-            current_day = DAYS_RU[now.weekday()]
-            current_time = now.strftime('%H:%M')
-            
-            # ОТЛАДКА: Показываем текущее время в начале минуты
-            if now.second == 0:
-                logger.info(f"⏰ Проверка: {current_time} ({DAYS_NAME_RU[current_day]})")
-            
-            # Получаем расписание на сегодня
-            day_schedule = messages_storage['weekly_schedule'].get(current_day, {})
-            daily_schedule = messages_storage.get('daily_schedule', {})
-            one_off_today = messages_storage.get('one_off', {}).get(now.strftime('%Y-%m-%d'), {})
-            
-            # Проверяем все времена в расписании
-            if group_id is not None:
-                # Сначала проверяем недельное расписание
-                if day_schedule:
-                    for time_slot, schedule_text in day_schedule.items():
-                        send_key = f"{current_day}_{time_slot}"
-                        if time_slot == current_time and send_key not in last_sent_times:
-                            logger.info(f"✅ ОТПРАВКА (неделя) В {current_time}: {schedule_text}")
-                            try:
-                                bot.send_message(
-                                    chat_id=group_id,
-                                    text=f"🤖 *{schedule_text}*",
-                                    parse_mode='Markdown'
-                                )
-                                last_sent_times.add(send_key)
-                                logger.info(f"✅ УСПЕШНО ОТПРАВЛЕНО (неделя)!")
-                            except Exception as e:
-                                logger.error(f"❌ Ошибка при отправке (неделя): {e}")
-                        elif time_slot != current_time and send_key in last_sent_times:
-                            last_sent_times.discard(send_key)
-
-                # Затем ежедневное расписание (каждый день одинаково)
-                if daily_schedule:
-                    for time_slot, schedule_text in daily_schedule.items():
-                        send_key = f"daily_{time_slot}"
-                        if time_slot == current_time and send_key not in last_sent_times:
-                            logger.info(f"✅ ОТПРАВКА (ежедневно) В {current_time}: {schedule_text}")
-                            try:
-                                bot.send_message(
-                                    chat_id=group_id,
-                                    text=f"🤖 *{schedule_text}*",
-                                    parse_mode='Markdown'
-                                )
-                                last_sent_times.add(send_key)
-                                logger.info(f"✅ УСПЕШНО ОТПРАВЛЕНО (ежедневно)!")
-                            except Exception as e:
-                                logger.error(f"❌ Ошибка при отправке (ежедневно): {e}")
-                        elif time_slot != current_time and send_key in last_sent_times:
-                            last_sent_times.discard(send_key)
-
-                # Обработка одноразовых отправок на сегодня (независимо от ежедневного расписания)
-                if one_off_today:
-                    for time_slot, schedule_text in one_off_today.copy().items():
-                        send_key = f"oneoff_{now.strftime('%Y-%m-%d')}_{time_slot}"
-                        if time_slot == current_time and send_key not in last_sent_times:
-                            logger.info(f"✅ ОТПРАВКА (one-off) В {current_time}: {schedule_text}")
-                            try:
-                                bot.send_message(
-                                    chat_id=group_id,
-                                    text=f"🤖 *{schedule_text}*",
-                                    parse_mode='Markdown'
-                                )
-                                last_sent_times.add(send_key)
-                                # удаляем одноразовую запись после отправки
-                                try:
-                                    del messages_storage['one_off'][now.strftime('%Y-%m-%d')][time_slot]
-                                except Exception:
-                                    pass
-                                save_schedule(messages_storage)
-                                logger.info(f"✅ УСПЕШНО ОТПРАВЛЕНО (one-off)!")
-                            except Exception as e:
-                                logger.error(f"❌ Ошибка при отправке (one-off): {e}")
-                        elif time_slot != current_time and send_key in last_sent_times:
-                            last_sent_times.discard(send_key)
-        
-        except Exception as e:
-            logger.error(f"❌ Ошибка в scheduled_sender: {e}")
-        
-        time.sleep(1)
+    if COALESCE_SAME_MINUTE:
+        scheduler.run(send_scheduled_batch, batch=True)
+    else:
+        scheduler.run(send_scheduled)
+
+
+def schedule_changed(_) -> None:
+    """Другой шард изменил расписание или группы"""
+    store.refresh()
+    scheduler.reschedule()
+
+
+def start_shard() -> None:
+    """Подключается к остальным шардам и ждёт от shard.py их состав"""
+    global node
+    from shard import ShardNode
+
+    node = ShardNode(SHARD_INDEX, SHARDS, RUN_DIR, SHARD_AUTHKEY)
+    node.on('update', dispatcher.submit)
+    node.on('changed', schedule_changed)
+    # группы переехали: могли поменяться и пояса, которые нужны планировщику
+    node.on('rebalance', lambda members: scheduler.reschedule())
+    handlers.shard = node
+    node.start()
+    logger.info(f"⏳ Шард {SHARD_INDEX} из {SHARDS}: ждём состав шардов...")
+    node.ready.wait()
+
+
+def run_webhook() -> None:
+    """Приём обновлений через встроенный HTTP-сервер вместо polling"""
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = WebhookServer(
+        bot.process_new_updates,
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret=secret,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        workers=WEBHOOK_WORKERS,
+        stats=update_stats,
+    )
+    update_queue.fn = lambda: server.queue_depth() + dispatcher.depth()
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=secret,
+                        max_connections=WEBHOOK_WORKERS)
+    try:
+        server.serve_forever()
+    finally:
+        server.shutdown()
 
 
 def main() -> None:
     """Основная функция"""
-    global stop_scheduler
-    
+    if METRICS_PORT:
+        # у каждого шарда свой порт: METRICS_PORT + номер шарда
+        metrics.serve(METRICS_HOST, METRICS_PORT + SHARD_INDEX)
+
+    if SHARDS > 1:
+        start_shard()
+
     # Запускаем планировщик в отдельном потоке
     scheduler_thread = Thread(target=scheduled_sender, daemon=True)
     scheduler_thread.start()
     
-    # Запускаем бота
-    logger.info("🚀 Бот запущен...")
+    # SIGTERM (так останавливает процесс Heroku) — как Ctrl+C
+    signal.signal(signal.SIGTERM, _interrupt)
     try:
-        bot.infinity_polling()
+        if node is not None:
+            # обновления от Telegram получает только ведущий шард
+            node.wait_leadership()
+        # Запускаем бота
+        logger.info(f"🚀 Бот запущен ({RUN_MODE})...")
+        if RUN_MODE == 'webhook':
+            run_webhook()
+        else:
+            # Ctrl+C polling перехватывает сам и просто возвращается
+            bot.infinity_polling()
     except KeyboardInterrupt:
-        logger.info("Бот остановлен")
-        stop_scheduler = True
+        pass
+    finally:
+        shutdown()
+
+
+def _interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def shutdown() -> None:
+    """Дорабатывает принятое, сохраняет отметку планировщика и дописывает хранилище"""
+    # второй сигнал не должен оборвать сохранение
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logger.info("Бот остановлен")
+    update_stats.log()
+    dispatcher.shutdown()
+    scheduler.stop()
+    delivery.shutdown()
+    if node is not None:
+        node.close()
+    store.close()
 
 
 if __name__ == '__main__':
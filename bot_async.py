@@ -0,0 +1,207 @@
+"""Запуск бота на asyncio: `python bot_async.py`.
+
+Команды те же, что и в bot.py (см. handlers.py), но обновления,
+планировщик и рассылка работают в одном цикле событий без потоков.
+"""
+import asyncio
+import logging
+import signal
+import time
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from config import (BOT_TOKEN, CHAT_BURST, CHAT_RATE_PER_MIN, COALESCE_SAME_MINUTE, DELIVERY_WORKERS,
+                    FILE_ID_CACHE_SIZE, GLOBAL_RATE_PER_SEC, MEDIA_DIR, METRICS_HOST, METRICS_PORT, RETRY_BASE_DELAY,
+                    RETRY_MAX_ATTEMPTS, RETRY_MAX_DELAY, store)
+import bulk
+import handlers
+import metrics
+from delivery import AsyncDeliveryEngine, RetryPolicy
+from media import AsyncMediaSender, FileIdCache
+from handlers import (HANDLER_SECONDS, Broadcast, Document, Download, Resend, due_broadcast,
+                      due_broadcasts, log_delivery, page_callback, remember_chat, router, scheduler)
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Создаём бота
+bot = AsyncTeleBot(BOT_TOKEN)
+
+# Текст или вложение; загруженные файлы отправляются повторно по file_id
+sender = AsyncMediaSender(bot, FileIdCache(store, limit=FILE_ID_CACHE_SIZE), MEDIA_DIR)
+
+# Рассылка через задачи asyncio с теми же лимитами, что и в bot.py
+delivery = AsyncDeliveryEngine(
+    sender.send,
+    workers=DELIVERY_WORKERS,
+    global_rate=GLOBAL_RATE_PER_SEC,
+    chat_per_minute=CHAT_RATE_PER_MIN,
+    chat_burst=CHAT_BURST,
+    retry=RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY),
+)
+
+
+async def execute(message, result):
+    """Выполняет то, что вернул обработчик команды"""
+    if result is None:
+        return
+
+    if isinstance(result, Download):
+        result = await read_document(result)
+
+    if isinstance(result, Document):
+        # выгрузка читает хранилище и пишет файл — не в цикле событий
+        with await asyncio.to_thread(bulk.spool, result.write) as f:
+            await bot.send_document(message.chat.id, f, visible_file_name=result.file_name, caption=result.caption)
+        return
+
+    if isinstance(result, Resend):
+        results = await asyncio.gather(
+            *(delivery.submit(letter['chat_id'], letter['text'], parse_mode=letter['parse_mode'],
+                              media=letter.get('media'))
+              for letter in result.letters),
+            return_exceptions=True)
+        # неотправленное снова ложится в недоставленные (store.update) — в потоке
+        result = await asyncio.to_thread(result.report, [r if isinstance(r, Exception) else None for r in results])
+
+    if isinstance(result, Broadcast):
+        results = await asyncio.gather(
+            *delivery.broadcast(result.groups, result.text, parse_mode=result.parse_mode, media=result.media),
+            return_exceptions=True)
+        if result.report is None:
+            return
+        result = result.report([r for r in results if isinstance(r, Exception)])
+
+    if result.quote:
+        await bot.reply_to(message, result.text, parse_mode=result.parse_mode, reply_markup=result.markup)
+    else:
+        await bot.send_message(chat_id=message.chat.id, text=result.text, parse_mode=result.parse_mode,
+                               reply_markup=result.markup)
+
+
+async def read_document(download):
+    """Скачивает документ потоком и отдаёт его обработчику (в отдельном потоке)"""
+    try:
+        file = await bot.get_file(download.file_id)
+
+        def read():
+            with bulk.open_document(BOT_TOKEN, file.file_path, asyncio_helper.FILE_URL) as stream:
+                return download.then(stream)
+
+        return await asyncio.to_thread(read)
+    except Exception as e:
+        logger.error(f"❌ Не удалось прочитать файл {download.file_id}: {e}")
+        return handlers.Reply(f"❌ Не удалось скачать файл: {e}", parse_mode=None)
+
+
+async def handle_command(message):
+    """Единственный обработчик сообщений: обработчик команды берётся из router"""
+    remember_chat(message.chat)
+    handler, args = router.resolve(message)
+    if handler is None:
+        return
+    started = time.perf_counter()
+    try:
+        await execute(message, handler(message, args))
+    finally:
+        HANDLER_SECONDS.labels(handler.__name__).observe(time.perf_counter() - started)
+
+
+bot.register_message_handler(handle_command, content_types=['text', 'document'], func=lambda message: True)
+
+
+async def handle_callback(call):
+    """Нажатие inline-кнопки (листание страниц): меняем текст сообщения с кнопками"""
+    started = time.perf_counter()
+    try:
+        result = page_callback(call)
+        if result is not None and call.message is not None:
+            try:
+                await bot.edit_message_text(result.text, call.message.chat.id, call.message.message_id,
+                                            parse_mode=result.parse_mode, reply_markup=result.markup)
+            except asyncio_helper.ApiTelegramException as e:
+                # нажали на текущую страницу — текст тот же
+                if 'message is not modified' not in e.description:
+                    raise
+    finally:
+        await bot.answer_callback_query(call.id)
+        HANDLER_SECONDS.labels('page_callback').observe(time.perf_counter() - started)
+
+
+bot.register_callback_query_handler(handle_callback, func=lambda call: True)
+
+
+def send_scheduled(key, schedule_text, slot_ts, zone):
+    """Ставит запись расписания в рассылку; вызывается из задачи планировщика"""
+    broadcast = due_broadcast(key, schedule_text, zone, slot_ts)
+    if broadcast is not None:
+        deliver_scheduled(key, broadcast, slot_ts)
+
+
+def send_scheduled_batch(items):
+    """То же для всех записей, сработавших вместе: одно сообщение на группу и минуту"""
+    for key, slot_ts, broadcast in due_broadcasts(items):
+        deliver_scheduled(key, broadcast, slot_ts)
+
+
+def deliver_scheduled(key, broadcast, slot_ts):
+    """Ставит рассылку по расписанию в очередь; итог каждой доставки — в log_delivery"""
+    tasks = [delivery.submit(group_id, broadcast.text_for(group_id), parse_mode=broadcast.parse_mode,
+                             media=broadcast.media)
+             for group_id in broadcast.groups]
+    for group_id, task in zip(broadcast.groups, tasks):
+        task.add_done_callback(lambda t, g=group_id: log_in_thread(key, g, broadcast, slot_ts, t))
+
+
+# log_delivery, ещё не дописавшие недоставленное; их ждут перед закрытием хранилища
+logging_tasks = set()
+
+
+def log_in_thread(*args):
+    """log_delivery в потоке: недоставленное пишется в хранилище через store.update"""
+    task = asyncio.ensure_future(asyncio.to_thread(log_delivery, *args))
+    logging_tasks.add(task)
+    task.add_done_callback(logging_tasks.discard)
+
+
+async def run() -> None:
+    """Цикл событий: опрос обновлений и задача планировщика"""
+    if METRICS_PORT:
+        metrics.serve(METRICS_HOST, METRICS_PORT)
+    if COALESCE_SAME_MINUTE:
+        scheduler_task = asyncio.create_task(scheduler.run_async(send_scheduled_batch, batch=True))
+    else:
+        scheduler_task = asyncio.create_task(scheduler.run_async(send_scheduled))
+    # SIGTERM (так останавливает процесс Heroku) — как Ctrl+C: отмена
+    # задачи останавливает polling, и ниже всё дописывается
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    logger.info("🚀 Бот запущен (asyncio)...")
+    try:
+        await bot.infinity_polling()
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        logger.info("Бот остановлен")
+        scheduler.stop()
+        await scheduler_task
+        await delivery.shutdown()
+        await asyncio.gather(*logging_tasks)
+        await bot.close_session()
+        store.close()
+
+
+def main() -> None:
+    """Основная функция"""
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
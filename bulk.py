@@ -0,0 +1,272 @@
+"""Массовый импорт и экспорт расписания (/import, /export).
+
+Файл — CSV с колонками kind, when, text или JSON (массив объектов с теми
+же полями либо по объекту в строке):
+
+    kind,when,text
+    weekly,monday 09:00,Доброе утро!
+    daily,12:00,Обед
+    one_off,2026-10-20 18:00,Собрание
+    rule,0 9 * * 1-5,По будням
+
+Файл читается потоком, кусками по CHUNK_SIZE символов: в памяти только
+сами записи, не весь документ. Каждая строка проверяется так же, как в
+командах /add_*; ошибки собираются в одну сводку. Применяется импорт
+только целиком — одной записью в хранилище (`store.batch`), после
+которой индекс планировщика пересобирается один раз.
+"""
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+from typing import NamedTuple
+
+import requests
+from telebot import apihelper
+
+import media
+import recurrence
+import templates
+from schedule_index import WEEKDAYS
+
+FIELDS = ('kind', 'when', 'text')
+KINDS = ('weekly', 'daily', 'one_off', 'rule')
+# Русские названия дней тоже принимаются
+DAY_ALIASES = dict(zip(('понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье'),
+                       WEEKDAYS))
+CHUNK_SIZE = 64 * 1024
+# Запись JSON длиннее этого не бывает (текст сообщения — до 4096 символов):
+# дальше не дочитываем, а считаем файл испорченным
+MAX_ITEM_SIZE = 1024 * 1024
+# Больше Bot API не отдаёт через getFile
+DOWNLOAD_LIMIT = 20 * 1024 * 1024
+# Сколько ошибок показывать в сводке
+MAX_ERRORS = 20
+# Выгрузка больше этого пишется во временный файл на диске
+SPOOL_SIZE = 1024 * 1024
+
+FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+
+
+class ImportResult(NamedTuple):
+    """Итог разбора: записи {ключ: текст}, число строк, ошибки [(строка, описание)]."""
+    entries: dict
+    rows: int
+    errors: list
+    error_count: int
+
+
+def parse_key(kind: str, when: str, now: datetime) -> tuple:
+    """Ключ записи расписания из полей kind/when; ValueError, если они неверны."""
+    kind, when = str(kind or '').strip().lower(), ' '.join(str(when or '').split())
+    if kind == 'rule':
+        spec = recurrence.normalize(when, now)
+        recurrence.parse(spec)
+        return ('rule', spec)
+    if kind not in KINDS:
+        raise ValueError(f"неизвестный вид записи {kind!r}, допустимы: {', '.join(KINDS)}")
+
+    *head, time_str = when.split(' ') if when else ['']
+    time_str = _time(time_str)
+    if kind == 'daily' and not head:
+        return ('daily', time_str)
+    if kind == 'weekly' and len(head) == 1:
+        day = DAY_ALIASES.get(head[0].lower(), head[0].lower())
+        if day not in WEEKDAYS:
+            raise ValueError(f"неизвестный день недели {head[0]!r}")
+        return ('weekly', day, time_str)
+    if kind == 'one_off' and len(head) == 1:
+        return ('one_off', datetime.strptime(head[0], '%Y-%m-%d').strftime('%Y-%m-%d'), time_str)
+    raise ValueError(f"неверное поле when {when!r} для {kind}")
+
+
+def _time(value: str) -> str:
+    try:
+        return datetime.strptime(value, '%H:%M').strftime('%H:%M')
+    except ValueError:
+        raise ValueError(f"неверное время {value!r}, нужно ЧЧ:ММ") from None
+
+
+def key_when(key: tuple) -> tuple:
+    """(kind, when) для записи в файл — обратное к `parse_key`."""
+    return key[0], ' '.join(key[1:])
+
+
+def check_text(text: str, media_dir: str):
+    """Описание ошибки в тексте записи или None."""
+    if not text or not text.strip():
+        return "пустой текст"
+    error = media.check(text, media_dir)
+    if error is not None:
+        return error
+    try:
+        templates.compile_template(media.split(text)[1], strict=True)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def _chunks(stream, first: str = ''):
+    if first:
+        yield first
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _lines(chunks):
+    """Строки из потока кусков (с переводами строк, как у файла)."""
+    tail = ''
+    for chunk in chunks:
+        *lines, tail = (tail + chunk).split('\n')
+        for line in lines:
+            yield line + '\n'
+    if tail:
+        yield tail
+
+
+def _json_array(chunks):
+    """Объекты JSON-массива по одному, без чтения всего массива в память.
+
+    Не разбирающийся кусок дочитывается, пока не превысит MAX_ITEM_SIZE.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, started, count = '', 0, False, 0
+    chunks = iter(chunks)
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if not started and pos < len(buffer):
+            if buffer[pos] != '[':
+                raise ValueError("ожидался JSON-массив")
+            started, pos = True, pos + 1
+            continue
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            if len(buffer) - pos > MAX_ITEM_SIZE:
+                raise ValueError(f"JSON с ошибкой около записи {count + 1}: {e.msg}") from None
+            chunk = next(chunks, None)
+            if chunk is None:
+                if buffer[pos:].strip():
+                    raise ValueError("JSON оборван или с ошибкой") from None
+                return
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        count += 1
+        yield item
+        pos = end
+
+
+def read_rows(stream):
+    """(номер строки, {kind, when, text}) из CSV, JSON-массива или JSON Lines.
+
+    Формат определяется по первому непробельному символу: '[' — массив,
+    '{' — по объекту в строке, иначе CSV с заголовком. Вместо словаря
+    может прийти строка — описание ошибки в этой строке файла.
+    """
+    first = stream.read(CHUNK_SIZE).lstrip('\ufeff')
+    head = first.lstrip()[:1]
+    chunks = _chunks(stream, first)
+    if head == '[':
+        for number, item in enumerate(_json_array(chunks), 1):
+            yield number, item if isinstance(item, dict) else "ожидался объект"
+    elif head == '{':
+        for number, line in enumerate(_lines(chunks), 1):
+            if line.strip():
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError as e:
+                    item = f"неверный JSON: {e.msg}"
+                yield number, item if isinstance(item, (dict, str)) else "ожидался объект"
+    else:
+        reader = csv.DictReader(_lines(chunks))
+        try:
+            missing = [name for name in FIELDS if name not in (reader.fieldnames or ())]
+            if missing:
+                raise ValueError(f"в заголовке CSV нет колонок: {', '.join(missing)}")
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as e:
+            raise ValueError(f"ошибка CSV в строке {reader.line_num}: {e}") from None
+
+
+def load(stream, now: datetime, media_dir: str, limit: int) -> ImportResult:
+    """Разбирает и проверяет файл; повтор ключа заменяет прежний текст.
+
+    Больше `limit` строк или нечитаемый файл — ValueError (импорт
+    целиком отклоняется; UnicodeDecodeError — тоже ValueError).
+    """
+    entries, errors, error_count, rows = {}, [], 0, 0
+    for number, row in read_rows(stream):
+        rows += 1
+        if rows > limit:
+            raise ValueError(f"в файле больше {limit} записей")
+        error = row if isinstance(row, str) else None
+        if error is None:
+            try:
+                key = parse_key(row.get('kind'), row.get('when'), now)
+                text = row.get('text')
+                error = check_text(text, media_dir) if isinstance(text, str) else "нет поля text"
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            error_count += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append((number, error))
+            continue
+        entries[key] = text
+    return ImportResult(entries, rows, errors, error_count)
+
+
+def export(store, out, fmt: str = 'csv') -> int:
+    """Пишет все записи расписания в текстовый поток `out`; возвращает их число."""
+    writer = csv.writer(out) if fmt == 'csv' else None
+    if writer is not None:
+        writer.writerow(FIELDS)
+    count = 0
+    for key in store.entries():
+        text = store.text(key)
+        if text is None:
+            continue
+        kind, when = key_when(key)
+        if writer is not None:
+            writer.writerow((kind, when, text))
+        else:
+            out.write(json.dumps({'kind': kind, 'when': when, 'text': text}, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def spool(write):
+    """Временный файл с тем, что `write(out)` написал в текстовый поток;
+    возвращается бинарным, открытым с начала (для send_document)."""
+    f = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    out = io.TextIOWrapper(f, encoding='utf-8', newline='')
+    write(out)
+    out.flush()
+    out.detach()
+    f.seek(0)
+    return f
+
+
+def open_document(token: str, file_path: str, file_url: str = None):
+    """Документ из Telegram текстовым потоком (скачивается по мере чтения).
+
+    `file_url` — шаблон адреса (asyncio_helper.FILE_URL); по умолчанию —
+    как у telebot.apihelper.
+    """
+    url = (file_url or apihelper.FILE_URL or FILE_URL).format(token, file_path)
+    response = requests.get(url, stream=True, proxies=apihelper.proxy, timeout=60)
+    if response.status_code != 200:
+        response.close()
+        raise apihelper.ApiHTTPException('Download file', response)
+    response.raw.decode_content = True
+    # иначе urllib3 закрывает поток на последнем куске и TextIOWrapper падает
+    response.raw.auto_close = False
+    return io.TextIOWrapper(response.raw, encoding='utf-8-sig', newline='')
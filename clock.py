@@ -0,0 +1,37 @@
+"""Источник текущего времени для планировщика и команд.
+
+По умолчанию — системные часы. `VirtualClock` двигается только вручную:
+с ним планировщик можно прогнать по любому отрезку дат без ожидания
+(см. replay.py).
+"""
+import time
+from datetime import datetime
+
+
+class SystemClock:
+    """Настоящее время процесса."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+
+class VirtualClock:
+    """Часы, которые стоят, пока их не сдвинут `advance()` или `set()`."""
+
+    def __init__(self, start):
+        self._ts = start.timestamp() if isinstance(start, datetime) else float(start)
+
+    def time(self) -> float:
+        return self._ts
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self._ts)
+
+    def set(self, when) -> None:
+        self._ts = when.timestamp() if isinstance(when, datetime) else float(when)
+
+    def advance(self, seconds: float) -> None:
+        self._ts += seconds
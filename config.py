@@ -1,23 +1,118 @@
+import atexit
+import logging
 import os
-import json
 from dotenv import load_dotenv
 
+from storage import JournalStore
+from storage_sqlite import SQLiteStore
+
 load_dotenv()
 
 # Токен бота
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 
+# Каталог с файлами расписания (по умолчанию — рядом с ботом)
+DATA_DIR = os.getenv('DATA_DIR', os.path.dirname(__file__))
+
+# Где хранить расписание: 'json' (снимок + журнал) или 'sqlite'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+# Окно (сек), за которое изменения собираются в одну фоновую запись на диск
+PERSIST_WINDOW = float(os.getenv('PERSIST_WINDOW', '0.5'))
+SQLITE_FILE = os.path.join(DATA_DIR, 'schedule.db')
+
 # Файл для хранения расписания
-SCHEDULE_FILE = os.path.join(os.path.dirname(__file__), 'schedule_data.json')
+SCHEDULE_FILE = os.path.join(DATA_DIR, 'schedule_data.json')
+
+# Журнал изменений расписания (дописывается, сжимается в SCHEDULE_FILE)
+JOURNAL_FILE = os.path.join(DATA_DIR, 'schedule_data.journal')
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '1000'))
+
+# Работа несколькими процессами (shard.py): число шардов; SHARD_INDEX и
+# SHARD_AUTHKEY задаёт надзиратель. Шарды делят одну базу, поэтому нужен sqlite
+SHARDS = int(os.getenv('SHARDS', '1'))
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', '0'))
+SHARD_AUTHKEY = bytes.fromhex(os.getenv('SHARD_AUTHKEY', ''))
+# Сокеты шардов и блокировка ведущего
+RUN_DIR = os.getenv('RUN_DIR', os.path.join(DATA_DIR, 'run'))
+if SHARDS > 1 and STORAGE_BACKEND != 'sqlite':
+    raise ValueError("SHARDS > 1 работает только с STORAGE_BACKEND=sqlite")
+
+# Обработка обновлений: число очередей по чатам, их размер и что делать при
+# переполнении — 'block', 'drop_new' или 'drop_oldest' (см. dispatcher.py)
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '8'))
+DISPATCH_QUEUE_SIZE = int(os.getenv('DISPATCH_QUEUE_SIZE', '100'))
+DISPATCH_OVERLOAD = os.getenv('DISPATCH_OVERLOAD', 'block')
+
+# Рассылка: размер пула отправки и лимиты Telegram
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', '8'))
+GLOBAL_RATE_PER_SEC = float(os.getenv('GLOBAL_RATE_PER_SEC', '30'))
+CHAT_RATE_PER_MIN = float(os.getenv('CHAT_RATE_PER_MIN', '20'))
+CHAT_BURST = float(os.getenv('CHAT_BURST', '3'))
+
+# Каталог с файлами для вложений (photo:имя.jpg в тексте, см. media.py) и
+# сколько file_id загруженных файлов помнить
+MEDIA_DIR = os.getenv('MEDIA_DIR', os.path.join(DATA_DIR, 'media'))
+FILE_ID_CACHE_SIZE = int(os.getenv('FILE_ID_CACHE_SIZE', '1000'))
+
+# Повторы неудачных отправок (429, 5xx, сетевые ошибки) и очередь недоставленных
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '5'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '1'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '60'))
+DEAD_LETTER_LIMIT = int(os.getenv('DEAD_LETTER_LIMIT', '500'))
+
+# Сколько записей можно загрузить одним файлом /import
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', '100000'))
 
-# Хранилище данных о сообщениях (всё в памяти, как раньше)
+# Часовой пояс IANA для групп, у которых не задан свой (/set_timezone);
+# пусто — локальное время сервера
+TIMEZONE = os.getenv('TIMEZONE', '')
+
+# 1 — записи, сработавшие в одну минуту, уходят в группу одним сообщением
+# (одинаковые тексты — один раз), а не каждая отдельно
+COALESCE_SAME_MINUTE = os.getenv('COALESCE_SAME_MINUTE', '0') == '1'
+
+# Пропущенные срабатывания (бот не работал или завис): 'all', 'latest' или 'skip'
+MISFIRE_POLICY = os.getenv('MISFIRE_POLICY', 'latest')
+# Срабатывания старше стольких секунд не догоняем
+MISFIRE_GRACE = float(os.getenv('MISFIRE_GRACE', '3600'))
+# Как часто сохранять момент, до которого расписание обработано
+SCHEDULER_CHECKPOINT = float(os.getenv('SCHEDULER_CHECKPOINT', '60'))
+
+# Как получать обновления: 'polling' или 'webhook' (встроенный HTTP-сервер, webhook.py)
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+# Публичный адрес для setWebhook; пусто — вебхук уже зарегистрирован снаружи
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', '8443')))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Значение заголовка X-Telegram-Bot-Api-Secret-Token; пусто — сгенерируется при запуске
+# (только вместе с WEBHOOK_URL: иначе Telegram этот секрет не узнает)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+if RUN_MODE == 'webhook' and not WEBHOOK_URL and not WEBHOOK_SECRET:
+    raise ValueError("RUN_MODE=webhook без WEBHOOK_URL требует WEBHOOK_SECRET — "
+                     "тот же secret_token, с которым вебхук зарегистрирован снаружи")
+# Очередь принятых обновлений и число потоков, которые их обрабатывают
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics; 0 — не запускать
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Значения по умолчанию: ими заполняется хранилище при первом запуске
 messages_storage = {
     'scheduled_text': 'Ваше первое сообщение',
     'scheduled_time': '09:00',
     'send_message_text': 'Стандартное сообщение',
     'group_id': None,
+    'groups': [],
+    'group_timezones': {},
+    'dead_letters': {'next_id': 1, 'letters': []},
+    'file_ids': {},
+    'group_titles': {},
     'daily_schedule': {},
     'one_off': {},
+    'rule_schedule': {},
     'weekly_schedule': {
         'monday': {
             '09:00': 'Доброе утро!',
@@ -58,45 +153,33 @@ messages_storage = {
 }
 
 
-def load_schedule(defaults: dict) -> dict:
-    """Пытается загрузить `schedule_data.json`, возвращает объединённый словарь."""
+def load_schedule(defaults: dict) -> None:
+    """Открывает хранилище расписания.
+
+    JSON: снимок `schedule_data.json` + проигрывание журнала изменений.
+    SQLite: пустая база заполняется значениями по умолчанию.
+    """
     try:
-        if os.path.exists(SCHEDULE_FILE):
-            with open(SCHEDULE_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Объединяем: значения из файла заменяют дефолтные
-                merged = defaults.copy()
-                merged.update(data)
-                # Убедимся, что все ключи существуют
-                for k, v in defaults.items():
-                    if k not in merged:
-                        merged[k] = v
-                return merged
+        store.load(defaults)
     except Exception:
-        # При ошибке чтения возвращаем дефолты
-        pass
+        # При ошибке чтения работаем с дефолтами
+        logging.getLogger(__name__).exception("❌ Не удалось загрузить расписание")
 
-    return defaults
+    # Старый формат: одна группа в group_id
+    if not store.get('groups') and store.get('group_id') is not None:
+        store.set('groups', [store.get('group_id')])
 
 
-def save_schedule(data: dict) -> None:
-    """Сохраняет текущее расписание в `schedule_data.json`."""
-    try:
-        # Сохраняем только нужные ключи (чтобы не писать секреты и лишние объекты)
-        to_save = {
-            'scheduled_text': data.get('scheduled_text'),
-            'scheduled_time': data.get('scheduled_time'),
-            'send_message_text': data.get('send_message_text'),
-            'group_id': data.get('group_id'),
-            'daily_schedule': data.get('daily_schedule', {}),
-            'weekly_schedule': data.get('weekly_schedule', {})
-        }
-        with open(SCHEDULE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(to_save, f, ensure_ascii=False, indent=2)
-    except Exception:
-        # Не фейлим исполнение бота при ошибке записи
-        pass
+# Хранилище расписания: снимок + журнал (storage.py) или SQLite (storage_sqlite.py)
+if STORAGE_BACKEND == 'sqlite':
+    store = SQLiteStore(SQLITE_FILE, window=PERSIST_WINDOW)
+else:
+    store = JournalStore(SCHEDULE_FILE, JOURNAL_FILE,
+                         window=PERSIST_WINDOW,
+                         compact_every=JOURNAL_COMPACT_EVERY)
 
+# Несохранённые изменения дописываются при любом завершении процесса
+atexit.register(store.close)
 
-# Попробуем загрузить сохранённые данные (если есть), иначе используем текущие defaults
-messages_storage = load_schedule(messages_storage)
+# Загружаем сохранённые данные (если есть), иначе используем defaults
+load_schedule(messages_storage)
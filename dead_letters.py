@@ -0,0 +1,76 @@
+"""Очередь недоставленных сообщений (dead letters).
+
+Сюда попадают отправки по расписанию, которые не удалось доставить даже
+после повторов (или с ошибкой, после которой повтор бесполезен: 400, 403).
+Список хранится в том же хранилище, что и расписание (настройка
+'dead_letters': {'next_id': ..., 'letters': [...]}), поэтому переживает
+перезапуск. Счётчик id лежит там же и только растёт: номер, разобранный
+через /replay_dead, не достанется новому сообщению. Команды /dead_letters
+и /replay_dead показывают и переотправляют список.
+
+Копии списка в памяти нет: он каждый раз читается из хранилища, а
+меняется через `store.update` (чтение и запись одной транзакцией), так что
+шарды с общей базой видят и не затирают сообщения друг друга.
+"""
+from datetime import datetime
+
+
+def _unpack(stored) -> tuple:
+    """(next_id, letters) из настройки; старый формат — просто список."""
+    if isinstance(stored, dict):
+        letters = list(stored.get('letters') or [])
+        return stored.get('next_id') or 1, letters
+    letters = list(stored or [])
+    return max((letter['id'] for letter in letters), default=0) + 1, letters
+
+
+class DeadLetters:
+    """Недоставленные сообщения; не больше `limit`, старые вытесняются."""
+
+    def __init__(self, store, limit: int = 500):
+        self._store = store
+        self.limit = limit
+
+    def __len__(self) -> int:
+        return len(self.list())
+
+    def add(self, chat_id, text: str, parse_mode=None, error=None, kind=None, media=None) -> dict:
+        """Кладёт сообщение в очередь и возвращает запись о нём.
+
+        `media` — ссылка на вложение ('photo:poster.jpg', см. media.py).
+        """
+        letter = {
+            'id': None,
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': parse_mode,
+            'media': media,
+            'kind': kind,
+            'error': str(error) if error is not None else None,
+            'failed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+        def append(stored):
+            next_id, letters = _unpack(stored)
+            letter['id'] = next_id
+            return {'next_id': next_id + 1, 'letters': (letters + [letter])[-self.limit:]}
+
+        self._store.update('dead_letters', append)
+        return letter
+
+    def list(self) -> list:
+        return _unpack(self._store.get('dead_letters'))[1]
+
+    def take(self, ids=None) -> list:
+        """Убирает из очереди и возвращает сообщения с `ids` (все, если None)."""
+        ids = None if ids is None else set(ids)
+        taken = []
+
+        def remove(stored):
+            next_id, letters = _unpack(stored)
+            taken.extend(letter for letter in letters if ids is None or letter['id'] in ids)
+            return {'next_id': next_id,
+                    'letters': [letter for letter in letters if ids is not None and letter['id'] not in ids]}
+
+        self._store.update('dead_letters', remove)
+        return taken
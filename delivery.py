@@ -0,0 +1,342 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SEND_SECONDS = Histogram('telegram_send_seconds', 'Длительность одного запроса send_message')
+SEND_ERRORS = Counter('telegram_send_errors_total', 'Ошибки send_message по виду', labels=('kind',))
+SEND_RETRIES = Counter('telegram_send_retries_total', 'Повторные попытки отправки')
+
+# Ошибки сети, после которых отправку стоит повторить
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+
+def classify_error(error: Exception) -> tuple:
+    """('retry', retry_after) — временная ошибка, ('fatal', None) — повтор бесполезен.
+
+    429 — Telegram сам говорит, сколько ждать (parameters.retry_after);
+    5xx и сетевые ошибки — временные; прочие коды (400, 403, ...) — нет.
+    Работает и с исключениями telebot.apihelper, и с telebot.asyncio_helper.
+    """
+    code = getattr(error, 'error_code', None)
+    if code is None:
+        # ApiHTTPException: ответ не JSON, код берём из HTTP-ответа
+        result = getattr(error, 'result', None)
+        code = getattr(result, 'status_code', None) or getattr(result, 'status', None)
+    if code == 429:
+        parameters = (getattr(error, 'result_json', None) or {}).get('parameters') or {}
+        return 'retry', parameters.get('retry_after')
+    if code is not None:
+        return ('retry', None) if code >= 500 else ('fatal', None)
+    # RequestTimeout из asyncio_helper импортировать без aiohttp нельзя
+    if isinstance(error, TRANSIENT_ERRORS) or type(error).__name__ == 'RequestTimeout':
+        return 'retry', None
+    return 'fatal', None
+
+
+def error_kind(error: Exception) -> str:
+    """Метка ошибки для метрик: код Telegram/HTTP, 'network' или 'other'."""
+    code = getattr(error, 'error_code', None)
+    if code is None:
+        result = getattr(error, 'result', None)
+        code = getattr(result, 'status_code', None) or getattr(result, 'status', None)
+    if code is not None:
+        return str(code)
+    if isinstance(error, TRANSIENT_ERRORS) or type(error).__name__ == 'RequestTimeout':
+        return 'network'
+    return 'other'
+
+
+class RetryPolicy:
+    """Когда повторять неудачную отправку.
+
+    На 429 ждём столько, сколько попросил Telegram, на временные ошибки —
+    экспоненциальная задержка со случайным разбросом (full jitter), чтобы
+    повторы от многих чатов не приходили одной волной.
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, error: Exception, attempt: int):
+        """Пауза перед следующей попыткой после `attempt` неудачных, None — сдаёмся."""
+        if attempt >= self.max_attempts:
+            return None
+        kind, retry_after = classify_error(error)
+        if kind == 'fatal':
+            return None
+        if retry_after is not None:
+            return float(retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    """Ведро токенов: `rate` токенов в секунду, не больше `capacity` про запас."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать появления токена (0 — токен есть)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (1 - self._tokens) / self.rate)
+
+    def reserve(self) -> float:
+        """Забирает токен (в долг, если нужно) и возвращает время ожидания."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class DeliveryEngine:
+    """Отправка сообщений в группы с учётом лимитов Telegram.
+
+    Общий лимит (~30 сообщений/с) и лимит на чат (~20 сообщений/мин)
+    соблюдает поток-диспетчер: он выбирает чат, у которого готов токен,
+    и передаёт отправку в ограниченный пул рабочих потоков. У чата в
+    отправке всегда не больше одного сообщения, поэтому порядок внутри
+    чата сохраняется.
+
+    Неудачная отправка по `retry` возвращается в начало очереди своего
+    чата с задержкой: поток не спит, остальные чаты отправляются дальше.
+    """
+
+    def __init__(self, send, workers: int = 8, global_rate: float = 30,
+                 chat_per_minute: float = 20, chat_burst: float = 3,
+                 retry: RetryPolicy = None):
+        self._send = send  # send(chat_id, text, **kwargs)
+        self._retry = retry
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='delivery')
+        self._slots = threading.BoundedSemaphore(workers)
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_per_minute / 60
+        self._chat_burst = chat_burst
+        self._chats = {}    # chat_id -> TokenBucket
+        self._pending = {}  # chat_id -> deque[(future, text, kwargs, attempt)]
+        self._busy = set()  # чаты, у которых сообщение уже в отправке
+        self._ready = []    # куча (monotonic-время готовности, seq, chat_id)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._dispatch, name='delivery-dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, chat_id, text: str, **kwargs) -> Future:
+        """Ставит сообщение в очередь; Future завершится результатом `send`."""
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('DeliveryEngine остановлен')
+            queue = self._pending.get(chat_id)
+            if queue is None:
+                queue = self._pending[chat_id] = deque()
+                if chat_id not in self._busy:
+                    heapq.heappush(self._ready, (time.monotonic(), next(self._seq), chat_id))
+            queue.append((future, text, kwargs, 0))
+            self._cond.notify()
+        return future
+
+    def broadcast(self, chat_ids, text: str, **kwargs) -> list:
+        """Одно и то же сообщение во все чаты; список Future в том же порядке."""
+        return [self.submit(chat_id, text, **kwargs) for chat_id in chat_ids]
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Останавливает диспетчер; неотправленные сообщения отменяются."""
+        with self._cond:
+            self._stopped = True
+            for queue in self._pending.values():
+                for future, *_ in queue:
+                    # сообщение, ждущее повтора, уже не отменить: завершаем ошибкой
+                    if not future.cancel():
+                        future.set_exception(RuntimeError('DeliveryEngine остановлен'))
+            self._pending.clear()
+            self._ready.clear()
+            self._cond.notify()
+        self._thread.join()
+        self._pool.shutdown(wait=wait)
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def _next_job(self):
+        """Ждёт чат с готовым токеном и снимает с него одно сообщение."""
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                delay = self._ready[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+
+                _, _, chat_id = heapq.heappop(self._ready)
+                bucket = self._bucket(chat_id)
+                wait = bucket.delay()
+                if wait > 0:
+                    heapq.heappush(self._ready, (time.monotonic() + wait, next(self._seq), chat_id))
+                    continue
+
+                bucket.reserve()
+                queue = self._pending[chat_id]
+                job = queue.popleft()
+                if not queue:
+                    del self._pending[chat_id]
+                # следующее сообщение чата — только после завершения этого
+                self._busy.add(chat_id)
+                return chat_id, job
+
+    def _release(self, chat_id) -> None:
+        with self._cond:
+            self._busy.discard(chat_id)
+            if chat_id in self._pending:
+                ready_at = time.monotonic() + self._bucket(chat_id).delay()
+                heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+                self._cond.notify()
+
+    def _requeue(self, chat_id, job: tuple, delay: float) -> bool:
+        """Возвращает сообщение в начало очереди чата; чат освободится через `delay`."""
+        with self._cond:
+            if self._stopped:
+                return False
+            self._pending.setdefault(chat_id, deque()).appendleft(job)
+            self._busy.discard(chat_id)
+            heapq.heappush(self._ready, (time.monotonic() + delay, next(self._seq), chat_id))
+            self._cond.notify()
+            return True
+
+    def _dispatch(self) -> None:
+        while True:
+            item = self._next_job()
+            if item is None:
+                return
+            chat_id, job = item
+            future, attempt = job[0], job[3]
+            # повтор уже в состоянии RUNNING, отменить его нельзя
+            if attempt == 0 and not future.set_running_or_notify_cancel():
+                self._release(chat_id)
+                continue
+            time.sleep(self._global.reserve())
+            self._slots.acquire()
+            self._pool.submit(self._deliver, chat_id, job)
+
+    def _deliver(self, chat_id, job: tuple) -> None:
+        future, text, kwargs, attempt = job
+        started = time.perf_counter()
+        try:
+            future.set_result(self._send(chat_id, text, **kwargs))
+            SEND_SECONDS.observe(time.perf_counter() - started)
+        except Exception as e:
+            SEND_SECONDS.observe(time.perf_counter() - started)
+            SEND_ERRORS.labels(error_kind(e)).inc()
+            delay = self._retry.delay(e, attempt + 1) if self._retry else None
+            if delay is not None and self._requeue(chat_id, (future, text, kwargs, attempt + 1), delay):
+                SEND_RETRIES.inc()
+                logger.warning(f"🔁 Повтор отправки в {chat_id} через {delay:.1f} с "
+                               f"(попытка {attempt + 2}): {e}")
+                self._slots.release()
+                return
+            future.set_exception(e)
+        self._slots.release()
+        self._release(chat_id)
+
+
+class AsyncDeliveryEngine:
+    """Асинхронный вариант `DeliveryEngine` для AsyncTeleBot.
+
+    Те же лимиты, но вместо пула потоков — задачи asyncio: семафор
+    ограничивает число одновременных запросов, а asyncio.Lock на чат
+    (он отдаёт очередь в порядке ожидания) сохраняет порядок сообщений.
+    Пауза перед повтором держит только замок своего чата.
+    """
+
+    def __init__(self, send, workers: int = 8, global_rate: float = 30,
+                 chat_per_minute: float = 20, chat_burst: float = 3,
+                 retry: RetryPolicy = None):
+        self._send = send  # async send(chat_id, text, **kwargs)
+        self._retry = retry
+        self._slots = asyncio.Semaphore(workers)
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_per_minute / 60
+        self._chat_burst = chat_burst
+        self._chats = {}  # chat_id -> (TokenBucket, asyncio.Lock)
+        self._tasks = set()
+
+    def submit(self, chat_id, text: str, **kwargs) -> asyncio.Task:
+        """Ставит сообщение в очередь; задача завершится результатом `send`."""
+        task = asyncio.ensure_future(self._deliver(chat_id, text, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def broadcast(self, chat_ids, text: str, **kwargs) -> list:
+        """Одно и то же сообщение во все чаты; список задач в том же порядке."""
+        return [self.submit(chat_id, text, **kwargs) for chat_id in chat_ids]
+
+    async def shutdown(self) -> None:
+        """Отменяет неотправленные сообщения и дожидается завершения задач."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _deliver(self, chat_id, text: str, kwargs: dict):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = (TokenBucket(self._chat_rate, self._chat_burst), asyncio.Lock())
+        bucket, lock = chat
+        async with lock:
+            attempt = 0
+            while True:
+                await asyncio.sleep(bucket.reserve())
+                await asyncio.sleep(self._global.reserve())
+                try:
+                    async with self._slots:
+                        started = time.perf_counter()
+                        result = await self._send(chat_id, text, **kwargs)
+                    SEND_SECONDS.observe(time.perf_counter() - started)
+                    return result
+                except Exception as e:
+                    SEND_SECONDS.observe(time.perf_counter() - started)
+                    SEND_ERRORS.labels(error_kind(e)).inc()
+                    attempt += 1
+                    delay = self._retry.delay(e, attempt) if self._retry else None
+                    if delay is None:
+                        raise
+                    SEND_RETRIES.inc()
+                    logger.warning(f"🔁 Повтор отправки в {chat_id} через {delay:.1f} с "
+                                   f"(попытка {attempt + 1}): {e}")
+                    await asyncio.sleep(delay)
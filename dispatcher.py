@@ -0,0 +1,148 @@
+"""Обработка обновлений по очередям чатов.
+
+Пул потоков telebot берёт обновления из одной общей очереди, поэтому
+медленный ответ в одном чате (большой /show_week) задерживает остальные, а
+сообщения одного чата могут обработаться не по порядку. `ChatDispatcher`
+раскладывает обновления по `workers` очередям по chat.id: в пределах
+чата — строго по порядку, разные чаты — параллельно.
+
+Очереди ограничены. Что делать, когда очередь воркера заполнена, задаёт
+`overload`:
+  'block'       — ждать места (polling/вебхук притормаживают, Telegram
+                  придержит обновления у себя)
+  'drop_new'    — отбросить пришедшее обновление
+  'drop_oldest' — отбросить самое старое в очереди (устаревшие команды
+                  всё равно уже никто не ждёт)
+"""
+import logging
+import queue
+import threading
+import time
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_POLICIES = ('block', 'drop_new', 'drop_oldest')
+
+HANDLE_SECONDS = Histogram('dispatcher_handle_seconds', 'Обработка одного обновления', labels=('worker',))
+WAIT_SECONDS = Histogram('dispatcher_wait_seconds', 'Ожидание обновления в очереди воркера', labels=('worker',))
+QUEUE_DEPTH = Gauge('dispatcher_queue_depth', 'Обновления в очереди воркера', labels=('worker',))
+DROPPED = Counter('dispatcher_dropped_total', 'Обновления, отброшенные из-за переполнения', labels=('worker',))
+
+# Поля Update, в которых есть чат
+_CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'my_chat_member', 'chat_member', 'chat_join_request')
+
+
+def chat_of(update):
+    """chat.id обновления; для обновлений без чата — отправитель или update_id."""
+    for name in _CHAT_FIELDS:
+        obj = getattr(update, name, None)
+        if obj is not None:
+            return obj.chat.id
+    query = getattr(update, 'callback_query', None)
+    if query is not None:
+        return query.message.chat.id if query.message is not None else query.from_user.id
+    return update.update_id
+
+
+class ChatDispatcher:
+    """`workers` потоков, у каждого своя очередь на `queue_size` обновлений.
+
+    `handle(update)` вызывается в потоке воркера; чат всегда попадает в
+    одну и ту же очередь (`key(update) % workers`).
+    """
+
+    def __init__(self, handle, workers: int = 8, queue_size: int = 100,
+                 overload: str = 'block', key=chat_of):
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError(f"неизвестная политика переполнения: {overload}")
+        self._handle = handle
+        self._key = key
+        self.overload = overload
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(i,), name=f'dispatcher-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        self._started = False
+        self._lock = threading.Lock()
+        QUEUE_DEPTH.fn = lambda: {(str(i),): depth for i, depth in enumerate(self.depths())}
+
+    def start(self) -> 'ChatDispatcher':
+        with self._lock:
+            if not self._started:
+                self._started = True
+                for thread in self._threads:
+                    thread.start()
+        return self
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def depths(self) -> list:
+        return [q.qsize() for q in self._queues]
+
+    def submit(self, update) -> bool:
+        """Ставит обновление в очередь его чата; False, если оно отброшено."""
+        if not self._started:
+            self.start()
+        i = hash(self._key(update)) % len(self._queues)
+        q = self._queues[i]
+        item = (time.perf_counter(), update)
+        if self.overload == 'block':
+            q.put(item)
+            return True
+        try:
+            q.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        if self.overload == 'drop_new':
+            self._dropped(i, update)
+            return False
+        # drop_oldest: освобождаем место, пока обновление не встанет в очередь
+        while True:
+            try:
+                _, old = q.get_nowait()
+                self._dropped(i, old)
+            except queue.Empty:
+                pass
+            try:
+                q.put_nowait(item)
+                return True
+            except queue.Full:
+                continue
+
+    def _dropped(self, i: int, update) -> None:
+        DROPPED.labels(str(i)).inc()
+        logger.warning(f"🗑️ Обновление {update.update_id} отброшено: очередь воркера {i} заполнена")
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Дорабатывает уже принятые обновления и останавливает воркеры."""
+        if not self._started:
+            return
+        for q in self._queues:
+            q.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _work(self, i: int) -> None:
+        q = self._queues[i]
+        waited = WAIT_SECONDS.labels(str(i))
+        latency = HANDLE_SECONDS.labels(str(i))
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            queued_at, update = item
+            started = time.perf_counter()
+            waited.observe(started - queued_at)
+            try:
+                self._handle(update)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                latency.observe(time.perf_counter() - started)
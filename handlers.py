@@ -0,0 +1,1159 @@
+"""Команды бота, общие для обычного (bot.py) и asyncio (bot_async.py) режимов.
+
+Обработчики не обращаются к Telegram сами: они меняют хранилище и
+возвращают, что ответить (`Reply`) или что разослать по группам
+(`Broadcast`). Исполняет это конкретный режим запуска.
+"""
+import logging
+import re
+from datetime import datetime
+from time import perf_counter
+from typing import Callable, NamedTuple, Optional
+
+from config import (DEAD_LETTER_LIMIT, IMPORT_MAX_ROWS, MEDIA_DIR, MISFIRE_GRACE, MISFIRE_POLICY, SCHEDULER_CHECKPOINT,
+                    SHARDS, TIMEZONE, store)
+from dead_letters import DeadLetters
+import bulk
+import media
+import pages
+import recurrence
+import templates
+from metrics import Counter, Gauge, Histogram
+from router import CommandRouter
+from scheduler import Scheduler
+from timezones import group_zone, groups_by_zone, is_valid, tzinfo
+
+logger = logging.getLogger(__name__)
+
+# Хранилище chat_id для отправки сообщений
+user_chats = set()
+
+# Дни недели
+DAYS_RU = {
+    0: 'monday',
+    1: 'tuesday',
+    2: 'wednesday',
+    3: 'thursday',
+    4: 'friday',
+    5: 'saturday',
+    6: 'sunday'
+}
+
+DAYS_NAME_RU = {
+    'monday': 'Понедельник',
+    'tuesday': 'Вторник',
+    'wednesday': 'Среда',
+    'thursday': 'Четверг',
+    'friday': 'Пятница',
+    'saturday': 'Суббота',
+    'sunday': 'Воскресенье'
+}
+
+# Подписи типов записей для логов
+KIND_LABELS = {
+    'weekly': 'неделя',
+    'daily': 'ежедневно',
+    'one_off': 'one-off',
+    'rule': 'правило',
+}
+
+
+class Reply(NamedTuple):
+    """Ответ в чат, из которого пришла команда"""
+    text: str
+    parse_mode: Optional[str] = 'Markdown'
+    quote: bool = True  # False - обычное сообщение в чат, а не ответ
+    markup: Optional[object] = None  # inline-кнопки (листание страниц)
+
+
+class Edit(NamedTuple):
+    """Новый текст и кнопки сообщения, под которым нажали кнопку"""
+    text: str
+    parse_mode: Optional[str] = 'Markdown'
+    markup: Optional[object] = None
+
+
+class Broadcast(NamedTuple):
+    """Рассылка по группам; `report(errors)` строит ответ после отправки.
+
+    `media` — ссылка на вложение (см. media.py), тогда `text` — подпись.
+    `texts` — свой текст для некоторых групп ({group_title} в шаблоне).
+    """
+    groups: list
+    text: str
+    parse_mode: Optional[str] = 'Markdown'
+    report: Optional[Callable[[list], Reply]] = None
+    media: Optional[str] = None
+    texts: Optional[dict] = None
+
+    def text_for(self, group_id) -> str:
+        return self.text if self.texts is None else self.texts.get(group_id, self.text)
+
+
+class Resend(NamedTuple):
+    """Повторная отправка недоставленных сообщений (у каждого свой чат и текст).
+
+    `report(errors)` получает ошибки в порядке `letters` (None — доставлено).
+    """
+    letters: list
+    report: Callable[[list], Reply]
+
+
+class Download(NamedTuple):
+    """Документ, присланный с командой: `then(stream)` читает его текст
+    (поток по мере скачивания) и возвращает ответ"""
+    file_id: str
+    then: Callable
+
+
+class Document(NamedTuple):
+    """Ответ файлом: `write(out)` пишет содержимое в текстовый поток"""
+    file_name: str
+    write: Callable
+    caption: str = ''
+
+
+# Шард этого процесса (shard.ShardNode), если бот запущен несколькими
+# процессами через shard.py; None — один процесс рассылает все группы
+shard = None
+
+
+def owns_group(group_id) -> bool:
+    """Рассылает ли группу этот процесс"""
+    return shard is None or shard.owns(group_id)
+
+
+def active_zones():
+    """Часовые пояса, в которых есть группы этого процесса (хотя бы пояс по умолчанию)"""
+    zones = [zone for zone, groups in groups_by_zone(store, TIMEZONE).items()
+             if any(owns_group(group_id) for group_id in groups)]
+    return zones or [TIMEZONE]
+
+
+# Планировщик общий для обоих режимов; отличается только способ ожидания.
+# Его часы (scheduler.clock) — «текущее время» и для команд
+scheduler = Scheduler(store, misfire_policy=MISFIRE_POLICY, misfire_grace=MISFIRE_GRACE,
+                      checkpoint=SCHEDULER_CHECKPOINT, zones=active_zones, cleanup_fired=SHARDS == 1)
+
+# Отправки по расписанию, которые не удалось доставить
+dead_letters = DeadLetters(store, limit=DEAD_LETTER_LIMIT)
+
+
+def _media_error(text):
+    """Ответ с ошибкой, если вложение в тексте не отправить (нет файла и т.п.)"""
+    error = media.check(text, MEDIA_DIR)
+    if error is None:
+        return None
+    return Reply(f"❌ {error}\n\nВложения берутся из каталога бота: `photo:имя.jpg Подпись`, "
+                 f"`document:имя.pdf Подпись`, `album:1.jpg,2.jpg Подпись`")
+
+
+def _template_error(text):
+    """Ответ с ошибкой, если в шаблоне неизвестная подстановка"""
+    try:
+        templates.compile_template(media.split(text)[1], strict=True)
+    except ValueError as e:
+        # без разметки: в именах подстановок есть '_'
+        return Reply(f"❌ {str(e).capitalize()}\n\nНапример: /add_daily 09:00 Сегодня {{weekday}}, {{date}}",
+                     parse_mode=None)
+    return None
+
+
+def _md(text: str) -> str:
+    """Текст пользователя внутри ответа с Markdown ('_' в {group_title} и т.п.)"""
+    return re.sub(r'([_*`\[])', r'\\\1', text)
+
+
+def remember_chat(chat) -> None:
+    """Запоминает название группы для подстановки {group_title}"""
+    if chat.type == 'private' or not chat.title:
+        return
+    titles = store.get('group_titles') or {}
+    if titles.get(str(chat.id)) != chat.title:
+        store.set('group_titles', {**titles, str(chat.id): chat.title})
+
+
+def _count_entries():
+    counts = {('weekly',): 0, ('daily',): 0, ('one_off',): 0, ('rule',): 0}
+    for key in store.entries():
+        counts[(key[0],)] += 1
+    return counts
+
+
+HANDLER_SECONDS = Histogram('handler_seconds', 'Обработка команды, включая ответ', labels=('command',))
+FIRE_LAG = Histogram('scheduler_fire_lag_seconds', 'Доставка записи расписания: время отправки минус время записи',
+                     labels=('kind',), buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600))
+COALESCED = Counter('schedule_coalesced_total', 'Записи расписания, не потребовавшие отдельного сообщения',
+                    labels=('reason',))
+IMPORT_ROWS = Counter('schedule_import_rows_total', 'Строки файлов /import', labels=('result',))
+ENTRIES = Gauge('schedule_entries', 'Записей в расписании по виду', labels=('kind',),
+                fn=lambda: store.cached('entry_counts', _count_entries))
+
+
+def start(message, args):
+    """Команда /start - показывает список доступных команд"""
+    user_chats.add(message.chat.id)
+    
+    help_text = """
+🤖 *Добро пожаловать в бот!*
+
+Доступные команды:
+
+*📤 /send* - Отправить текстовое сообщение (текущее значение)
+    Используется для отправки заготовленного текста
+
+*⏰ /set_schedule* - Установить время и текст для автоотправки
+    Пример: `/set_schedule 10:30 Привет, это автоматическое сообщение`
+
+*📝 /get_scheduled* - Показать текущее запланированное сообщение и время
+
+*✏️ /edit_text* - Изменить текст для отправки
+    Пример: `/edit_text Новый текст сообщения`
+
+*🕐 /edit_time* - Изменить время отправки
+    Пример: `/edit_time 15:45`
+
+*📅 /week_schedule* - Управление расписанием на неделю
+
+*📆 /add_daily* - Добавить ежедневную отправку (каждый день в указанное время)
+    Пример: `/add_daily 09:00 Доброе утро!`
+
+*🗑️ /remove_daily* - Удалить ежедневную отправку
+    Пример: `/remove_daily 09:00`
+
+*📊 /show_daily* - Показать ежедневное расписание
+
+*📋 /status* - Показать статус всех настроек
+
+*ℹ️ /help* - Показать эту справку
+    """
+    
+    return Reply(help_text)
+
+
+def set_group(message, args):
+    """Команда /set_group - Установить ID группы для отправки"""
+    if not args:
+        return Reply(
+            "❌ Пожалуйста, укажите ID группы!\n\n"
+            "Используйте: `/set_group -1001234567890`\n\n"
+            "📖 Как получить ID группы:\n"
+            "1. Добавьте бота в группу\n"
+            "2. Напишите в группе: `/get_group_id`\n"
+            "3. Бот покажет ID группы")
+    
+    try:
+        group_id = int(args)
+        store.set('group_id', group_id)  # СОХРАНЯЕМ!
+        store.set('groups', [group_id])
+        scheduler.reschedule()  # могли поменяться часовые пояса групп
+        
+        logger.info(f"Группа установлена: {group_id}")
+        return Reply(
+            f"✅ Группа установлена!\n\n"
+            f"📋 ID группы: `{group_id}`\n\n"
+            f"Чтобы рассылать в несколько групп, используйте `/add_group`")
+    except ValueError:
+        return Reply(
+            "❌ Неправильный ID группы!\n\n"
+            "ID должен быть числом (например: -1001234567890)")
+
+
+def get_group_id(message, args):
+    """Команда /get_group_id - Показать ID текущей группы"""
+    return Reply(
+        f"🆔 ID этой группы/чата: `{message.chat.id}`\n\n"
+        f"Используйте эту команду:\n`/set_group {message.chat.id}`",
+        quote=False)
+
+
+def get_group(message, args):
+    """Команда /get_group - Показать группы для отправки"""
+    groups = store.get('groups')
+    if not groups:
+        return Reply(
+            "❌ Группа не установлена!\n\n"
+            "Используйте: `/set_group -1001234567890`")
+    else:
+        groups_text = "\n".join(f"`{g}` ({group_zone(store, g, TIMEZONE) or 'время сервера'})" for g in groups)
+        return Reply(f"📋 Группы для отправки ({len(groups)}):\n{groups_text}")
+
+
+def _update_groups(groups):
+    """Сохраняет список групп; group_id — первая из них (для совместимости)"""
+    store.set('groups', groups)
+    store.set('group_id', groups[0] if groups else None)
+    scheduler.reschedule()  # могли поменяться часовые пояса групп
+
+
+def add_group(message, args):
+    """Команда /add_group - Добавить группу в рассылку"""
+    if not args:
+        return Reply("❌ Пожалуйста, укажите ID группы!\n\nИспользуйте: `/add_group -1001234567890`")
+
+    try:
+        group_id = int(args)
+    except ValueError:
+        return Reply(
+            "❌ Неправильный ID группы!\n\n"
+            "ID должен быть числом (например: -1001234567890)")
+
+    groups = store.get('groups')
+    if group_id in groups:
+        return Reply(f"ℹ️ Группа `{group_id}` уже в рассылке.")
+
+    _update_groups(groups + [group_id])
+    logger.info(f"Группа добавлена: {group_id}")
+    return Reply(
+        f"✅ Группа `{group_id}` добавлена в рассылку!\n\n"
+        f"📋 Всего групп: {len(store.get('groups'))}")
+
+
+def remove_group(message, args):
+    """Команда /remove_group - Убрать группу из рассылки"""
+    if not args:
+        return Reply("❌ Пожалуйста, укажите ID группы!\n\nИспользуйте: `/remove_group -1001234567890`")
+
+    try:
+        group_id = int(args)
+    except ValueError:
+        group_id = None
+
+    groups = store.get('groups')
+    if group_id not in groups:
+        return Reply("❌ Такой группы нет в рассылке.")
+
+    _update_groups([g for g in groups if g != group_id])
+    logger.info(f"Группа удалена: {group_id}")
+    return Reply(f"✅ Группа `{group_id}` убрана из рассылки.")
+
+
+def send_message_cmd(message, args):
+    """Команда /send - Отправить заготовленное сообщение во все группы"""
+    groups = store.get('groups')
+    if not groups:
+        return Reply(
+            "❌ Группа не установлена!\n\n"
+            "Используйте команду `/set_group` чтобы установить группу")
+    
+    message_text = store.get('send_message_text')
+    ref, caption = media.split(message_text)
+    groups = list(groups)
+
+    def report(errors):
+        if not errors:
+            logger.info(f"Сообщение отправлено в группы: {groups}")
+            return Reply(f"✅ Сообщение отправлено в группы ({len(groups)})!\n\n{message_text}")
+        logger.error(f"Ошибка при отправке: {errors[0]}")
+        return Reply(f"❌ Ошибка при отправке в {len(errors)} из {len(groups)} групп: {str(errors[0])}")
+
+    return Broadcast(groups, f"📤 {caption}", report=report, media=ref)
+
+
+def set_schedule(message, args):
+    """Команда /set_schedule - Установить время и текст для автоотправки"""
+    parts = args.split(maxsplit=1)
+    
+    if len(parts) < 2:
+        return Reply(
+            "❌ Неправильный формат!\n\n"
+            "Используйте: `/set_schedule ВремяВ:МИН Текст сообщения`\n\n"
+            "Пример: `/set_schedule 10:30 Привет, это автоматическое сообщение`")
+    
+    time_str, message_text = parts
+
+    error = _template_error(message_text)
+    if error is not None:
+        return error
+    
+    # Проверка формата времени
+    try:
+        datetime.strptime(time_str, '%H:%M')
+        store.set('scheduled_time', time_str)
+        store.set('scheduled_text', message_text)
+        
+        logger.info(f"Расписание установлено: {time_str} - {message_text}")
+        return Reply(
+            f"✅ Запланировано!\n\n"
+            f"⏰ Время: {time_str}\n"
+            f"📝 Текст: {_md(message_text)}")
+    except ValueError:
+        return Reply(
+            "❌ Неправильный формат времени!\n\n"
+            "Используйте формат: `ЧЧ:МИН` (например: `10:30`)")
+
+
+def get_scheduled(message, args):
+    """Команда /get_scheduled - Показать текущее запланированное сообщение"""
+    scheduled_time = store.get('scheduled_time')
+    scheduled_text = store.get('scheduled_text')
+    
+    return Reply(
+        f"📋 *Текущее расписание:*\n\n"
+        f"⏰ Время: `{scheduled_time}`\n"
+        f"📝 Текст:\n`{scheduled_text}`")
+
+
+def edit_text(message, args):
+    """Команда /edit_text - Изменить текст для отправки"""
+    if not args:
+        return Reply(
+            "❌ Пожалуйста, укажите новый текст!\n\n"
+            "Используйте: `/edit_text Новый текст`")
+    
+    new_text = args
+    error = _media_error(new_text)
+    if error is not None:
+        return error
+    store.set('send_message_text', new_text)
+    
+    logger.info(f"Текст изменён на: {new_text}")
+    return Reply(
+        f"✅ Текст обновлён!\n\n"
+        f"📝 Новый текст для `/send`:\n`{new_text}`")
+
+
+def edit_time(message, args):
+    """Команда /edit_time - Изменить время отправки"""
+    if not args:
+        return Reply(
+            "❌ Пожалуйста, укажите время!\n\n"
+            "Используйте: `/edit_time 14:30`")
+    
+    time_str = args
+    
+    # Проверка формата времени
+    try:
+        datetime.strptime(time_str, '%H:%M')
+        store.set('scheduled_time', time_str)
+        
+        logger.info(f"Время изменено на: {time_str}")
+        return Reply(
+            f"✅ Время обновлено!\n\n"
+            f"⏰ Новое время отправки: `{time_str}`")
+    except ValueError:
+        return Reply(
+            "❌ Неправильный формат времени!\n\n"
+            "Используйте формат: `ЧЧ:МИН` (например: `14:30`)")
+
+
+def status(message, args):
+    """Команда /status [страница] - Показать статус всех настроек"""
+    return _page_reply('status', args)
+
+
+def _status_pages():
+    counts = _count_entries()
+    groups = store.get('groups') or []
+    titles = store.get('group_titles') or {}
+    settings = [
+        f"📝 *Текст для /send:*\n`{store.get('send_message_text')}`\n",
+        f"⏰ *Время автоотправки:* `{store.get('scheduled_time')}`",
+        f"📤 *Текст при автоотправке:*\n`{store.get('scheduled_text')}`\n",
+        f"📋 Записей: неделя {counts[('weekly',)]}, ежедневно {counts[('daily',)]}, "
+        f"разово {counts[('one_off',)]}, правил {counts[('rule',)]}",
+    ]
+    group_lines = [f"`{g}` ({group_zone(store, g, TIMEZONE) or 'время сервера'})"
+                   f"{' ' + _md(titles[str(g)]) if titles.get(str(g)) else ''}" for g in groups]
+    return pages.paginate("📊 *Статус бота:*\n\n", [
+        pages.Section('', settings),
+        pages.Section(f"👥 Группы ({len(groups)})", group_lines or ["не заданы — `/add_group`"]),
+    ])
+
+
+def help_command(message, args):
+    """Команда /help - Показать справку"""
+    help_text = """
+🤖 *Справка по командам:*
+
+*📤 /send* - Отправить текстовое сообщение
+Отправляет текст, установленный через `/edit_text`
+
+*⏰ /set_schedule <ВремяВ:МИН> <Текст>* 
+Установить время и текст для автоотправки
+Пример: `/set_schedule 10:30 Доброе утро!`
+
+*📝 /get_scheduled* - Показать запланированное сообщение
+
+*✏️ /edit_text <Текст>* - Изменить текст отправки
+Пример: `/edit_text Новое сообщение`
+
+*🕐 /edit_time <ВремяВ:МИН>* - Изменить время
+Пример: `/edit_time 18:00`
+
+*📅 /week_schedule* - Управление расписанием на неделю
+
+Ежедневные отправки (одни и те же времена каждый день):
+*➕ /add_daily <Время> <Текст>* - Добавить ежедневную отправку
+*❌ /remove_daily <Время>* - Удалить время из ежедневного расписания
+*📊 /show_daily* - Показать ежедневное расписание
+
+Правила повторения (cron или RRULE):
+*🔁 /add_rule <Правило> | <Текст>* - Например `/add_rule 0 9 * * 1-5 | Доброе утро!`
+*❌ /remove_rule <Номер>* - Удалить правило
+*📋 /show_rules* - Показать правила
+
+В текстах расписания работают подстановки `{date}`, `{weekday}`, `{time}`, `{group_title}`
+
+Много записей сразу:
+*📥 /import [replace]* - Загрузить расписание из файла CSV/JSON (подпись к файлу)
+*📤 /export [json]* - Выгрузить расписание файлом
+
+Фото и документы: текст может начинаться со ссылки на файл из каталога бота, дальше — подпись:
+`photo:poster.jpg Текст`, `document:report.pdf Текст`, `album:1.jpg,2.jpg Текст`
+
+Группы для рассылки:
+*👥 /set_group <ID>* - Оставить одну группу
+*➕ /add_group <ID>* - Добавить группу в рассылку
+*❌ /remove_group <ID>* - Убрать группу из рассылки
+*📋 /get_group* - Показать группы
+*🌍 /set_timezone [ID] <Пояс>* - Часовой пояс группы (например `Europe/Moscow`)
+*🕒 /server_time* - Время сервера и группы
+
+*📋 /status* - Показать все текущие настройки
+
+Недоставленные сообщения:
+*📭 /dead_letters* - Показать сообщения, которые не удалось отправить
+*🔁 /replay_dead <ID ...|all>* - Отправить их ещё раз
+
+*ℹ️ /help* - Показать эту справку
+    """
+    return Reply(help_text)
+
+
+def week_schedule_menu(message, args):
+    """Команда /week_schedule - Управление расписанием на неделю"""
+    help_text = """
+📅 *Управление расписанием на неделю*
+
+Доступные команды:
+
+*➕ /add_schedule* - Добавить время отправки для дня
+Пример: `/add_schedule monday 09:00 Доброе утро!`
+
+*❌ /remove_schedule* - Удалить время отправки
+Пример: `/remove_schedule monday 09:00`
+
+*📊 /show_week* - Показать всё расписание на неделю
+
+*🔄 /clear_week* - Очистить всё расписание
+
+Дни недели: monday, tuesday, wednesday, thursday, friday, saturday, sunday
+
+Также, если нужно одно и то же время каждый день, используйте ежедневные команды:
+*➕ /add_daily <Время> <Текст>* — добавить ежедневную отправку
+*❌ /remove_daily <Время>* — удалить ежедневную отправку
+*📊 /show_daily* — показать ежедневное расписание
+    """
+    return Reply(help_text)
+
+
+def add_schedule(message, args):
+    """Команда /add_schedule - Добавить время для дня недели"""
+    parts = args.split(maxsplit=2)
+    
+    if len(parts) < 3:
+        return Reply(
+            "❌ Неправильный формат!\n\n"
+            "Используйте: `/add_schedule день время текст`\n\n"
+            "Пример: `/add_schedule monday 09:00 Доброе утро!`\n\n"
+            "Дни: monday, tuesday, wednesday, thursday, friday, saturday, sunday")
+    
+    day, time_str, schedule_text = parts
+    day = day.lower()
+    
+    # Проверка дня
+    valid_days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    if day not in valid_days:
+        return Reply(
+            f"❌ Неправильный день недели!\n\n"
+            f"Допустимые дни: {', '.join(valid_days)}")
+    
+    try:
+        send_at = datetime.strptime(time_str, '%H:%M')
+    except ValueError:
+        return Reply(
+            "❌ Неправильный формат времени!\n\n"
+            "Используйте формат: `ЧЧ:МИН` (например: `10:30`)")
+
+    error = _media_error(schedule_text) or _template_error(schedule_text)
+    if error is not None:
+        return error
+    
+    # Добавляем в расписание (повтор по неделям)
+    added = [('weekly', day, time_str)]
+    store.add(added[0], schedule_text)
+
+    # Плюс отправки на ближайшие N дней (включая сегодня) — одним правилом
+    N = 3
+    now = scheduler.clock.now()
+    added.append(('rule', f"DTSTART={now:%Y%m%d}T{send_at:%H%M}00;FREQ=DAILY;COUNT={N}"))
+    store.add(added[-1], schedule_text)  # СОХРАНЯЕМ!
+
+    scheduler.reschedule(added=added)
+
+    # Вычисляем, будет ли первая отправка сегодня или позже (по серверному времени)
+    today_day = DAYS_RU[now.weekday()]
+    first_send_note = ''
+    try:
+        send_time_obj = datetime.strptime(time_str, '%H:%M').time()
+        if day == today_day and send_time_obj >= now.time():
+            first_send_note = f"\n\nℹ️ Первая отправка: сегодня ({DAYS_NAME_RU[day]}) в {time_str}."
+        else:
+            first_send_note = f"\n\nℹ️ Первая отправка: в следующую {DAYS_NAME_RU[day]} в {time_str}."
+    except Exception:
+        first_send_note = ''
+
+    logger.info(f"Добавлено расписание: {day} {time_str} - {schedule_text}")
+    return Reply(
+        f"✅ Добавлено!\n\n"
+        f"📅 День: {DAYS_NAME_RU[day]}\n"
+        f"⏰ Время: {time_str}\n"
+        f"📝 Текст: {_md(schedule_text)}{first_send_note}\n\n"
+        f"ℹ️ Также запланировано на ближайшие {N} дней (правилом, см. /show_rules).")
+
+
+def remove_schedule(message, args):
+    """Команда /remove_schedule - Удалить время для дня"""
+    parts = args.split(maxsplit=1)
+    
+    if len(parts) < 2:
+        return Reply(
+            "❌ Неправильный формат!\n\n"
+            "Используйте: `/remove_schedule день время`\n\n"
+            "Пример: `/remove_schedule monday 09:00`")
+    
+    day, time_str = parts
+    day = day.lower()
+    
+    # Проверка дня
+    valid_days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    if day not in valid_days:
+        return Reply("❌ Неправильный день недели!")
+    
+    # Удаляем из расписания
+    if store.text(('weekly', day, time_str)) is not None:
+        store.remove(('weekly', day, time_str))  # СОХРАНЯЕМ!
+        scheduler.reschedule(removed=[('weekly', day, time_str)])
+        logger.info(f"Удалено расписание: {day} {time_str}")
+        return Reply(
+            f"✅ Удалено!\n\n"
+            f"📅 День: {DAYS_NAME_RU[day]}\n"
+            f"⏰ Время: {time_str}")
+    else:
+        return Reply("❌ Время не найдено для этого дня!")
+
+
+def show_week(message, args):
+    """Команда /show_week [страница] - Показать расписание на неделю"""
+    return _page_reply('week', args)
+
+
+def _week_pages():
+    return pages.paginate(
+        "📅 *РАСПИСАНИЕ НА НЕДЕЛЮ:*\n\n",
+        [pages.Section(f"📌 {day_ru}", [f"   ⏰ {t} → {_md(text)}" for t, text in store.day_entries(day_eng)])
+         for day_eng, day_ru in DAYS_NAME_RU.items()],
+        empty="📅 *Расписание пусто!*\n\nДобавьте расписание с помощью `/add_schedule`")
+
+
+def clear_week(message, args):
+    """Команда /clear_week - Очистить расписание"""
+    store.clear('weekly')  # СОХРАНЯЕМ!
+    scheduler.reschedule()
+    return Reply("✅ Расписание очищено!")
+
+
+def show_dead_letters(message, args):
+    """Команда /dead_letters - Показать недоставленные сообщения"""
+    letters = dead_letters.list()
+    if not letters:
+        return Reply("📭 Недоставленных сообщений нет.")
+
+    # тексты и ошибки приходят как есть, без разметки: Markdown их не переварит
+    lines = [f"📭 Недоставленные сообщения ({len(letters)}):", ""]
+    for letter in letters[-20:]:
+        lines.append(f"#{letter['id']} → {letter['chat_id']} ({letter['failed_at']}): {letter['text'][:60]}")
+        lines.append(f"   ⚠️ {(letter['error'] or '')[:100]}")
+    if len(letters) > 20:
+        lines.append(f"\n… и ещё {len(letters) - 20} (показаны последние 20)")
+    lines.append("\nОтправить снова: /replay_dead <ID ...> или /replay_dead all")
+    return Reply("\n".join(lines), parse_mode=None)
+
+
+def replay_dead(message, args):
+    """Команда /replay_dead <ID ...|all> - Отправить недоставленные сообщения снова"""
+    ids = args.split()
+    if not ids:
+        return Reply("❌ Укажите ID сообщений или all!\n\nПример: `/replay_dead 3 4` или `/replay_dead all`")
+
+    if ids == ['all']:
+        letters = dead_letters.take()
+    else:
+        try:
+            letters = dead_letters.take(int(a.lstrip('#')) for a in ids)
+        except ValueError:
+            return Reply("❌ ID должны быть числами (см. `/dead_letters`)")
+    if not letters:
+        return Reply("❌ Таких сообщений нет в очереди недоставленных.")
+
+    def report(errors):
+        failed = 0
+        for letter, error in zip(letters, errors):
+            if error is not None:
+                # не получилось снова — возвращаем в очередь с новой ошибкой
+                failed += 1
+                dead_letters.add(letter['chat_id'], letter['text'], letter['parse_mode'], error, letter['kind'],
+                                 letter.get('media'))
+        logger.info(f"🔁 Переотправлено недоставленных: {len(letters) - failed} из {len(letters)}")
+        if failed:
+            return Reply(f"⚠️ Доставлено {len(letters) - failed} из {len(letters)}, "
+                         f"остальные снова в `/dead_letters`.")
+        return Reply(f"✅ Доставлено {len(letters)} из {len(letters)}!")
+
+    return Resend(letters, report)
+
+
+def handle_message(message, args):
+    """Обработка текстовых сообщений - только в личном чате"""
+    if message.chat.type != 'private':
+        return None
+    
+    return Reply("👋 Привет! Используйте команду `/help` чтобы узнать доступные команды.")
+
+
+def add_daily(message, args):
+    """Команда /add_daily <Время> <Текст> - Добавить время для ежедневной отправки"""
+    parts = args.split(maxsplit=1)
+    if len(parts) < 2:
+        return Reply("❌ Неправильный формат!\n\nИспользуйте: `/add_daily 09:00 Текст сообщения`")
+
+    time_str, schedule_text = parts
+    try:
+        datetime.strptime(time_str, '%H:%M')
+    except ValueError:
+        return Reply("❌ Неправильный формат времени!\n\nИспользуйте формат: `ЧЧ:МИН` (например: `09:00`)")
+    error = _media_error(schedule_text) or _template_error(schedule_text)
+    if error is not None:
+        return error
+
+    store.add(('daily', time_str), schedule_text)
+    scheduler.reschedule(added=[('daily', time_str)])
+    logger.info(f"Добавлено ежедневное расписание: {time_str} - {schedule_text}")
+    return Reply(f"✅ Ежедневная отправка добавлена: {time_str} → {_md(schedule_text)}")
+
+
+def remove_daily(message, args):
+    """Команда /remove_daily <Время> - Удалить время из ежедневного расписания"""
+    if not args:
+        return Reply("❌ Укажите время!\n\nПример: `/remove_daily 09:00`")
+
+    time_str = args
+    if store.text(('daily', time_str)) is not None:
+        store.remove(('daily', time_str))
+        scheduler.reschedule(removed=[('daily', time_str)])
+        logger.info(f"Удалено ежедневное время: {time_str}")
+        return Reply(f"✅ Ежедневная отправка {time_str} удалена.")
+    else:
+        return Reply("❌ Время не найдено в ежедневном расписании.")
+
+
+def add_rule(message, args):
+    """Команда /add_rule <Правило> | <Текст> - Повторяющаяся отправка по правилу cron или RRULE"""
+    spec, sep, schedule_text = args.partition('|')
+    spec, schedule_text = spec.strip(), schedule_text.strip()
+    if not sep or not spec or not schedule_text:
+        return Reply(
+            "❌ Неправильный формат!\n\n"
+            "Используйте: `/add_rule правило | текст`\n\n"
+            "Примеры:\n"
+            "`/add_rule 0 9 * * 1-5 | Доброе утро!` — по будням в 09:00\n"
+            "`/add_rule FREQ=DAILY;INTERVAL=2;BYHOUR=9;BYMINUTE=0 | Текст` — через день\n"
+            "`/add_rule FREQ=MONTHLY;BYDAY=-1FR;BYHOUR=18;BYMINUTE=0 | Текст` — последняя пятница месяца")
+
+    now = scheduler.clock.now()
+    spec = recurrence.normalize(spec, now)
+    try:
+        upcoming = recurrence.parse(spec).occurrences(now, 3)
+    except ValueError as e:
+        return Reply(f"❌ Неправильное правило: {e}")
+    error = _media_error(schedule_text) or _template_error(schedule_text)
+    if error is not None:
+        return error
+
+    store.add(('rule', spec), schedule_text)
+    scheduler.reschedule(added=[('rule', spec)])
+    logger.info(f"Добавлено правило: {spec} - {schedule_text}")
+    upcoming_text = '\n'.join(f"   ⏰ {dt:%Y-%m-%d %H:%M}" for dt in upcoming) or "   больше не сработает"
+    return Reply(
+        f"✅ Правило добавлено!\n\n"
+        f"🔁 `{spec}`\n"
+        f"📝 Текст: {_md(schedule_text)}\n\n"
+        f"ℹ️ Ближайшие отправки (по часам каждой группы):\n{upcoming_text}")
+
+
+def remove_rule(message, args):
+    """Команда /remove_rule <Номер> - Удалить правило (номер из /show_rules)"""
+    rules = store.rule_entries()
+    try:
+        spec = rules[int(args) - 1][0] if args and int(args) > 0 else None
+    except (ValueError, IndexError):
+        spec = None
+    if spec is None:
+        return Reply("❌ Укажите номер правила из `/show_rules`!\n\nПример: `/remove_rule 1`")
+
+    store.remove(('rule', spec))
+    scheduler.reschedule(removed=[('rule', spec)])
+    logger.info(f"Удалено правило: {spec}")
+    return Reply(f"✅ Правило `{spec}` удалено.")
+
+
+def show_rules(message, args):
+    """Команда /show_rules - Показать правила повторения и их ближайшие срабатывания"""
+    rules = store.rule_entries()
+    if not rules:
+        return Reply("🔁 Правил повторения нет.\n\nДобавьте: `/add_rule 0 9 * * 1-5 | Текст`")
+
+    now = scheduler.clock.now()
+    text = "🔁 *Правила повторения:*\n\n"
+    for i, (spec, txt) in enumerate(rules, 1):
+        try:
+            upcoming = recurrence.parse(spec).next_after(now)
+            when = f"{upcoming:%Y-%m-%d %H:%M}" if upcoming else "больше не сработает"
+        except ValueError as e:
+            when = f"ошибка в правиле: {e}"
+        text += f"{i}. `{spec}` → {_md(txt)}\n   ⏭ {when}\n"
+    return Reply(text)
+
+
+def show_daily(message, args):
+    """Показать ежедневное расписание"""
+    return _page_reply('daily', args)
+
+
+def _daily_pages():
+    return pages.paginate(
+        "📅 *Ежедневное расписание:*\n\n",
+        [pages.Section('', [f"   ⏰ {t} → {_md(txt)}" for t, txt in store.daily_entries()])],
+        empty="📅 Ежедневное расписание пусто.")
+
+
+# Постраничные списки: вид -> (построение страниц, от каких ключей хранилища зависят).
+# Страницы строятся один раз и живут в store.cached до изменения этих ключей
+PAGED_VIEWS = {
+    'week': (_week_pages, ('weekly_schedule',)),
+    'daily': (_daily_pages, ('daily_schedule',)),
+    'status': (_status_pages, ('send_message_text', 'scheduled_time', 'scheduled_text', 'groups',
+                               'group_timezones', 'group_titles', 'weekly_schedule', 'daily_schedule',
+                               'one_off', 'rule_schedule')),
+}
+
+
+def _view_pages(view: str) -> list:
+    build, fields = PAGED_VIEWS[view]
+    return store.cached(f'pages:{view}', build, fields)
+
+
+def _page(view: str, page: int):
+    """(текст, кнопки) страницы; номер за пределами — последняя страница"""
+    view_pages = _view_pages(view)
+    page = min(max(page, 0), len(view_pages) - 1)
+    return view_pages[page], pages.keyboard(view, page, len(view_pages))
+
+
+def _page_reply(view: str, args: str):
+    words = args.split()
+    page = int(words[0]) - 1 if words and words[0].isdigit() else 0
+    text, markup = _page(view, page)
+    return Reply(text, markup=markup)
+
+
+def page_callback(call):
+    """Кнопки ◀️ ▶️ под /show_week, /show_daily и /status"""
+    parsed = pages.parse(call.data)
+    if parsed is None or parsed[0] not in PAGED_VIEWS:
+        return None
+    text, markup = _page(*parsed)
+    return Edit(text, markup=markup)
+
+
+def server_time(message, args):
+    """Показать текущее серверное время и время группы, если у неё свой пояс."""
+    now = scheduler.clock.now()
+    day = DAYS_NAME_RU[DAYS_RU[now.weekday()]]
+    text = f"🕒 Серверное время: {now.strftime('%Y-%m-%d %H:%M:%S')} ({day})"
+    zone = group_zone(store, message.chat.id, TIMEZONE)
+    if zone:
+        local = datetime.fromtimestamp(scheduler.clock.time(), tzinfo(zone))
+        text += (f"\n🌍 Время группы ({zone}): {local.strftime('%Y-%m-%d %H:%M:%S')} "
+                 f"({DAYS_NAME_RU[DAYS_RU[local.weekday()]]})")
+    return Reply(text)
+
+
+def set_timezone(message, args):
+    """Команда /set_timezone [ID группы] <Пояс> - Часовой пояс группы (IANA, например Europe/Moscow)"""
+    words = args.split()
+    if words and words[0].lstrip('-').isdigit():
+        group_id, words = int(words[0]), words[1:]
+    else:
+        group_id = message.chat.id
+    timezones = dict(store.get('group_timezones') or {})
+
+    if not words:
+        zone = timezones.get(str(group_id), TIMEZONE) or 'время сервера'
+        return Reply(
+            f"🌍 Часовой пояс `{group_id}`: {zone}\n\n"
+            "Изменить: `/set_timezone Europe/Moscow` (в группе) или "
+            "`/set_timezone -1001234567890 Europe/Moscow`\n"
+            "Сбросить: `/set_timezone default`")
+
+    zone = words[0]
+    if zone == 'default':
+        timezones.pop(str(group_id), None)
+    elif not is_valid(zone):
+        return Reply(f"❌ Неизвестный часовой пояс: `{zone}`\n\nНужно имя IANA, например `Europe/Moscow`")
+    else:
+        timezones[str(group_id)] = zone
+    store.set('group_timezones', timezones)
+    scheduler.reschedule()
+    logger.info(f"Часовой пояс группы {group_id}: {timezones.get(str(group_id), 'по умолчанию')}")
+    return Reply(f"✅ Часовой пояс `{group_id}`: {timezones.get(str(group_id), TIMEZONE) or 'время сервера'}")
+
+
+def import_schedule(message, args):
+    """Команда /import [replace] - Загрузить расписание из CSV/JSON (подпись к файлу или ответ на файл)"""
+    document = message.document
+    if document is None and message.reply_to_message is not None:
+        document = message.reply_to_message.document
+    if document is None:
+        return Reply(
+            "📥 Пришлите файл CSV или JSON с подписью `/import` "
+            "(или ответьте `/import` на сообщение с файлом).\n\n"
+            "Колонки CSV: `kind,when,text`, например:\n"
+            "`weekly,monday 09:00,Доброе утро!`\n"
+            "`daily,12:00,Обед`\n"
+            "`one_off,2026-10-20 18:00,Собрание`\n"
+            "`rule,0 9 * * 1-5,По будням`\n\n"
+            "JSON — массив объектов с полями kind, when, text (или по объекту в строке).\n"
+            "`/import replace` — сначала удалить всё текущее расписание.\n"
+            "Выгрузить текущее: `/export` или `/export json`")
+    if document.file_size and document.file_size > bulk.DOWNLOAD_LIMIT:
+        return Reply(f"❌ Файл больше {bulk.DOWNLOAD_LIMIT // 2**20} МБ — Telegram не даст его скачать.")
+    replace = 'replace' in args.split()
+    return Download(document.file_id, lambda stream: _apply_import(stream, replace))
+
+
+def _apply_import(stream, replace: bool):
+    """Проверяет файл целиком и, если ошибок нет, применяет его одной пачкой"""
+    started = perf_counter()
+    try:
+        result = bulk.load(stream, scheduler.clock.now(), MEDIA_DIR, IMPORT_MAX_ROWS)
+    except ValueError as e:
+        return Reply(f"❌ Файл не разобрать: {e}", parse_mode=None)
+
+    IMPORT_ROWS.labels('error').inc(result.error_count)
+    if result.error_count:
+        lines = [f"❌ Импорт отменён: ошибок {result.error_count} из {result.rows} строк, "
+                 f"расписание не изменено.", ""]
+        lines += [f"строка {number}: {error}" for number, error in result.errors]
+        if result.error_count > len(result.errors):
+            lines.append(f"… и ещё {result.error_count - len(result.errors)}")
+        return Reply('\n'.join(lines), parse_mode=None)
+    if not result.entries:
+        return Reply("❌ В файле нет записей.")
+
+    records = [{'op': 'clear', 'kind': kind} for kind in bulk.KINDS] if replace else []
+    records += [{'op': 'add', 'key': list(key), 'text': text} for key, text in result.entries.items()]
+    store.batch(records)
+    scheduler.reschedule()
+    IMPORT_ROWS.labels('ok').inc(result.rows)
+    elapsed = perf_counter() - started
+    logger.info(f"📥 Импорт: {len(result.entries)} записей из {result.rows} строк за {elapsed:.2f} с"
+                f"{' (с заменой)' if replace else ''}")
+    repeated = result.rows - len(result.entries)
+    return Reply(
+        f"✅ Импортировано записей: {len(result.entries)}"
+        f"{f' (повторов ключа: {repeated}, взят последний текст)' if repeated else ''}\n"
+        f"{'🗑 Прежнее расписание удалено.' if replace else 'ℹ️ Записи с тем же временем заменены.'}")
+
+
+def export_schedule(message, args):
+    """Команда /export [csv|json] - Выгрузить расписание файлом"""
+    words = args.split()
+    fmt = 'json' if words and words[0].lower() in ('json', 'jsonl') else 'csv'
+    count = len(store.entries())
+    return Document(f"schedule.{'jsonl' if fmt == 'json' else 'csv'}",
+                    lambda out: bulk.export(store, out, fmt),
+                    caption=f"📤 Записей в расписании: {count}. Загрузить обратно: /import")
+
+
+def _zone_groups(zone):
+    return [group_id for group_id in groups_by_zone(store, TIMEZONE).get(zone, ()) if owns_group(group_id)]
+
+
+def _entry_broadcast(schedule_text, groups, values):
+    """Рассылка одной записи: текст по шаблону в HTML, у каждой группы свой,
+    если в шаблоне есть {group_title}"""
+    ref, caption = media.split(schedule_text)
+
+    def wrap(values):
+        return f"🤖 <b>{templates.render(caption, values)}</b>" if caption else ''
+
+    texts = None
+    if templates.uses(caption, 'group_title'):
+        titles = store.get('group_titles') or {}
+        texts = {group_id: wrap(dict(values, group_title=titles.get(str(group_id), ''))) for group_id in groups}
+    return Broadcast(groups, wrap(values), parse_mode='HTML', media=ref, texts=texts)
+
+
+def due_broadcast(key, schedule_text, zone=TIMEZONE, slot_ts=None):
+    """Рассылка сработавшей записи по группам пояса `zone` этого процесса
+    (None, если таких групп нет).
+
+    Одноразовую запись после рассылки во всех поясах удаляет планировщик.
+    """
+    groups = _zone_groups(zone)
+    if not groups:
+        return None
+
+    where = f" {zone}" if zone else ''
+    logger.info(f"✅ ОТПРАВКА ({KIND_LABELS[key[0]]}) В {key[-1]}{where} в группы ({len(groups)}): {schedule_text}")
+    if slot_ts is None:
+        slot_ts = scheduler.clock.time()
+    return _entry_broadcast(schedule_text, groups, templates.context(slot_ts, tzinfo(zone)))
+
+
+# Длина одного сообщения в Telegram
+MESSAGE_LIMIT = 4096
+
+
+def _split_long(text: str, limit: int) -> list:
+    """Режет HTML-текст без тегов на куски не длиннее `limit`, по возможности по строкам"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+            # не разрезаем &amp; и подобные
+            amp = text.rfind('&', cut - 8, cut)
+            if amp > 0 and text.find(';', amp, cut) == -1:
+                cut = amp
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    parts.append(text)
+    return parts
+
+
+def _pack(entries: list, limit: int) -> list:
+    """[(ключи, текст)]: записи склеены через пустую строку в сообщения не длиннее `limit`"""
+    messages, keys, parts, size = [], [], [], 0
+    for key, text in entries:
+        pieces = [f"🤖 <b>{piece}</b>" for piece in _split_long(text, limit - 10)]
+        for piece in pieces:
+            if parts and size + 2 + len(piece) > limit:
+                messages.append((keys, '\n\n'.join(parts)))
+                keys, parts, size = [], [], 0
+            if key not in keys:
+                keys.append(key)
+            size += (2 if parts else 0) + len(piece)
+            parts.append(piece)
+    if parts:
+        messages.append((keys, '\n\n'.join(parts)))
+    return messages
+
+
+def due_broadcasts(items, limit: int = MESSAGE_LIMIT) -> list:
+    """Рассылки записей, сработавших вместе: [(key, slot_ts, Broadcast)].
+
+    items — [(key, text, slot_ts, zone)] от планировщика (batch=True).
+    Записи одной минуты в одном поясе идут в одни и те же группы, поэтому
+    склеиваются в одно сообщение (несколько — если длиннее лимита
+    Telegram), а одинаковые тексты отправляются один раз. Вложения и
+    шаблоны с {group_title} отправляются отдельно. key — первая запись
+    сообщения (для логов и недоставленных).
+    """
+    slots = {}
+    for key, text, ts, zone in items:
+        slots.setdefault((zone, ts), []).append((key, text))
+
+    result = []
+    for (zone, ts), entries in slots.items():
+        groups = _zone_groups(zone)
+        if not groups:
+            continue
+        values = templates.context(ts, tzinfo(zone))
+        before = len(result)
+        seen, plain = set(), []
+        for key, text in entries:
+            if text in seen:
+                COALESCED.labels('duplicate').inc()
+                continue
+            seen.add(text)
+            ref, caption = media.split(text)
+            if ref is not None or templates.uses(caption, 'group_title'):
+                result.append((key, ts, _entry_broadcast(text, groups, values)))
+            else:
+                plain.append((key, templates.render(text, values)))
+        for keys, text in _pack(plain, limit):
+            COALESCED.labels('merged').inc(len(keys) - 1)
+            result.append((keys[0], ts, Broadcast(groups, text, parse_mode='HTML')))
+
+        where = f" {zone}" if zone else ''
+        logger.info(f"✅ ОТПРАВКА ({len(entries)} зап.) В {datetime.fromtimestamp(ts, tzinfo(zone)):%H:%M}{where} "
+                    f"в группы ({len(groups)}): сообщений {len(result) - before}")
+    return result
+
+
+def log_delivery(key, group_id, broadcast, slot_ts, future):
+    """Итог доставки записи расписания в группу (Future или asyncio.Task).
+
+    Неотправленное после всех повторов уходит в очередь недоставленных.
+    """
+    if future.cancelled():
+        return
+    kind = key[0]
+    error = future.exception()
+    if error is None:
+        FIRE_LAG.labels(kind).observe(scheduler.clock.time() - slot_ts)
+        logger.info(f"✅ УСПЕШНО ОТПРАВЛЕНО ({KIND_LABELS[kind]}) в {group_id}!")
+    else:
+        logger.error(f"❌ Ошибка при отправке ({KIND_LABELS[kind]}) в {group_id}: {error}")
+        letter = dead_letters.add(group_id, broadcast.text_for(group_id), broadcast.parse_mode, error, kind,
+                                  broadcast.media)
+        logger.warning(f"📭 Сообщение #{letter['id']} в {group_id} отложено в недоставленные")
+
+
+# Все команды бота; остальные сообщения (и неизвестные команды) — handle_message.
+# Новые команды: router.register('name', handler) или @router.command('name')
+router = CommandRouter({
+    'start': start,
+    'set_group': set_group,
+    'get_group_id': get_group_id,
+    'get_group': get_group,
+    'add_group': add_group,
+    'remove_group': remove_group,
+    'send': send_message_cmd,
+    'set_schedule': set_schedule,
+    'get_scheduled': get_scheduled,
+    'edit_text': edit_text,
+    'edit_time': edit_time,
+    'status': status,
+    'help': help_command,
+    'week_schedule': week_schedule_menu,
+    'add_schedule': add_schedule,
+    'remove_schedule': remove_schedule,
+    'show_week': show_week,
+    'clear_week': clear_week,
+    'dead_letters': show_dead_letters,
+    'replay_dead': replay_dead,
+    'add_daily': add_daily,
+    'remove_daily': remove_daily,
+    'show_daily': show_daily,
+    'add_rule': add_rule,
+    'remove_rule': remove_rule,
+    'show_rules': show_rules,
+    'server_time': server_time,
+    'set_timezone': set_timezone,
+    'import': import_schedule,
+    'export': export_schedule,
+}, fallback=handle_message)
@@ -0,0 +1,393 @@
+"""Фото, документы и альбомы в рассылках.
+
+Текст записи расписания (или /edit_text) может начинаться со ссылки на
+файлы из каталога MEDIA_DIR, остальное — подпись:
+
+    photo:poster.jpg Сегодня в 19:00!
+    document:docs/report.pdf Отчёт за неделю
+    album:a.jpg,b.jpg,c.jpg Фото с встречи
+
+Файл загружается в Telegram один раз: `file_id` из ответа сохраняется
+в хранилище ('file_ids') по хешу содержимого, и следующие отправки (в
+другие группы, на следующий день) отправляют только его. Изменился файл —
+изменился хеш, и он загрузится заново; старая запись удаляется. Записей
+не больше `limit`, давно не использованные вытесняются.
+"""
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from telebot import types
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('photo', 'document', 'album')
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# Ограничения Telegram
+CAPTION_LIMIT = 1024
+ALBUM_SIZE = (2, 10)
+
+CACHE_LOOKUPS = Counter('media_file_id_cache_total', 'Поиск file_id в кэше', labels=('result',))
+UPLOAD_SECONDS = Histogram('media_upload_seconds', 'Отправка с загрузкой файла в Telegram')
+
+
+class Media(NamedTuple):
+    """Разобранная ссылка: вид ('photo', 'document', 'album') и пути в MEDIA_DIR."""
+    kind: str
+    paths: tuple
+
+
+def split(text: str):
+    """(ссылка или None, подпись): 'photo:a.jpg Текст' → ('photo:a.jpg', 'Текст')."""
+    head, _, rest = (text or '').partition(' ')
+    kind, sep, paths = head.partition(':')
+    if not sep or kind not in KINDS or not paths:
+        return None, text
+    return head, rest.strip()
+
+
+@lru_cache(maxsize=1024)
+def parse(ref: str) -> Media:
+    kind, _, paths = ref.partition(':')
+    if kind not in KINDS:
+        raise ValueError(f"неизвестный вид вложения: {kind}")
+    return Media(kind, tuple(path for path in paths.split(',') if path))
+
+
+def item_kind(path: str) -> str:
+    """Вид элемента альбома по расширению: картинка — photo, остальное — document."""
+    return 'photo' if os.path.splitext(path)[1].lower() in PHOTO_EXTENSIONS else 'document'
+
+
+def resolve(media_dir: str, path: str) -> str:
+    """Полный путь файла; выйти за пределы MEDIA_DIR нельзя."""
+    root = os.path.realpath(media_dir)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root:
+        raise ValueError(f"файл {path} вне каталога вложений")
+    return full
+
+
+def check(text: str, media_dir: str) -> Optional[str]:
+    """Описание ошибки во вложении текста или None, если всё в порядке."""
+    ref, caption = split(text)
+    if ref is None:
+        return None
+    media = parse(ref)
+    if media.kind == 'album':
+        low, high = ALBUM_SIZE
+        if not low <= len(media.paths) <= high:
+            return f"В альбоме должно быть от {low} до {high} файлов"
+        if len({item_kind(path) for path in media.paths}) > 1:
+            return "В альбоме нельзя смешивать картинки и документы"
+    elif len(media.paths) != 1:
+        return f"Для {media.kind} нужен один файл (несколько — album:)"
+    if len(caption) > CAPTION_LIMIT:
+        return f"Подпись длиннее {CAPTION_LIMIT} символов"
+    for path in media.paths:
+        try:
+            if not os.path.isfile(resolve(media_dir, path)):
+                return f"Файл {path} не найден"
+        except ValueError as e:
+            return str(e).capitalize()
+    return None
+
+
+def _file_id(message, kind: str) -> str:
+    """file_id из ответа Telegram (у фото — самый большой размер)."""
+    if kind == 'photo':
+        return message.photo[-1].file_id
+    return message.document.file_id
+
+
+def _stale_file_id(error: Exception) -> bool:
+    """Telegram не узнал file_id — запись кэша устарела, нужно загрузить заново."""
+    description = str(getattr(error, 'description', '') or error).lower()
+    return getattr(error, 'error_code', None) == 400 and (
+        'file identifier' in description or 'file_reference' in description)
+
+
+class FileIdCache:
+    """file_id загруженных файлов по хешу содержимого, в хранилище ('file_ids').
+
+    Ключ — 'вид:sha256' (file_id фото и документа у Telegram разные).
+    Хеш файла пересчитывается, только когда изменились его размер или
+    время изменения. `_lock` защищает только словари в памяти; запись в
+    хранилище идёт вне его (под `_save_lock`), чтобы `get` не ждал диска.
+    """
+
+    def __init__(self, store, limit: int = 1000):
+        self._store = store
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._entries = {key: dict(entry) for key, entry in (store.get('file_ids') or {}).items()}
+        self._digests = {}  # путь -> (mtime_ns, size, sha256)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, kind: str, path: str) -> str:
+        stat = os.stat(path)
+        with self._lock:
+            known = self._digests.get(path)
+        if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return f"{kind}:{known[2]}"
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        with self._lock:
+            self._digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        if known is not None and known[2] != digest:
+            # файл изменился: его прежний file_id больше не нужен
+            logger.info(f"🖼 Файл {path} изменился, загрузим заново")
+            for old_kind in ('photo', 'document'):
+                self.invalidate(f"{old_kind}:{known[2]}")
+        return f"{kind}:{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # мог загрузить другой процесс (шард); записи копируем —
+                # время использования меняется только у своей копии
+                self._entries.update((k, dict(v)) for k, v in (self._store.get('file_ids') or {}).items())
+                entry = self._entries.get(key)
+            if entry is None:
+                CACHE_LOOKUPS.labels('miss').inc()
+                return None
+            # время использования сохраняется вместе со следующим изменением
+            entry['used'] = time.time()
+            CACHE_LOOKUPS.labels('hit').inc()
+            return entry['file_id']
+
+    def put(self, key: str, file_id: str) -> None:
+        with self._lock:
+            self._entries[key] = {'file_id': file_id, 'used': time.time()}
+        self._save(key)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return
+        self._save(key)
+
+    def _save(self, key: str) -> None:
+        """Меняет в хранилище только запись `key` (и время использования
+        остальных) — чтением и записью за одну операцию `store.update`, чтобы
+        не затереть file_id, сохранённые другими процессами (шардами)."""
+        def merge(stored):
+            entries = {k: dict(v) for k, v in (stored or {}).items()}
+            for k, entry in entries.items():
+                if k in local:
+                    entry['used'] = max(entry['used'], local[k]['used'])
+            if key in local:
+                entries[key] = dict(local[key])
+            else:
+                entries.pop(key, None)
+            if len(entries) > self.limit:
+                oldest = sorted(entries, key=lambda k: entries[k]['used'])
+                for old in oldest[:len(entries) - self.limit]:
+                    del entries[old]
+            return entries
+
+        with self._save_lock:
+            with self._lock:
+                local = {k: dict(v) for k, v in self._entries.items()}
+            stored = self._store.update('file_ids', merge)
+            with self._lock:
+                # изменённое в памяти, пока шла запись, не откатываем
+                changed = {k for k in local.keys() | self._entries.keys() if self._entries.get(k) != local.get(k)}
+                entries = {k: dict(v) for k, v in stored.items() if k not in changed}
+                entries.update((k, self._entries[k]) for k in changed if k in self._entries)
+                self._entries = entries
+
+
+class _Sender:
+    """Общее для синхронной и асинхронной отправки: пути, ключи кэша, альбомы."""
+
+    def __init__(self, bot, cache: FileIdCache, media_dir: str):
+        self._bot = bot
+        self._cache = cache
+        self._media_dir = media_dir
+
+    def _items(self, media: Media) -> list:
+        """[(вид, полный путь, ключ кэша, file_id или None)] файлов вложения."""
+        items = []
+        for path in media.paths:
+            full = resolve(self._media_dir, path)
+            kind = item_kind(path) if media.kind == 'album' else media.kind
+            key = self._cache.key(kind, full)
+            items.append((kind, full, key, self._cache.get(key)))
+        return items
+
+    @staticmethod
+    def _album(items: list, files: list, text: str, parse_mode) -> list:
+        """InputMedia для send_media_group; открытые файлы добавляются в `files`."""
+        album = []
+        for i, (kind, full, _, file_id) in enumerate(items):
+            source = file_id
+            if source is None:
+                source = open(full, 'rb')
+                files.append(source)
+            cls = types.InputMediaPhoto if kind == 'photo' else types.InputMediaDocument
+            if i == 0 and text:
+                album.append(cls(source, caption=text, parse_mode=parse_mode))
+            else:
+                album.append(cls(source))
+        return album
+
+    def _remember(self, items: list, messages) -> None:
+        for (kind, _, key, file_id), message in zip(items, messages):
+            if file_id is None:
+                self._cache.put(key, _file_id(message, kind))
+
+    def _forget(self, items: list) -> None:
+        for _, _, key, file_id in items:
+            if file_id is not None:
+                self._cache.invalidate(key)
+
+
+class MediaSender(_Sender):
+    """send(chat_id, text, media=None, **kwargs) для `DeliveryEngine`.
+
+    Пока файл загружается в первый чат, отправки того же вложения в
+    другие чаты ждут и потом берут готовый file_id.
+    """
+
+    def __init__(self, bot, cache: FileIdCache, media_dir: str):
+        super().__init__(bot, cache, media_dir)
+        self._lock = threading.Lock()
+        self._uploads = {}  # ссылка -> [threading.Lock, сколько потоков её держат или ждут]
+
+    def send(self, chat_id, text: str, media: str = None, **kwargs):
+        if media is None:
+            return self._bot.send_message(chat_id, text, **kwargs)
+        items = self._items(parse(media))
+        if all(file_id is not None for *_, file_id in items):
+            try:
+                return self._send(chat_id, parse(media).kind, items, text, **kwargs)
+            except Exception as e:
+                if not _stale_file_id(e):
+                    raise
+                logger.warning(f"🖼 Telegram не узнал file_id вложения {media}, загрузим заново")
+                self._forget(items)
+        with self._uploading(media):
+            # пока ждали, файл мог загрузить другой поток
+            items = self._items(parse(media))
+            if all(file_id is not None for *_, file_id in items):
+                return self._send(chat_id, parse(media).kind, items, text, **kwargs)
+            started = time.perf_counter()
+            result = self._send(chat_id, parse(media).kind, items, text, **kwargs)
+            UPLOAD_SECONDS.observe(time.perf_counter() - started)
+            return result
+
+    @contextlib.contextmanager
+    def _uploading(self, media: str):
+        """Блокировка загрузки вложения; убирается, когда её никто не ждёт."""
+        with self._lock:
+            upload = self._uploads.setdefault(media, [threading.Lock(), 0])
+            upload[1] += 1
+        try:
+            with upload[0]:
+                yield
+        finally:
+            with self._lock:
+                upload[1] -= 1
+                if not upload[1]:
+                    del self._uploads[media]
+
+    def _send(self, chat_id, kind: str, items: list, text: str, parse_mode=None, **kwargs):
+        files = []
+        try:
+            if kind == 'album':
+                messages = self._bot.send_media_group(chat_id, self._album(items, files, text, parse_mode), **kwargs)
+                self._remember(items, messages)
+                return messages
+            _, full, _, file_id = items[0]
+            source = file_id
+            if source is None:
+                source = open(full, 'rb')
+                files.append(source)
+            send = self._bot.send_photo if kind == 'photo' else self._bot.send_document
+            message = send(chat_id, source, caption=text or None, parse_mode=parse_mode, **kwargs)
+            self._remember(items, [message])
+            return message
+        finally:
+            for f in files:
+                f.close()
+
+
+class AsyncMediaSender(_Sender):
+    """То же для AsyncTeleBot и `AsyncDeliveryEngine`.
+
+    Хеширование файлов и запись file_id в хранилище — в потоке
+    (`asyncio.to_thread`), чтобы не останавливать цикл событий.
+    """
+
+    def __init__(self, bot, cache: FileIdCache, media_dir: str):
+        super().__init__(bot, cache, media_dir)
+        self._uploads = {}  # ссылка -> [asyncio.Lock, сколько задач её держат или ждут]
+
+    async def send(self, chat_id, text: str, media: str = None, **kwargs):
+        if media is None:
+            return await self._bot.send_message(chat_id, text, **kwargs)
+        items = await asyncio.to_thread(self._items, parse(media))
+        if all(file_id is not None for *_, file_id in items):
+            try:
+                return await self._send(chat_id, parse(media).kind, items, text, **kwargs)
+            except Exception as e:
+                if not _stale_file_id(e):
+                    raise
+                logger.warning(f"🖼 Telegram не узнал file_id вложения {media}, загрузим заново")
+                await asyncio.to_thread(self._forget, items)
+        async with self._uploading(media):
+            items = await asyncio.to_thread(self._items, parse(media))
+            if all(file_id is not None for *_, file_id in items):
+                return await self._send(chat_id, parse(media).kind, items, text, **kwargs)
+            started = time.perf_counter()
+            result = await self._send(chat_id, parse(media).kind, items, text, **kwargs)
+            UPLOAD_SECONDS.observe(time.perf_counter() - started)
+            return result
+
+    @contextlib.asynccontextmanager
+    async def _uploading(self, media: str):
+        upload = self._uploads.setdefault(media, [asyncio.Lock(), 0])
+        upload[1] += 1
+        try:
+            async with upload[0]:
+                yield
+        finally:
+            upload[1] -= 1
+            if not upload[1]:
+                del self._uploads[media]
+
+    async def _send(self, chat_id, kind: str, items: list, text: str, parse_mode=None, **kwargs):
+        files = []
+        try:
+            if kind == 'album':
+                messages = await self._bot.send_media_group(chat_id, self._album(items, files, text, parse_mode), **kwargs)
+                await asyncio.to_thread(self._remember, items, messages)
+                return messages
+            _, full, _, file_id = items[0]
+            source = file_id
+            if source is None:
+                source = open(full, 'rb')
+                files.append(source)
+            send = self._bot.send_photo if kind == 'photo' else self._bot.send_document
+            message = await send(chat_id, source, caption=text or None, parse_mode=parse_mode, **kwargs)
+            await asyncio.to_thread(self._remember, items, [message])
+            return message
+        finally:
+            for f in files:
+                f.close()
@@ -0,0 +1,97 @@
+"""Постраничный вывод длинных списков (/show_week, /show_daily, /status).
+
+Текст режется на страницы не длиннее PAGE_LIMIT по границам строк (у
+Telegram предел 4096 символов на сообщение). Раздел, не поместившийся
+на страницу, продолжается на следующей со своим заголовком.
+
+Под сообщением — кнопки ◀️ N/M ▶️ с callback_data 'page:<вид>:<номер>';
+по нажатию бот заменяет текст сообщения нужной страницей. Список страниц
+строится один раз и кэшируется до изменения расписания (`store.cached`),
+так что листание — это взять элемент списка.
+"""
+from typing import NamedTuple, Optional
+
+from telebot import types
+
+PAGE_LIMIT = 3500
+PREFIX = 'page'
+
+
+class Section(NamedTuple):
+    """Раздел страницы: заголовок (без разметки, может быть пустым) и строки."""
+    title: str
+    lines: list
+
+
+def _split(line: str, limit: int) -> list:
+    """Слишком длинная строка — кусками; экранирование '\\x' не разрываем."""
+    pieces = []
+    while len(line) > limit:
+        cut = limit
+        if line[cut - 1] == '\\':
+            cut -= 1
+        pieces.append(line[:cut])
+        line = line[cut:]
+    pieces.append(line)
+    return pieces
+
+
+def paginate(header: str, sections, limit: int = PAGE_LIMIT, empty: str = '') -> list:
+    """Страницы текста: `header` в начале каждой, дальше разделы по строкам.
+
+    Без строк — одна страница `empty` (или только заголовок).
+    """
+    pages, lines, size = [], [], len(header)
+
+    def add(line):
+        nonlocal size
+        lines.append(line)
+        size += len(line) + 1
+
+    def flush():
+        nonlocal lines, size
+        pages.append(header + '\n'.join(lines).rstrip('\n'))
+        lines, size = [], len(header)
+
+    for section in sections:
+        heading = f"*{section.title}:*" if section.title else ''
+        continued = f"*{section.title} (продолжение):*" if section.title else ''
+        first = True
+        for line in section.lines:
+            for piece in _split(line, limit - len(header) - len(continued) - 2):
+                need = len(piece) + 1 + (len(heading) + 1 if first and heading else 0)
+                if lines and size + need > limit:
+                    flush()
+                    if not first and continued:
+                        add(continued)
+                if first and heading:
+                    add(heading)
+                add(piece)
+                first = False
+        if not first:
+            add('')
+    if lines:
+        flush()
+    return pages or [empty or header]
+
+
+def keyboard(view: str, page: int, total: int) -> Optional[types.InlineKeyboardMarkup]:
+    """Кнопки листания; для одной страницы — None."""
+    if total <= 1:
+        return None
+    markup = types.InlineKeyboardMarkup()
+    markup.row(
+        types.InlineKeyboardButton('◀️', callback_data=f"{PREFIX}:{view}:{(page - 1) % total}"),
+        types.InlineKeyboardButton(f"{page + 1}/{total}", callback_data=f"{PREFIX}:{view}:{page}"),
+        types.InlineKeyboardButton('▶️', callback_data=f"{PREFIX}:{view}:{(page + 1) % total}"),
+    )
+    return markup
+
+
+def parse(data: Optional[str]):
+    """(вид, номер страницы) из callback_data или None."""
+    prefix, _, rest = (data or '').partition(':')
+    view, _, page = rest.partition(':')
+    if prefix != PREFIX or not view or not page.isdigit():
+        return None
+    return view, int(page)
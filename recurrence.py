@@ -0,0 +1,310 @@
+"""Правила повторения: выражения cron и RRULE (RFC 5545).
+
+    0 9 * * 1-5                                   будни в 09:00
+    */30 8-18 * * *                               каждые полчаса с 8 до 18
+    @daily                                        каждый день в 00:00
+    FREQ=DAILY;INTERVAL=2;BYHOUR=9;BYMINUTE=0     через день в 09:00
+    FREQ=MONTHLY;BYDAY=-1FR;BYHOUR=18;BYMINUTE=0  последняя пятница месяца
+    FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10              10 раз по пн и ср
+
+Из RRULE поддерживаются FREQ (DAILY, WEEKLY, MONTHLY, YEARLY), INTERVAL,
+BYMONTH, BYMONTHDAY (в том числе отрицательные — с конца месяца), BYDAY (с
+номером: 2MO, -1FR), BYHOUR, BYMINUTE, DTSTART, UNTIL и COUNT; UNTIL и
+DTSTART — в формате YYYYMMDD или YYYYMMDDTHHMMSS. В cron в поле дня месяца
+можно писать L — последний день.
+
+Время правил — «настенное», без пояса: планировщик переводит его в момент
+по часам каждой группы. `next_after(t)` идёт по дням, а не по минутам:
+неподходящие месяцы пропускаются целиком, время внутри дня ищется
+бинарным поиском по отсортированному списку.
+"""
+import bisect
+import calendar
+from datetime import date, datetime, time as dtime, timedelta
+from functools import lru_cache
+from typing import Optional
+
+# Дальше этого не ищем (29 февраля бывает раз в 8 лет)
+SEARCH_DAYS = 366 * 8
+# Неделя RRULE без DTSTART считается от этого понедельника
+_ANCHOR = date(1970, 1, 5)
+
+_RRULE_DAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+_CRON_MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+_CRON_DAYS = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+_CRON_MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+
+class Recurrence:
+    """Скомпилированное правило: времена суток и проверка дня."""
+
+    def __init__(self, spec: str, times: list, day_matches, months=None,
+                 start: datetime = None, until: datetime = None, count: int = None):
+        if not times:
+            raise ValueError("в правиле нет ни одного времени срабатывания")
+        self.spec = spec
+        self.times = sorted(set(times))  # минуты суток
+        self._day_matches = day_matches
+        self._months = months  # None — любой месяц
+        self.start = start
+        self.until = until
+        self.count = count
+        self._last = None
+
+    def next_after(self, t: datetime) -> Optional[datetime]:
+        """Первое срабатывание строго позже `t`; None, если их больше не будет."""
+        until = self.until
+        if self.count is not None:
+            last = self._last_occurrence()
+            until = last if until is None else min(until, last)
+        return self._next(t, until)
+
+    def occurrences(self, t: datetime, limit: int) -> list:
+        """До `limit` ближайших срабатываний после `t`."""
+        result = []
+        while len(result) < limit:
+            t = self.next_after(t)
+            if t is None:
+                break
+            result.append(t)
+        return result
+
+    def _last_occurrence(self) -> datetime:
+        if self._last is None:
+            t = self.start - timedelta(minutes=1)
+            for _ in range(self.count):
+                nxt = self._next(t, self.until)
+                if nxt is None:
+                    break
+                t = nxt
+            self._last = t
+        return self._last
+
+    def _next(self, t: datetime, until) -> Optional[datetime]:
+        if self.start is not None and t < self.start:
+            t = self.start - timedelta(minutes=1)
+        day = t.date()
+        minute = t.hour * 60 + t.minute
+        last_day = day + timedelta(days=SEARCH_DAYS)
+        if until is not None:
+            last_day = min(last_day, until.date())
+        while day <= last_day:
+            if self._months is not None and day.month not in self._months:
+                # весь месяц не подходит — сразу к первому числу следующего
+                day = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+                minute = -1
+                continue
+            if self._day_matches(day):
+                i = bisect.bisect_right(self.times, minute)
+                if i < len(self.times):
+                    m = self.times[i]
+                    result = datetime.combine(day, dtime(m // 60, m % 60))
+                    return None if until is not None and result > until else result
+            day += timedelta(days=1)
+            minute = -1
+        return None
+
+
+@lru_cache(maxsize=4096)
+def parse(spec: str) -> Recurrence:
+    """Правило из строки (cron или RRULE); ValueError, если не разобрать."""
+    spec = spec.strip()
+    if 'FREQ=' in spec.upper():
+        return _parse_rrule(spec)
+    return _parse_cron(spec)
+
+
+def normalize(spec: str, now: datetime) -> str:
+    """Приводит правило к виду для хранения.
+
+    RRULE без DTSTART получает DTSTART=now: от него считаются INTERVAL и
+    COUNT, и из него берутся время и день, если они не заданы.
+    """
+    spec = ' '.join(spec.split())
+    if 'FREQ=' not in spec.upper():
+        return spec
+    parts = [p for p in spec.upper().removeprefix('RRULE:').split(';') if p]
+    if not any(p.startswith('DTSTART=') for p in parts):
+        parts.insert(0, f"DTSTART={now:%Y%m%dT%H%M00}")
+    return ';'.join(parts)
+
+
+# --- RRULE -------------------------------------------------------------
+
+def _parse_stamp(value: str) -> datetime:
+    value = value.rstrip('Z')
+    for fmt in ('%Y%m%dT%H%M%S', '%Y%m%dT%H%M', '%Y%m%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"неверная дата: {value}")
+
+
+def _ints(value: str, low: int, high: int, allow_negative: bool = False) -> list:
+    result = []
+    for item in value.split(','):
+        n = int(item)
+        if not (low <= abs(n) <= high) or (n < 0 and not allow_negative):
+            raise ValueError(f"значение вне диапазона: {n}")
+        result.append(n)
+    return result
+
+
+def _parse_rrule(spec: str) -> Recurrence:
+    fields = {}
+    for part in spec.upper().removeprefix('RRULE:').split(';'):
+        if not part:
+            continue
+        name, sep, value = part.partition('=')
+        if not sep or not value:
+            raise ValueError(f"неверная часть правила: {part}")
+        fields[name] = value
+
+    freq = fields.pop('FREQ', None)
+    if freq not in ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY'):
+        raise ValueError("FREQ должен быть DAILY, WEEKLY, MONTHLY или YEARLY")
+    interval = int(fields.pop('INTERVAL', '1'))
+    if interval < 1:
+        raise ValueError("INTERVAL должен быть положительным")
+    start = _parse_stamp(fields.pop('DTSTART')) if 'DTSTART' in fields else None
+    until = fields.pop('UNTIL', None)
+    if until is not None:
+        # UNTIL без времени — включая весь этот день
+        until = _parse_stamp(until) if 'T' in until else _parse_stamp(until).replace(hour=23, minute=59)
+    count = int(fields.pop('COUNT')) if 'COUNT' in fields else None
+    if count is not None and (count < 1 or start is None):
+        raise ValueError("COUNT должен быть положительным и требует DTSTART")
+    months = set(_ints(fields.pop('BYMONTH'), 1, 12)) if 'BYMONTH' in fields else None
+    monthdays = _ints(fields.pop('BYMONTHDAY'), 1, 31, allow_negative=True) if 'BYMONTHDAY' in fields else None
+    weekdays = []
+    for item in fields.pop('BYDAY').split(',') if 'BYDAY' in fields else ():
+        n, name = item[:-2], item[-2:]
+        if name not in _RRULE_DAYS or (n and not n.lstrip('+-').isdigit()):
+            raise ValueError(f"неверный день: {item}")
+        weekdays.append((int(n) if n else None, _RRULE_DAYS.index(name)))
+    hours = _ints(fields.pop('BYHOUR'), 0, 23) if 'BYHOUR' in fields else None
+    minutes = _ints(fields.pop('BYMINUTE'), 0, 59) if 'BYMINUTE' in fields else None
+    if fields:
+        raise ValueError(f"неподдерживаемые части правила: {', '.join(fields)}")
+
+    if start is None and (hours is None or minutes is None):
+        raise ValueError("нужны BYHOUR и BYMINUTE или DTSTART")
+    hours = hours if hours is not None else [start.hour]
+    minutes = minutes if minutes is not None else [start.minute]
+
+    # недостающие дни берутся из DTSTART, как в RFC 5545
+    if start is not None:
+        if freq == 'WEEKLY' and not weekdays:
+            weekdays = [(None, start.weekday())]
+        elif freq == 'MONTHLY' and not weekdays and monthdays is None:
+            monthdays = [start.day]
+        elif freq == 'YEARLY' and not weekdays and monthdays is None:
+            monthdays = [start.day]
+            months = months or {start.month}
+    if freq == 'WEEKLY' and not weekdays:
+        raise ValueError("для FREQ=WEEKLY нужен BYDAY или DTSTART")
+
+    anchor = start.date() if start is not None else _ANCHOR
+    year_scope = freq == 'YEARLY' and months is None
+
+    def day_matches(day: date) -> bool:
+        if freq == 'DAILY' and (day - anchor).days % interval:
+            return False
+        if freq == 'WEEKLY' and ((day - anchor).days + anchor.weekday()) // 7 % interval:
+            return False
+        if freq == 'MONTHLY' and ((day.year - anchor.year) * 12 + day.month - anchor.month) % interval:
+            return False
+        if freq == 'YEARLY' and (day.year - anchor.year) % interval:
+            return False
+        if monthdays is not None:
+            days_in_month = calendar.monthrange(day.year, day.month)[1]
+            if day.day not in monthdays and day.day - days_in_month - 1 not in monthdays:
+                return False
+        if weekdays:
+            return any(wd == day.weekday() and (n is None or _nth_matches(day, n, year_scope))
+                       for n, wd in weekdays)
+        return True
+
+    return Recurrence(spec, [h * 60 + m for h in hours for m in minutes], day_matches, months,
+                      start, until, count)
+
+
+def _nth_matches(day: date, n: int, year_scope: bool) -> bool:
+    """Это n-й (с конца, если n < 0) такой день недели в месяце (или в году)."""
+    if year_scope:
+        position = day.timetuple().tm_yday
+        total = 366 if calendar.isleap(day.year) else 365
+    else:
+        position = day.day
+        total = calendar.monthrange(day.year, day.month)[1]
+    if n > 0:
+        return (position - 1) // 7 + 1 == n
+    return -((total - position) // 7 + 1) == n
+
+
+# --- cron --------------------------------------------------------------
+
+def _cron_field(value: str, low: int, high: int, names=()) -> set:
+    result = set()
+    for item in value.lower().split(','):
+        body, _, step = item.partition('/')
+        step = int(step) if step else 1
+        if step < 1:
+            raise ValueError(f"неверный шаг: {item}")
+        if body == '*':
+            first, last = low, high
+        else:
+            first_s, _, last_s = body.partition('-')
+            first = _cron_value(first_s, names)
+            last = _cron_value(last_s, names) if last_s else (high if step > 1 else first)
+        if not (low <= first <= high and low <= last <= high and first <= last):
+            raise ValueError(f"значение вне диапазона: {item}")
+        result.update(range(first, last + 1, step))
+    return result
+
+
+def _cron_value(value: str, names) -> int:
+    if value in names:
+        return names.index(value) + (1 if names is _CRON_MONTHS else 0)
+    return int(value)
+
+
+def _parse_cron(spec: str) -> Recurrence:
+    expr = _CRON_MACROS.get(spec.lower(), spec)
+    parts = expr.split()
+    if len(parts) != 5:
+        raise ValueError("в выражении cron должно быть 5 полей: минута час день месяц день_недели")
+    minute_f, hour_f, dom_f, month_f, dow_f = parts
+    minutes = _cron_field(minute_f, 0, 59)
+    hours = _cron_field(hour_f, 0, 23)
+    last_day = dom_f.upper() == 'L'
+    doms = None if dom_f == '*' or last_day else _cron_field(dom_f, 1, 31)
+    months = None if month_f == '*' else _cron_field(month_f, 1, 12, _CRON_MONTHS)
+    # cron: 0 и 7 — воскресенье; у datetime.weekday() понедельник — 0
+    dows = None if dow_f == '*' else {(d - 1) % 7 for d in _cron_field(dow_f, 0, 7, _CRON_DAYS)}
+
+    def dom_matches(day: date) -> bool:
+        if last_day:
+            return day.day == calendar.monthrange(day.year, day.month)[1]
+        return day.day in doms
+
+    restricted_dom = doms is not None or last_day
+
+    def day_matches(day: date) -> bool:
+        if restricted_dom and dows is not None:
+            # как в cron: если заданы оба поля, достаточно любого
+            return dom_matches(day) or day.weekday() in dows
+        if restricted_dom:
+            return dom_matches(day)
+        return dows is None or day.weekday() in dows
+
+    return Recurrence(spec, [h * 60 + m for h in hours for m in minutes], day_matches, months)
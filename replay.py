@@ -0,0 +1,175 @@
+"""Прогон расписания по отрезку дат на виртуальных часах.
+
+Планировщик (тот же `Scheduler`, что в боте) работает с `VirtualClock`,
+который перескакивает сразу к следующему срабатыванию, поэтому месяц
+проходится за секунды. На выходе — JSON-строки в том порядке, в каком бот
+сделал бы рассылки:
+
+    {"at": "2026-11-02 09:00", "zone": "", "key": ["weekly", "monday", "09:00"], "text": "...", "groups": [...]}
+
+`at` — время записи в поясе `zone` (пустой — время сервера).
+
+Расписание берётся из хранилища бота (копия в памяти, на диск ничего не
+пишется) или генерируется (--synthetic):
+
+    python replay.py 2026-11-01 2026-12-01 --out deliveries.jsonl
+    python replay.py 2026-11-01 2026-12-01 --synthetic 50000 --groups 3 --out /dev/null
+"""
+import argparse
+import copy
+import json
+import logging
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from clock import VirtualClock
+from schedule_index import WEEKDAYS, iter_entries, lookup_text
+from scheduler import Scheduler
+from storage import apply_mutation
+from timezones import groups_by_zone, tzinfo
+
+logger = logging.getLogger(__name__)
+
+
+class Delivery(NamedTuple):
+    """Одна рассылка: запись `key` с текстом `text` во все `groups` пояса `zone`."""
+    slot_ts: float
+    zone: str
+    key: tuple
+    text: str
+    groups: list
+
+
+class MemoryStore:
+    """Расписание только в памяти — изменения при прогоне не сохраняются.
+
+    Умеет ровно то, что нужно планировщику и `replay()`.
+    """
+
+    def __init__(self, data: dict):
+        self.data = copy.deepcopy(data)
+
+    @classmethod
+    def copy_of(cls, store) -> 'MemoryStore':
+        """Копия записей, групп и их поясов из JournalStore или SQLiteStore."""
+        data = {'weekly_schedule': {day: {} for day in WEEKDAYS}, 'daily_schedule': {}, 'one_off': {},
+                'groups': list(store.get('groups') or []),
+                'group_timezones': dict(store.get('group_timezones') or {})}
+        for key in store.entries():
+            apply_mutation(data, {'op': 'add', 'key': key, 'text': store.text(key)})
+        return cls(data)
+
+    def get(self, name: str, default=None):
+        return self.data.get(name, default)
+
+    def entries(self):
+        return list(iter_entries(self.data))
+
+    def text(self, key: tuple):
+        return lookup_text(self.data, key)
+
+    def add(self, key: tuple, text: str) -> None:
+        apply_mutation(self.data, {'op': 'add', 'key': key, 'text': text})
+
+    def remove(self, key: tuple) -> None:
+        apply_mutation(self.data, {'op': 'remove', 'key': key})
+
+    def set(self, name: str, value) -> None:
+        self.data[name] = value
+
+
+def replay(store, start: datetime, end: datetime, default_zone: str = ''):
+    """Рассылки в [start, end) по порядку, как их сделал бы бот.
+
+    `store` меняется так же, как при работе бота (отправленные одноразовые
+    записи удаляются), поэтому передавайте копию — `MemoryStore`.
+    """
+    clock = VirtualClock(start)
+    # checkpoint=inf: high-water mark в хранилище не пишем; без него нет и
+    # догона «пропущенного» до start
+    scheduler = Scheduler(store, misfire_policy='skip', checkpoint=float('inf'), clock=clock,
+                          zones=lambda: list(groups_by_zone(store, default_zone)) or [default_zone])
+    end_ts = end.timestamp()
+    while clock.time() < end_ts:
+        due, delay = scheduler.step()
+        if not due:
+            clock.advance(delay)
+            continue
+        for key, slot_ts, zone in due:
+            text = store.text(key)
+            # как due_broadcast: только группы этого пояса
+            groups = groups_by_zone(store, default_zone).get(zone)
+            if text is not None and groups:
+                yield Delivery(slot_ts, zone, key, text, groups)
+            scheduler.done(key)
+
+
+def synthetic_store(entries: int, groups: int, start: datetime, days: int) -> MemoryStore:
+    """entries записей: треть недельных, треть ежедневных, остальное — одноразовые в пределах `days`."""
+    rnd = random.Random(entries)
+    store = MemoryStore({'weekly_schedule': {day: {} for day in WEEKDAYS}, 'daily_schedule': {}, 'one_off': {},
+                         'groups': [-1000000 - i for i in range(groups)]})
+    for i in range(entries):
+        time_str = f"{rnd.randrange(24):02d}:{rnd.randrange(60):02d}"
+        kind = i % 3
+        if kind == 0:
+            store.add(('weekly', rnd.choice(WEEKDAYS), time_str), f"w{i}")
+        elif kind == 1:
+            store.add(('daily', time_str), f"d{i}")
+        else:
+            date_str = (start + timedelta(days=rnd.randrange(max(days, 1)))).strftime('%Y-%m-%d')
+            store.add(('one_off', date_str, time_str), f"o{i}")
+    return store
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Прогон расписания по датам без ожидания')
+    parser.add_argument('start', help='начало, YYYY-MM-DD или "YYYY-MM-DD HH:MM"')
+    parser.add_argument('end', help='конец (не включительно)')
+    parser.add_argument('--synthetic', type=int, metavar='N', help='вместо хранилища бота — N случайных записей')
+    parser.add_argument('--groups', type=int, help='подставить столько групп вместо сохранённых')
+    parser.add_argument('--timezone', help='пояс групп без своего (по умолчанию TIMEZONE бота)')
+    parser.add_argument('--out', default='-', help='файл для JSON-строк, "-" — stdout')
+    args = parser.parse_args(argv)
+
+    start = datetime.fromisoformat(args.start)
+    end = datetime.fromisoformat(args.end)
+    if args.synthetic is not None:
+        store = synthetic_store(args.synthetic, args.groups or 1, start, (end - start).days)
+        default_zone = args.timezone or ''
+    else:
+        from config import TIMEZONE, store as bot_store
+        store = MemoryStore.copy_of(bot_store)
+        bot_store.close()
+        if args.groups is not None:
+            store.set('groups', [-1000000 - i for i in range(args.groups)])
+        default_zone = TIMEZONE if args.timezone is None else args.timezone
+
+    out = sys.stdout if args.out == '-' else open(args.out, 'w', encoding='utf-8')
+    started = time.perf_counter()
+    fired = sent = 0
+    try:
+        for delivery in replay(store, start, end, default_zone):
+            out.write(json.dumps({
+                'at': datetime.fromtimestamp(delivery.slot_ts, tzinfo(delivery.zone)).strftime('%Y-%m-%d %H:%M'),
+                'zone': delivery.zone,
+                'key': delivery.key,
+                'text': delivery.text,
+                'groups': delivery.groups,
+            }, ensure_ascii=False) + '\n')
+            fired += 1
+            sent += len(delivery.groups)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print(f"⏩ {start:%Y-%m-%d %H:%M} → {end:%Y-%m-%d %H:%M}: срабатываний {fired}, "
+          f"сообщений {sent}, за {elapsed:.2f} с", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
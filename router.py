@@ -0,0 +1,77 @@
+"""Таблица команд: имя команды → обработчик.
+
+telebot проверяет обработчики по очереди, разбирая текст заново для
+каждого, и первый подходящий выигрывает — обработчик «на всё», стоящий
+раньше команд, их перекрывает. Здесь команда разбирается один раз и
+ищется в словаре; всё, что не команда из таблицы, уходит в единственный
+запасной обработчик.
+"""
+from typing import NamedTuple, Optional
+
+
+class Command(NamedTuple):
+    """Разобранная команда: `/name@bot args` → ('name', 'args')."""
+    name: str
+    args: str
+
+
+def parse_command(text: Optional[str]) -> Optional[Command]:
+    """Команда из текста сообщения или None, если это не команда.
+
+    Имя от аргументов отделяет любой пробельный символ (и перевод строки).
+    """
+    if not text or not text.startswith('/'):
+        return None
+    head, *rest = text.split(maxsplit=1)
+    name = head[1:].split('@', 1)[0]
+    if not name:
+        return None
+    return Command(name, rest[0].strip() if rest else '')
+
+
+class CommandRouter:
+    """Словарь команд и запасной обработчик для всего остального.
+
+    Обработчики — функции `handler(message, args)`, как в handlers.py;
+    `args` — текст после имени команды (у запасного обработчика пустой).
+    """
+
+    def __init__(self, commands: dict = None, fallback=None):
+        self._commands = {}
+        self._fallback = fallback
+        for name, handler in (commands or {}).items():
+            self.register(name, handler)
+
+    def register(self, name: str, handler) -> None:
+        """Добавляет команду; повторная регистрация имени — ошибка."""
+        name = name.lstrip('/')
+        if name in self._commands:
+            raise ValueError(f"команда /{name} уже зарегистрирована")
+        self._commands[name] = handler
+
+    def command(self, *names: str):
+        """Декоратор: `@router.command('ping')` регистрирует функцию."""
+        def decorator(handler):
+            for name in names:
+                self.register(name, handler)
+            return handler
+        return decorator
+
+    def set_fallback(self, handler) -> None:
+        self._fallback = handler
+
+    def commands(self) -> list:
+        return list(self._commands)
+
+    def resolve(self, message) -> tuple:
+        """(обработчик, аргументы) для сообщения: команда из таблицы или
+        запасной обработчик (может быть None).
+
+        У документа команда — в подписи (`/import` с файлом).
+        """
+        command = parse_command(message.text if message.text is not None else message.caption)
+        if command is not None:
+            handler = self._commands.get(command.name)
+            if handler is not None:
+                return handler, command.args
+        return self._fallback, ''
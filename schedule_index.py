@@ -0,0 +1,177 @@
+import heapq
+from datetime import datetime
+
+import recurrence
+
+# Дни недели в порядке datetime.weekday()
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def minute_of_day(time_str: str) -> int:
+    """'HH:MM' -> номер минуты в сутках (0..1439)."""
+    hours, minutes = time_str.split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"неверное время: {time_str}")
+    return hours * 60 + minutes
+
+
+def minute_of_week(dt: datetime) -> int:
+    """Номер минуты в неделе (0..10079), неделя начинается с понедельника."""
+    return dt.weekday() * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
+
+
+def iter_entries(storage: dict):
+    """Перебирает ключи всех записей расписания из `messages_storage`.
+
+    Ключи записей:
+    ('weekly', day, 'HH:MM'), ('daily', 'HH:MM'), ('one_off', 'YYYY-MM-DD', 'HH:MM'),
+    ('rule', 'правило cron или RRULE').
+    """
+    for day, slots in storage.get('weekly_schedule', {}).items():
+        for time_str in slots:
+            yield ('weekly', day, time_str)
+    for time_str in storage.get('daily_schedule', {}):
+        yield ('daily', time_str)
+    for date_str, slots in storage.get('one_off', {}).items():
+        for time_str in slots:
+            yield ('one_off', date_str, time_str)
+    for spec in storage.get('rule_schedule', {}):
+        yield ('rule', spec)
+
+
+def lookup_text(storage: dict, key: tuple):
+    """Текст записи по ключу или None, если запись уже удалена."""
+    kind = key[0]
+    if kind == 'weekly':
+        return storage.get('weekly_schedule', {}).get(key[1], {}).get(key[2])
+    if kind == 'daily':
+        return storage.get('daily_schedule', {}).get(key[1])
+    if kind == 'rule':
+        return storage.get('rule_schedule', {}).get(key[1])
+    return storage.get('one_off', {}).get(key[1], {}).get(key[2])
+
+
+class ScheduleIndex:
+    """Скомпилированный индекс расписания.
+
+    `weekly` отображает минуту недели в список ключей (ежедневные записи
+    попадают в семь ячеек сразу), `one_off` — дату в {минута суток: ключи},
+    `rules` — текст правила повторения в ключи.
+    Поиск записей на конкретную минуту — два обращения к словарю. Даты
+    одноразовых записей дополнительно лежат в куче, чтобы прошедшие можно
+    было вычистить за время, пропорциональное их числу (`expire`).
+    """
+
+    def __init__(self):
+        self.weekly = {}
+        self.one_off = {}
+        self.rules = {}
+        self._dates = []  # куча дат 'YYYY-MM-DD' (могут быть уже удалённые)
+
+    @classmethod
+    def build(cls, storage: dict) -> 'ScheduleIndex':
+        index = cls()
+        for key in iter_entries(storage):
+            index.add(key)
+        return index
+
+    @staticmethod
+    def slots_for(key: tuple) -> list:
+        """Ячейки индекса, в которые попадает запись.
+
+        ('w', минута недели) для повторяющихся записей,
+        ('d', 'YYYY-MM-DD', минута суток) для одноразовых,
+        ('r', правило) для правил повторения.
+        """
+        kind = key[0]
+        if kind == 'weekly':
+            return [('w', WEEKDAYS.index(key[1]) * MINUTES_PER_DAY + minute_of_day(key[2]))]
+        if kind == 'daily':
+            m = minute_of_day(key[1])
+            return [('w', d * MINUTES_PER_DAY + m) for d in range(7)]
+        if kind == 'rule':
+            recurrence.parse(key[1])
+            return [('r', key[1])]
+        datetime.strptime(key[1], '%Y-%m-%d')
+        return [('d', key[1], minute_of_day(key[2]))]
+
+    def _bucket(self, slot: tuple, create: bool = False):
+        if slot[0] in ('w', 'r'):
+            table = self.weekly if slot[0] == 'w' else self.rules
+            if create:
+                return table.setdefault(slot[1], [])
+            return table.get(slot[1])
+        if create:
+            if slot[1] not in self.one_off:
+                heapq.heappush(self._dates, slot[1])
+            return self.one_off.setdefault(slot[1], {}).setdefault(slot[2], [])
+        return self.one_off.get(slot[1], {}).get(slot[2])
+
+    def add(self, key: tuple) -> list:
+        """Добавляет запись; возвращает её ячейки. ValueError при неверном ключе."""
+        slots = self.slots_for(key)
+        for slot in slots:
+            bucket = self._bucket(slot, create=True)
+            if key not in bucket:
+                bucket.append(key)
+        return slots
+
+    def remove(self, key: tuple) -> None:
+        try:
+            slots = self.slots_for(key)
+        except ValueError:
+            return
+        for slot in slots:
+            bucket = self._bucket(slot)
+            if bucket and key in bucket:
+                bucket.remove(key)
+                if not bucket:
+                    self._drop(slot)
+
+    def _drop(self, slot: tuple) -> None:
+        if slot[0] == 'w':
+            self.weekly.pop(slot[1], None)
+            return
+        if slot[0] == 'r':
+            self.rules.pop(slot[1], None)
+            return
+        day = self.one_off.get(slot[1])
+        if day is not None:
+            day.pop(slot[2], None)
+            if not day:
+                del self.one_off[slot[1]]
+
+    def expire(self, before: str) -> list:
+        """Убирает одноразовые записи на даты раньше `before`; возвращает их ключи."""
+        expired = []
+        while self._dates and self._dates[0] < before:
+            minutes = self.one_off.pop(heapq.heappop(self._dates), None)
+            for keys in (minutes or {}).values():
+                expired.extend(keys)
+        return expired
+
+    def keys_at(self, slot: tuple) -> list:
+        """Ключи записей в ячейке (копия, можно менять индекс во время обхода)."""
+        return list(self._bucket(slot) or ())
+
+    def slots(self):
+        """Все непустые ячейки индекса."""
+        for m in self.weekly:
+            yield ('w', m)
+        for date_str, minutes in self.one_off.items():
+            for m in minutes:
+                yield ('d', date_str, m)
+        for spec in self.rules:
+            yield ('r', spec)
+
+    def due(self, dt: datetime) -> list:
+        """Все записи, назначенные на минуту `dt`."""
+        due = list(self.weekly.get(minute_of_week(dt), ()))
+        day = self.one_off.get(dt.strftime('%Y-%m-%d'))
+        if day:
+            due.extend(day.get(dt.hour * 60 + dt.minute, ()))
+        return due
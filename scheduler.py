@@ -0,0 +1,456 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import date, datetime, time as dtime, timedelta
+
+from clock import SystemClock
+import recurrence
+from metrics import Histogram
+from schedule_index import MINUTES_PER_DAY, ScheduleIndex
+from timezones import tzinfo
+
+logger = logging.getLogger(__name__)
+
+TICK_SECONDS = Histogram('scheduler_tick_seconds', 'Одна итерация планировщика: поиск и постановка срабатываний')
+
+# Сколько секунд после начала минуты запись ещё считается «текущей»
+SLOT_SECONDS = 60
+
+# Что делать с пропущенными срабатываниями (простой, перезапуск):
+# 'all' — отправить все, 'latest' — только последнее по каждой записи, 'skip' — ничего
+MISFIRE_POLICIES = ('all', 'latest', 'skip')
+
+
+def _slot_ts(day, minute: int, tz=None) -> float:
+    """Метка времени (UTC) начала минуты суток `minute` дня `day` в поясе `tz`.
+
+    tz=None — локальное время сервера. Времени, которого нет из-за
+    перевода часов вперёд, соответствует момент на длину перевода позже
+    (02:30 → 03:30); из дважды повторяющегося берётся первое (fold=0).
+    """
+    return datetime.combine(day, dtime(minute // 60, minute % 60), tzinfo=tz).timestamp()
+
+
+def next_occurrence(slot: tuple, after: float, tz=None):
+    """Ближайшее срабатывание ячейки индекса в поясе `tz`, чья минута ещё не закончилась к `after`.
+
+    Для прошедших одноразовых ячеек возвращает None.
+    """
+    if slot[0] == 'd':
+        ts = _slot_ts(date.fromisoformat(slot[1]), slot[2], tz)
+        return ts if ts + SLOT_SECONDS > after else None
+
+    if slot[0] == 'r':
+        rule = recurrence.parse(slot[1])
+        # настенное время минуты, которая закончилась к after
+        wall = datetime.fromtimestamp(after - SLOT_SECONDS, tz).replace(tzinfo=None)
+        while True:
+            wall = rule.next_after(wall)
+            if wall is None:
+                return None
+            ts = _slot_ts(wall.date(), wall.hour * 60 + wall.minute, tz)
+            # у перевода часов назад настенное время идёт по второму кругу
+            if ts + SLOT_SECONDS > after:
+                return ts
+
+    weekday, minute = divmod(slot[1], MINUTES_PER_DAY)
+    today = datetime.fromtimestamp(after, tz).date()
+    day = today + timedelta(days=(weekday - today.weekday()) % 7)
+    ts = _slot_ts(day, minute, tz)
+    while ts + SLOT_SECONDS <= after:
+        day += timedelta(days=7)
+        ts = _slot_ts(day, minute, tz)
+    return ts
+
+
+class FiredRing:
+    """Какие записи уже отправлены в последние `size` минут.
+
+    Корзина на минуту в кольце из `size` корзин: при переходе на новую
+    минуту старая корзина очищается, так что память не растёт со временем
+    работы. В корзинах — целые id записей (см. `Scheduler._key_id`).
+    """
+
+    def __init__(self, size: int = 2):
+        self._minutes = [None] * size
+        self._buckets = [set() for _ in range(size)]
+
+    def add(self, minute: int, key_id: int) -> bool:
+        """Отмечает срабатывание; False, если оно уже было."""
+        i = minute % len(self._buckets)
+        bucket = self._buckets[i]
+        if self._minutes[i] != minute:
+            self._minutes[i] = minute
+            bucket.clear()
+        if key_id in bucket:
+            return False
+        bucket.add(key_id)
+        return True
+
+
+class Scheduler:
+    """Планировщик: куча ближайших срабатываний и сон до самого раннего.
+
+    В куче лежат занятые ячейки `ScheduleIndex` (минута недели или дата и
+    минута), записи на сработавшую минуту достаются из индекса одним
+    поиском. Между отправками `run()` спит на условной переменной, а
+    `run_async()` — на asyncio.Event. Обработчики, меняющие расписание,
+    вызывают `reschedule()`.
+
+    Момент, до которого расписание обработано (high-water mark), раз в
+    `checkpoint` секунд и после каждого срабатывания сохраняется в
+    хранилище ('scheduler_hwm'), так что и после kill -9 сработавшее
+    повторно не отправляется. Всё,
+    что должно было сработать между ним и запуском, а также срабатывания,
+    опоздавшие больше чем на минуту из-за зависания, отправляются по
+    `misfire_policy`, но не старше `misfire_grace` секунд. Одноразовые
+    записи на даты старше этого окна удаляются из хранилища.
+
+    Каждая ячейка стоит в куче отдельно для каждого часового пояса из
+    `zones()` (имена IANA, '' — время сервера) с заранее посчитанным
+    моментом срабатывания в UTC; после срабатывания считается только
+    следующий момент этой ячейки. Сработавшее — [(key, slot_ts, zone)].
+    Одноразовая запись удаляется, когда отработала во всех поясах
+    (`done()`), правило — когда у него не осталось срабатываний. С
+    cleanup_fired=False (несколько шардов читают одну базу, и запись ещё
+    нужна соседям) такие записи остаются в хранилище до истечения
+    `misfire_grace`.
+
+    Время берётся из `clock` (по умолчанию системные часы). С
+    `VirtualClock` вместо `run()` планировщик двигают вызовами `step()`.
+    """
+
+    def __init__(self, store, misfire_policy: str = 'latest', misfire_grace: float = 3600,
+                 checkpoint: float = 60, clock=None, zones=None, cleanup_fired: bool = True):
+        if misfire_policy not in MISFIRE_POLICIES:
+            raise ValueError(f"неизвестная политика пропущенных срабатываний: {misfire_policy}")
+        self._store = store  # JournalStore или SQLiteStore
+        self.misfire_policy = misfire_policy
+        self.misfire_grace = misfire_grace
+        self.checkpoint = checkpoint
+        self.cleanup_fired = cleanup_fired
+        self.clock = clock or SystemClock()
+        self._zones_source = zones or (lambda: ('',))
+        self._zones = {}  # имя пояса -> tzinfo (None — время сервера)
+        self._cond = threading.Condition()
+        self._wakeup = None  # (loop, asyncio.Event) при работе через run_async()
+        self._index = ScheduleIndex()
+        self._heap = []
+        self._queued = set()  # (slot, zone) в куче
+        self._seq = itertools.count()
+        self._expire_at = 0
+        self._dirty = True
+        self._stopped = False
+        # отправленное в текущую минуту: повторная сборка индекса может
+        # снова поставить в кучу ещё не закончившуюся минуту
+        self._fired = FiredRing()
+        self._ids = {}  # (key, zone) -> целый id (только для записей из расписания)
+        self._id_seq = itertools.count(1)
+        # до какого момента расписание обработано; None — первый запуск
+        self._hwm = store.get('scheduler_hwm')
+        self._hwm_saved = self._hwm or 0
+        self._caught_up = False
+        self._catchup = []
+
+    def reschedule(self, added=(), removed=()) -> None:
+        """Сообщает планировщику об изменении расписания и будит его поток.
+
+        Если переданы ключи добавленных/удалённых записей, индекс
+        патчится на месте, иначе (в том числе когда поменялись группы или
+        их пояса) пересобирается целиком.
+        """
+        with self._cond:
+            if not self._dirty and (added or removed):
+                now = self.clock.time()
+                for key in removed:
+                    self._forget(key)
+                for key in added:
+                    try:
+                        slots = self._index.add(key)
+                    except ValueError:
+                        logger.warning(f"⚠️ Пропущена запись с неверным форматом: {key}")
+                        continue
+                    for slot in slots:
+                        for zone in self._zones:
+                            self._push(slot, zone, now)
+            else:
+                self._dirty = True
+            self._notify()
+
+    def done(self, key: tuple) -> None:
+        """Запись отправлена в одном из поясов; одноразовую (или правило,
+        у которого не осталось срабатываний), отработавшую во всех поясах,
+        удаляет из индекса и хранилища."""
+        if key[0] not in ('one_off', 'rule'):
+            return
+        with self._cond:
+            slot = ScheduleIndex.slots_for(key)[0]
+            if any((slot, zone) in self._queued for zone in self._zones):
+                return
+            if not self.cleanup_fired:
+                # запись ещё читают другие шарды; удалит её _expire
+                return
+            self._forget(key)
+        self._store.remove(key)
+
+    def _forget(self, key: tuple) -> None:
+        self._index.remove(key)
+        for zone in self._zones:
+            self._ids.pop((key, zone), None)
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            if self._hwm is not None:
+                self._store.set('scheduler_hwm', self._hwm)
+            self._notify()
+
+    def _notify(self) -> None:
+        self._cond.notify()
+        if self._wakeup is not None:
+            loop, event = self._wakeup
+            loop.call_soon_threadsafe(event.set)
+
+    def _push(self, slot: tuple, zone: str, after: float) -> None:
+        if (slot, zone) in self._queued:
+            return
+        ts = next_occurrence(slot, after, self._zones[zone])
+        if ts is not None:
+            heapq.heappush(self._heap, (ts, next(self._seq), slot, zone))
+            self._queued.add((slot, zone))
+
+    def _key_id(self, key: tuple, zone: str) -> int:
+        key_id = self._ids.get((key, zone))
+        if key_id is None:
+            key_id = self._ids[(key, zone)] = next(self._id_seq)
+        return key_id
+
+    def _rebuild(self, now: float) -> None:
+        index = ScheduleIndex()
+        keys = set()
+        for key in self._store.entries():
+            try:
+                index.add(key)
+            except ValueError:
+                logger.warning(f"⚠️ Пропущена запись с неверным форматом: {key}")
+                continue
+            keys.add(key)
+        self._index = index
+        self._zones = {}
+        for zone in self._zones_source():
+            try:
+                self._zones[zone] = tzinfo(zone)
+            except Exception as e:
+                logger.error(f"❌ Неизвестный часовой пояс {zone!r}: {e}")
+        if not self._zones:
+            self._zones[''] = None
+        self._heap = []
+        self._queued = set()
+        for slot in index.slots():
+            for zone in self._zones:
+                self._push(slot, zone, now)
+        # id сохраняются между сборками, иначе FiredRing не узнает запись
+        self._ids = {item: key_id for item, key_id in self._ids.items()
+                     if item[0] in keys and item[1] in self._zones}
+        self._expire_at = 0
+        self._dirty = False
+        if not self._caught_up:
+            # первая сборка после запуска: что пропустили, пока бот не работал
+            self._caught_up = True
+            if self._hwm is not None:
+                self._catchup = self._misfired(self._missed_since(self._hwm, now), now)
+
+    def _missed_since(self, since: float, now: float) -> list:
+        """[(key, ts, zone)] срабатываний после `since`, чья минута уже закончилась к `now`.
+
+        Смотрим не дальше `misfire_grace` назад, поэтому после долгого
+        простоя работа ограничена: не больше grace/неделя+1 на ячейку.
+        """
+        since = max(since, now - self.misfire_grace)
+        missed = []
+        for slot in self._index.slots():
+            for zone, tz in self._zones.items():
+                # первое срабатывание строго после since
+                ts = next_occurrence(slot, since + SLOT_SECONDS, tz)
+                while ts is not None and ts + SLOT_SECONDS <= now:
+                    missed.extend((key, ts, zone) for key in self._index.keys_at(slot))
+                    if slot[0] == 'd':
+                        break
+                    ts = next_occurrence(slot, ts + SLOT_SECONDS, tz)
+        return missed
+
+    def _misfired(self, missed: list, now: float) -> list:
+        """Отбирает из опоздавших срабатываний те, что отправим, по `misfire_policy`."""
+        if not missed:
+            return []
+        fresh = [item for item in missed if now - item[1] <= self.misfire_grace]
+        if self.misfire_policy == 'skip':
+            chosen = []
+        elif self.misfire_policy == 'latest':
+            latest = {}
+            for key, ts, zone in fresh:
+                latest[(key, zone)] = max(ts, latest.get((key, zone), ts))
+            chosen = [(key, ts, zone) for (key, zone), ts in latest.items()]
+        else:
+            chosen = fresh
+        chosen.sort(key=lambda item: item[1])
+        logger.warning(f"⏪ Пропущено срабатываний: {len(missed)}, будет отправлено: {len(chosen)} "
+                       f"(политика {self.misfire_policy}, не старше {self.misfire_grace:.0f} с)")
+        return chosen
+
+    def _expire(self, now: float) -> None:
+        """Удаляет одноразовые записи и исчерпанные правила, которые уже не
+        сработают даже при догоне.
+
+        Дата отсечки — самая ранняя по всем поясам; считается не чаще раза
+        в минуту. Правило проверяется, только когда его нет в куче ни в
+        одном поясе.
+        """
+        if now < self._expire_at:
+            return
+        self._expire_at = now + SLOT_SECONDS
+        cutoff = min(datetime.fromtimestamp(now - self.misfire_grace, tz).date()
+                     for tz in self._zones.values())
+        expired = self._index.expire(cutoff.isoformat())
+        for key in expired:
+            self._store.remove(key)
+            for zone in self._zones:
+                self._ids.pop((key, zone), None)
+        exhausted = [key for spec in list(self._index.rules) for key in self._index.keys_at(('r', spec))
+                     if not any((('r', spec), zone) in self._queued for zone in self._zones)
+                     and all(next_occurrence(('r', spec), now - self.misfire_grace, tz) is None
+                             for tz in self._zones.values())]
+        for key in exhausted:
+            self._forget(key)
+            self._store.remove(key)
+        if expired or exhausted:
+            logger.info(f"🧹 Удалено прошедших одноразовых записей: {len(expired)}, "
+                        f"исчерпанных правил: {len(exhausted)}")
+
+    def _pop_due(self, now: float) -> list:
+        due, late = [], []
+        while self._heap and self._heap[0][0] <= now:
+            ts, _, slot, zone = heapq.heappop(self._heap)
+            self._queued.discard((slot, zone))
+            for key in self._index.keys_at(slot):
+                if ts + SLOT_SECONDS <= now:
+                    # минута уже прошла — поток завис или часы прыгнули вперёд
+                    late.append((key, ts, zone))
+                elif self._fired.add(int(ts // SLOT_SECONDS), self._key_id(key, zone)):
+                    due.append((key, ts, zone))
+            if slot[0] in ('w', 'r') and self._index.keys_at(slot):
+                self._push(slot, zone, ts + SLOT_SECONDS)
+        return self._misfired(late, now) + due
+
+    def _advance(self, now: float, force: bool = False) -> None:
+        """Сдвигает high-water mark; в хранилище — раз в `checkpoint` секунд или с force."""
+        self._hwm = now
+        if force or now - self._hwm_saved >= self.checkpoint:
+            self._hwm_saved = now
+            self._store.set('scheduler_hwm', now)
+
+    def _poll(self):
+        """Под блокировкой: (due, delay) — что отправить сейчас и сколько спать.
+
+        Спим не дольше `checkpoint`, чтобы high-water mark не отставал.
+        """
+        now = self.clock.time()
+        if self._dirty:
+            self._rebuild(now)
+        self._expire(now)
+        if self._catchup:
+            due, self._catchup = self._catchup, []
+            self._advance(now, force=True)
+            return due, 0
+        if not self._heap or self._heap[0][0] > now:
+            self._advance(now)
+            delay = self._heap[0][0] - now if self._heap else self.checkpoint
+            return [], min(delay, self.checkpoint)
+        due = self._pop_due(now)
+        # отправленное не должно уйти снова, если процесс убьют до отметки
+        self._advance(now, force=bool(due))
+        return due, 0
+
+    def step(self):
+        """Одна итерация без ожидания: (due, delay), как в `run()`.
+
+        due — [(key, slot_ts, zone)] сработавших записей, delay — через
+        сколько секунд по часам планировщика стоит спросить снова. Для
+        одноразовых записей после отправки вызывайте `done(key)`.
+        """
+        with self._cond:
+            return self._poll()
+
+    def _fire_all(self, fire, due: list, batch: bool = False) -> None:
+        if batch:
+            items = []
+            for key, ts, zone in due:
+                text = self._store.text(key)
+                if text is not None:
+                    items.append((key, text, ts, zone))
+            try:
+                fire(items)
+            except Exception as e:
+                logger.error(f"❌ Ошибка в scheduled_sender: {e}")
+            for key, *_ in items:
+                self.done(key)
+            return
+
+        for key, ts, zone in due:
+            text = self._store.text(key)
+            if text is None:
+                continue
+            try:
+                fire(key, text, ts, zone)
+            except Exception as e:
+                logger.error(f"❌ Ошибка в scheduled_sender: {e}")
+            self.done(key)
+
+    def run(self, fire, batch: bool = False) -> None:
+        """Основной цикл в отдельном потоке; возвращается после `stop()`.
+
+        fire(key, text, slot_ts, zone) вызывается для каждой сработавшей записи.
+        С batch=True — fire(items) один раз на всё, что сработало вместе,
+        items — [(key, text, slot_ts, zone)].
+        """
+        while True:
+            started = time.perf_counter()
+            with self._cond:
+                if self._stopped:
+                    return
+                due, delay = self._poll()
+                if not due:
+                    TICK_SECONDS.observe(time.perf_counter() - started)
+                    self._cond.wait(delay)
+                    continue
+            self._fire_all(fire, due, batch)
+            TICK_SECONDS.observe(time.perf_counter() - started)
+
+    async def run_async(self, fire, batch: bool = False) -> None:
+        """То же, что `run()`, но как задача asyncio; fire не должен блокировать."""
+        event = asyncio.Event()
+        with self._cond:
+            self._wakeup = (asyncio.get_running_loop(), event)
+        try:
+            while True:
+                started = time.perf_counter()
+                with self._cond:
+                    if self._stopped:
+                        return
+                    event.clear()
+                    due, delay = self._poll()
+                if not due:
+                    TICK_SECONDS.observe(time.perf_counter() - started)
+                    try:
+                        await asyncio.wait_for(event.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self._fire_all(fire, due, batch)
+                TICK_SECONDS.observe(time.perf_counter() - started)
+        finally:
+            with self._cond:
+                self._wakeup = None
@@ -0,0 +1,376 @@
+"""Работа несколькими процессами: группы поделены между шардами.
+
+    SHARDS=4 STORAGE_BACKEND=sqlite python shard.py
+
+shard.py — надзиратель: запускает SHARDS процессов `bot.py` (у каждого
+SHARD_INDEX), следит за ними и перезапускает упавшие. Каждый процесс —
+шард со своим планировщиком и пулом рассылки; он рассылает только свои
+группы — те, что попадают на него в кольце консистентного хеширования
+(`HashRing`) по id группы.
+
+Обновления от Telegram получает один процесс — ведущий: тот, кто держит
+flock-блокировку RUN_DIR/leader.lock. Остальные ждут на той же
+блокировке; когда ведущий завершается (даже kill -9), ядро её снимает, и
+ведущим становится следующий. Ведущий пересылает обновление шарду,
+которому принадлежит чат, через unix-сокет RUN_DIR/shard-N.sock, так
+что обновления одного чата обрабатываются одним процессом по порядку.
+
+Состав живых шардов рассылает надзиратель ('members'). Когда шард
+умирает, его группы расходятся по остальным (чужие группы при этом не
+переезжают), а после перезапуска возвращаются к нему. Шард, изменивший
+расписание командой, сообщает остальным ('changed'), и те перечитывают
+его из общей базы — поэтому нужен STORAGE_BACKEND=sqlite.
+"""
+import bisect
+import fcntl
+import hashlib
+import logging
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+# Как часто надзиратель проверяет процессы и повторяет состав шардов
+POLL_INTERVAL = 0.5
+RESEND_MEMBERS_EVERY = 5
+# Сколько ждать запуска всех шардов, прежде чем разослать первый состав
+STARTUP_TIMEOUT = 30
+# Задержка перед перезапуском процесса, который быстро упал (удваивается)
+RESTART_DELAY = 1
+RESTART_MAX_DELAY = 30
+
+
+class HashRing:
+    """Консистентное хеширование: у каждого шарда `replicas` точек на кольце.
+
+    Ключ принадлежит шарду с ближайшей точкой по часовой стрелке. Когда
+    шард выпадает, его ключи расходятся по остальным, а чужие остаются на
+    месте. Хеш — md5, а не hash(): он одинаков во всех процессах.
+    """
+
+    def __init__(self, nodes=(), replicas: int = 100):
+        self.nodes = frozenset(nodes)
+        self.replicas = replicas
+        points = sorted((self._hash(f"{node}:{i}"), node) for node in self.nodes for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value) -> int:
+        return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], 'big')
+
+    def owner(self, key):
+        if not self._points:
+            raise LookupError("в кольце нет шардов")
+        i = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[i]
+
+
+class LeaderLock:
+    """Эксклюзивная flock-блокировка файла: кто её держит, тот ведущий.
+
+    Ядро снимает блокировку, когда процесс-владелец завершается.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except BaseException:
+            os.close(fd)
+            raise
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def socket_path(run_dir: str, index: int) -> str:
+    return os.path.join(run_dir, f'shard-{index}.sock')
+
+
+def connect(run_dir: str, index: int, authkey: bytes):
+    return Client(socket_path(run_dir, index), family='AF_UNIX', authkey=authkey)
+
+
+class ShardNode:
+    """Шард в процессе бота: кольцо, сокет для сообщений и выборы ведущего.
+
+    Сообщения — (вид, данные); обработчики видов задаются `on(kind, fn)`.
+    Пока не пришёл первый состав шардов, `ready` не установлено.
+    """
+
+    def __init__(self, index: int, count: int, run_dir: str, authkey: bytes, replicas: int = 100):
+        self.index = index
+        self.count = count
+        self.run_dir = run_dir
+        self.replicas = replicas
+        self._authkey = authkey
+        self._ring = HashRing((index,), replicas)
+        self._handlers = {}
+        self._peers = {}  # номер шарда -> исходящее соединение
+        self._lock = threading.Lock()
+        self._listener = None
+        self._leader_lock = LeaderLock(os.path.join(run_dir, 'leader.lock'))
+        self.leader = False
+        self.ready = threading.Event()
+
+    def on(self, kind: str, handler) -> None:
+        self._handlers[kind] = handler
+
+    @property
+    def members(self) -> frozenset:
+        return self._ring.nodes
+
+    def owner(self, key) -> int:
+        return self._ring.owner(key)
+
+    def owns(self, key) -> bool:
+        return self._ring.owner(key) == self.index
+
+    def set_members(self, members) -> None:
+        """Новый состав живых шардов; при изменении вызывает обработчик 'rebalance'."""
+        members = frozenset(members) | {self.index}
+        with self._lock:
+            changed = members != self._ring.nodes
+            if changed:
+                self._ring = HashRing(members, self.replicas)
+                for index in set(self._peers) - members:
+                    self._peers.pop(index).close()
+        self.ready.set()
+        if changed:
+            logger.info(f"🔀 Шард {self.index}: состав {sorted(members)}")
+            self._dispatch('rebalance', members)
+
+    def start(self) -> 'ShardNode':
+        """Открывает сокет шарда и принимает сообщения в фоновом потоке."""
+        os.makedirs(self.run_dir, exist_ok=True)
+        path = socket_path(self.run_dir, self.index)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._listener = Listener(path, family='AF_UNIX', authkey=self._authkey)
+        self.on('members', self.set_members)
+        threading.Thread(target=self._accept, name=f'shard-{self.index}', daemon=True).start()
+        return self
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return  # сокет закрыт
+            except Exception as e:
+                logger.warning(f"⚠️ Шард {self.index}: отклонено соединение: {e}")
+                continue
+            threading.Thread(target=self._receive, args=(conn,), daemon=True).start()
+
+    def _receive(self, conn) -> None:
+        with conn:
+            while True:
+                try:
+                    kind, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self._dispatch(kind, payload)
+
+    def _dispatch(self, kind: str, payload) -> None:
+        handler = self._handlers.get(kind)
+        if handler is None:
+            return
+        try:
+            handler(payload)
+        except Exception as e:
+            logger.error(f"❌ Шард {self.index}: ошибка обработки '{kind}': {e}")
+
+    def send(self, index: int, kind: str, payload=None) -> bool:
+        """Отправляет сообщение шарду; False, если он недоступен."""
+        with self._lock:
+            try:
+                conn = self._peers.get(index)
+                if conn is None:
+                    conn = self._peers[index] = connect(self.run_dir, index, self._authkey)
+                conn.send((kind, payload))
+                return True
+            except (OSError, EOFError):
+                conn = self._peers.pop(index, None)
+                if conn is not None:
+                    conn.close()
+                return False
+
+    def route(self, key, kind: str, payload) -> None:
+        """Передаёт сообщение шарду-владельцу `key` (себе — вызовом обработчика).
+
+        Недоступный шард до следующего состава от надзирателя считается
+        выбывшим, и сообщение уходит новому владельцу.
+        """
+        while True:
+            owner = self.owner(key)
+            if owner == self.index:
+                self._dispatch(kind, payload)
+                return
+            if self.send(owner, kind, payload):
+                return
+            logger.warning(f"⚠️ Шард {owner} недоступен, его чаты переходят к остальным")
+            self.set_members(self.members - {owner})
+
+    def publish(self, kind: str, payload=None) -> None:
+        """Отправляет сообщение всем остальным живым шардам."""
+        for index in sorted(self.members - {self.index}):
+            self.send(index, kind, payload)
+
+    def wait_leadership(self) -> None:
+        """Блокируется, пока этот процесс не станет ведущим."""
+        self._leader_lock.acquire()
+        self.leader = True
+        logger.info(f"👑 Шард {self.index} стал ведущим: принимает обновления")
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            try:
+                os.unlink(socket_path(self.run_dir, self.index))
+            except OSError:
+                pass
+        with self._lock:
+            for conn in self._peers.values():
+                conn.close()
+            self._peers.clear()
+        self._leader_lock.release()
+
+
+class Supervisor:
+    """Запускает `count` процессов бота и сообщает им состав живых шардов."""
+
+    def __init__(self, count: int, run_dir: str, argv=None):
+        self.count = count
+        self.run_dir = run_dir
+        self.argv = argv or [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')]
+        self.authkey = secrets.token_bytes(16)
+        self._procs = {}
+        self._started_at = {}
+        self._restart_at = {}
+        self._delays = {}
+        self._members = set()
+        self._stopping = False
+
+    def _spawn(self, index: int) -> None:
+        env = dict(os.environ, SHARDS=str(self.count), SHARD_INDEX=str(index),
+                   SHARD_AUTHKEY=self.authkey.hex(), RUN_DIR=self.run_dir)
+        self._procs[index] = subprocess.Popen(self.argv, env=env)
+        self._started_at[index] = time.monotonic()
+        logger.info(f"▶️ Шард {index} запущен (pid {self._procs[index].pid})")
+
+    def _reachable(self, index: int) -> bool:
+        try:
+            connect(self.run_dir, index, self.authkey).close()
+            return True
+        except (OSError, EOFError):
+            return False
+
+    def _announce(self) -> None:
+        members = sorted(self._members)
+        for index in members:
+            try:
+                with connect(self.run_dir, index, self.authkey) as conn:
+                    conn.send(('members', members))
+            except (OSError, EOFError):
+                pass
+
+    def _check(self) -> bool:
+        """Следит за процессами; True, если состав шардов изменился."""
+        changed = False
+        now = time.monotonic()
+        for index, proc in list(self._procs.items()):
+            if proc is None:
+                if now >= self._restart_at[index]:
+                    self._spawn(index)
+                continue
+            if proc.poll() is not None:
+                logger.warning(f"💀 Шард {index} завершился с кодом {proc.returncode}")
+                self._procs[index] = None
+                if index in self._members:
+                    self._members.discard(index)
+                    changed = True
+                # быстро падающий процесс перезапускаем всё реже
+                lived = now - self._started_at[index]
+                delay = self._delays.get(index, RESTART_DELAY) if lived < 10 * RESTART_DELAY else RESTART_DELAY
+                self._delays[index] = min(delay * 2, RESTART_MAX_DELAY)
+                self._restart_at[index] = now + delay
+            elif index not in self._members and self._reachable(index):
+                self._members.add(index)
+                changed = True
+        return changed
+
+    def run(self) -> None:
+        os.makedirs(self.run_dir, exist_ok=True)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._stop)
+        for index in range(self.count):
+            self._spawn(index)
+
+        # первый состав — когда поднялись все (или по таймауту), иначе
+        # шарды, запущенные раньше, считали бы чужие группы своими
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not self._stopping and len(self._members) < self.count and time.monotonic() < deadline:
+            self._check()
+            time.sleep(POLL_INTERVAL)
+        logger.info(f"🚀 Шарды запущены: {sorted(self._members)} из {self.count}")
+        self._announce()
+
+        announced = time.monotonic()
+        while not self._stopping:
+            time.sleep(POLL_INTERVAL)
+            # повторяем состав и без изменений: шард мог счесть соседа выбывшим
+            if self._check() or time.monotonic() - announced >= RESEND_MEMBERS_EVERY:
+                self._announce()
+                announced = time.monotonic()
+        self._shutdown()
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _shutdown(self) -> None:
+        """SIGINT шардам: и ведущий, и ведомые выходят из ожидания, а `shutdown()`
+        в finally `bot.main()` дописывает хранилище и сохраняет отметку планировщика.
+        """
+        procs = [proc for proc in self._procs.values() if proc is not None and proc.poll() is None]
+        for proc in procs:
+            proc.send_signal(signal.SIGINT)
+        for proc in procs:
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        logger.info("Шарды остановлены")
+
+
+def main() -> None:
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    from config import RUN_DIR, SHARDS
+    Supervisor(SHARDS, RUN_DIR).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,503 @@
+"""Хранение расписания: снимок `schedule_data.json` + журнал изменений.
+
+Каждое изменение расписания дописывается в журнал одной JSON-строкой:
+
+    {"op": "add", "key": ["weekly", "monday", "09:00"], "text": "..."}
+    {"op": "remove", "key": ["daily", "09:00"]}
+    {"op": "clear", "kind": "weekly"}
+    {"op": "set", "name": "group_id", "value": -100123}
+    {"op": "batch", "records": [...]}   (несколько изменений разом, /import)
+
+Записи дописываются фоновым потоком пачками (`CoalescingWriter`), так что
+обработчики команд не ждут диска. При запуске снимок загружается и журнал
+проигрывается поверх него. Когда записей в журнале становится много,
+текущее состояние атомарно (временный файл + rename) пишется в новый
+снимок, а журнал обнуляется. Все операции идемпотентны, поэтому сбой между
+заменой снимка и обнулением журнала безопасен.
+
+В памяти расписание хранится неизменяемыми версиями (copy-on-write):
+изменение копирует только затронутые словари и публикует новую версию,
+поэтому читатели не берут блокировок и всегда видят согласованное
+состояние, а производные данные можно кэшировать по номеру версии.
+"""
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from metrics import Counter, Histogram
+from schedule_index import WEEKDAYS, iter_entries, lookup_text
+
+logger = logging.getLogger(__name__)
+
+WRITE_SECONDS = Histogram('storage_write_seconds', 'Длительность записи расписания на диск', labels=('target',))
+BYTES_WRITTEN = Counter('storage_bytes_written_total', 'Записано байт', labels=('target',))
+
+# Ключи, которые попадают в снимок (секреты и служебные объекты не пишем)
+SNAPSHOT_KEYS = (
+    'scheduled_text',
+    'scheduled_time',
+    'send_message_text',
+    'group_id',
+    'groups',
+    'group_timezones',
+    'dead_letters',
+    'file_ids',
+    'group_titles',
+    'scheduler_hwm',
+    'daily_schedule',
+    'one_off',
+    'rule_schedule',
+    'weekly_schedule',
+)
+
+# Вид записи -> ключ messages_storage
+KIND_FIELDS = {
+    'weekly': 'weekly_schedule',
+    'daily': 'daily_schedule',
+    'one_off': 'one_off',
+    'rule': 'rule_schedule',
+}
+
+# Виды записей без вложенного уровня (день недели или дата)
+FLAT_KINDS = ('daily', 'rule')
+
+
+class Snapshot(NamedTuple):
+    """Опубликованная версия расписания; `data` после публикации не меняется."""
+    version: int
+    data: dict
+
+
+def touched_fields(record: dict) -> set:
+    """Ключи messages_storage, которые меняет запись журнала."""
+    op = record['op']
+    if op == 'set':
+        return {record['name']}
+    if op == 'clear':
+        return {KIND_FIELDS[record['kind']]}
+    if op == 'batch':
+        return set().union(*map(touched_fields, record['records']))
+    return {KIND_FIELDS[record['key'][0]]}
+
+
+class ViewCache:
+    """Производные от расписания значения (отрисованные списки и т.п.) по версии хранилища.
+
+    Если значение зависит от нескольких ключей (`fields`), оно живёт, пока
+    меняется что-то другое: отметка планировщика раз в минуту не
+    сбрасывает отрисованное расписание.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._changed = {}  # ключ -> номер версии, на которой он менялся
+        self._base = 0      # версия после загрузки: с неё всё считается изменённым
+
+    def touch(self, record: dict, version: int) -> None:
+        for field in touched_fields(record):
+            self._changed[field] = version
+
+    def reset(self, version: int) -> None:
+        self._changed = {}
+        self._base = version
+
+    def get(self, name: str, version: int, build, fields=None):
+        if fields is not None:
+            version = tuple(self._changed.get(field, self._base) for field in fields)
+        item = self._items.get(name)
+        if item is None or item[0] != version:
+            item = self._items[name] = (version, build())
+        return item[1]
+
+
+def copy_path(data: dict, record: dict) -> dict:
+    """Копия `data`, в которой скопированы словари, которые изменит `record`.
+
+    Остальные вложенные словари общие со старой версией. Для пачки каждый
+    словарь копируется один раз.
+    """
+    data = dict(data)
+    copied = set()
+    for item in record['records'] if record['op'] == 'batch' else (record,):
+        if item['op'] not in ('add', 'remove'):
+            continue
+        kind, *path = item['key']
+        field = KIND_FIELDS[kind]
+        if field not in copied:
+            data[field] = dict(data.get(field, {}))
+            copied.add(field)
+        if kind not in FLAT_KINDS and (field, path[0]) not in copied:
+            data[field][path[0]] = dict(data[field].get(path[0], {}))
+            copied.add((field, path[0]))
+    return data
+
+
+def apply_mutation(data: dict, record: dict) -> None:
+    """Применяет одну запись журнала к словарю расписания."""
+    op = record['op']
+    if op == 'set':
+        data[record['name']] = record['value']
+        return
+
+    if op == 'batch':
+        for item in record['records']:
+            apply_mutation(data, item)
+        return
+
+    if op == 'clear':
+        if record['kind'] == 'weekly':
+            data['weekly_schedule'] = {day: {} for day in WEEKDAYS}
+        else:
+            data[KIND_FIELDS[record['kind']]] = {}
+        return
+
+    kind, *path = record['key']
+    parent = data.setdefault(KIND_FIELDS[kind], {})
+    if kind not in FLAT_KINDS:
+        parent = parent.setdefault(path[0], {})
+
+    if op == 'add':
+        parent[path[-1]] = record['text']
+    elif op == 'remove':
+        parent.pop(path[-1], None)
+        # пустые даты одноразовых отправок не храним
+        if kind == 'one_off' and not parent:
+            data['one_off'].pop(path[0], None)
+    else:
+        raise ValueError(f"неизвестная операция журнала: {op}")
+
+
+class CoalescingWriter:
+    """Фоновая запись изменений на диск.
+
+    `submit()` только кладёт запись в очередь и помечает состояние
+    «грязным», поэтому обработчики не ждут диска. Поток-писатель ждёт
+    `window` секунд после первого изменения, забирает всё накопленное и
+    сохраняет одной операцией `flush(batch)`. Повторные `set` одной и той
+    же настройки внутри пачки схлопываются в последний. Если `flush`
+    упал, пачка возвращается в начало очереди и пишется снова через
+    `retry` секунд (вместе с накопившимся за это время).
+    """
+
+    def __init__(self, flush, window: float = 0.5, name: str = 'storage-writer',
+                 retry: float = 1.0):
+        self._flush = flush
+        self.window = window
+        self.retry = retry
+        self._cond = threading.Condition()
+        self._pending = []
+        self._busy = False
+        self._stopped = False
+        # Счётчики: сколько изменений пришло и сколько раз писали на диск
+        self.mutations = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def coalesced(self) -> int:
+        """Сколько изменений ушло на диск «попутно», без отдельной записи."""
+        return self.mutations - self.writes
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending) or self._busy
+
+    def stats(self) -> dict:
+        return {'mutations': self.mutations, 'writes': self.writes, 'coalesced': self.coalesced}
+
+    def submit(self, record: dict) -> None:
+        with self._cond:
+            self._pending.append(record)
+            self.mutations += 1
+            self._cond.notify_all()
+
+    def _take(self) -> list:
+        batch, self._pending = self._pending, []
+        last_set = {r['name']: i for i, r in enumerate(batch) if r['op'] == 'set'}
+        self._busy = True
+        return [r for i, r in enumerate(batch) if r['op'] != 'set' or last_set[r['name']] == i]
+
+    def _write(self, batch: list) -> bool:
+        """Пишет пачку; при ошибке возвращает её в очередь и отдаёт False."""
+        try:
+            if batch:
+                self._flush(batch)
+                self.writes += 1
+            failed = False
+        except Exception as e:
+            # Не фейлим исполнение бота при ошибке записи, но и не теряем пачку
+            logger.error(f"❌ Ошибка фоновой записи расписания ({len(batch)} изм. ждут повтора): {e}")
+            failed = True
+        with self._cond:
+            if failed:
+                self._pending[:0] = batch
+            self._busy = False
+            self._cond.notify_all()
+        return not failed
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # даём накопиться пачке изменений
+                deadline = time.monotonic() + self.window
+                while not self._stopped:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                while self._busy:
+                    self._cond.wait()
+                batch = self._take()
+            if self._write(batch):
+                continue
+            with self._cond:
+                # остаток при остановке допишет close()
+                deadline = time.monotonic() + self.retry
+                while not self._stopped:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                if self._stopped:
+                    return
+
+    def flush(self) -> None:
+        """Синхронно дожидается записи всего накопленного."""
+        with self._cond:
+            while self._busy:
+                self._cond.wait()
+            if not self._pending:
+                return
+            batch = self._take()
+        self._write(batch)
+
+    def close(self) -> None:
+        """Записывает остаток и останавливает поток."""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+        if self._pending:
+            logger.error(f"❌ Не записано на диск изменений: {len(self._pending)}")
+        logger.info(f"💾 Записей на диск: {self.writes}, изменений: {self.mutations} "
+                    f"(схлопнуто {self.coalesced})")
+
+
+class JournalStore:
+    """Расписание в памяти плюс журнал изменений на диске.
+
+    Изменения делаются только через `add`/`remove`/`clear`/`set`: они по
+    очереди (под одной блокировкой) строят новую версию `Snapshot` и сразу
+    её публикуют, а запись в журнал уходит через `CoalescingWriter` пачками
+    (одна запись и один fsync на пачку). Сжатие в снимок — когда в журнале
+    набирается `compact_every` записей.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: str,
+                 window: float = 0.5, compact_every: int = 1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self._snapshot = Snapshot(0, {})
+        self._views = ViewCache()
+        self._lock = threading.RLock()     # писатели версий в памяти
+        self._io_lock = threading.Lock()   # файл журнала и снимок
+        self._log = None
+        self._records = 0
+        self.writer = CoalescingWriter(self._write_batch, window, name='journal-writer')
+
+    def load(self, defaults: dict) -> dict:
+        """Снимок поверх `defaults`, затем проигрывание журнала."""
+        with self._lock:
+            data = copy.deepcopy(defaults)
+            if os.path.exists(self.snapshot_path):
+                try:
+                    with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                        data.update(json.load(f))
+                except Exception as e:
+                    logger.error(f"❌ Не удалось прочитать снимок {self.snapshot_path}: {e}")
+
+            self._records = 0
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            apply_mutation(data, json.loads(line))
+                        except Exception:
+                            # оборванная последняя строка после сбоя
+                            logger.warning(f"⚠️ Пропущена повреждённая запись журнала: {line[:80]!r}")
+                            continue
+                        self._records += 1
+
+            self._snapshot = Snapshot(self._snapshot.version + 1, data)
+            self._views.reset(self._snapshot.version)
+            return data
+
+    @property
+    def data(self) -> dict:
+        """Текущая версия расписания (только для чтения)."""
+        return self._snapshot.data
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    def cached(self, name: str, build, fields=None):
+        """`build()` один раз на версию расписания (или только ключей `fields`);
+        до следующего изменения — из кэша."""
+        return self._views.get(name, self._snapshot.version, build, fields)
+
+    def get(self, name: str, default=None):
+        """Значение настройки (group_id, groups, send_message_text, ...)."""
+        return self.data.get(name, default)
+
+    def entries(self):
+        """Ключи всех записей расписания."""
+        return list(iter_entries(self.data))
+
+    def text(self, key: tuple):
+        """Текст записи по ключу или None, если записи нет."""
+        return lookup_text(self.data, key)
+
+    def day_entries(self, day: str) -> list:
+        """[(время, текст)] недельного расписания на день, по времени."""
+        return sorted(self.data.get('weekly_schedule', {}).get(day, {}).items())
+
+    def daily_entries(self) -> list:
+        """[(время, текст)] ежедневного расписания, по времени."""
+        return sorted(self.data.get('daily_schedule', {}).items())
+
+    def rule_entries(self) -> list:
+        """[(правило, текст)] правил повторения, по тексту правила."""
+        return sorted(self.data.get('rule_schedule', {}).items())
+
+    def add(self, key: tuple, text: str) -> None:
+        self._record({'op': 'add', 'key': list(key), 'text': text})
+
+    def remove(self, key: tuple) -> None:
+        self._record({'op': 'remove', 'key': list(key)})
+
+    def clear(self, kind: str) -> None:
+        """Очищает все записи вида 'weekly', 'daily', 'one_off' или 'rule'."""
+        self._record({'op': 'clear', 'kind': kind})
+
+    def set(self, name: str, value) -> None:
+        self._record({'op': 'set', 'name': name, 'value': value})
+
+    def batch(self, records: list) -> None:
+        """Несколько изменений одной версией и одной записью журнала."""
+        self._record({'op': 'batch', 'records': records})
+
+    def update(self, name: str, change):
+        """Записывает `change(текущее значение настройки)` так, что между
+        чтением и записью её никто не изменит. Возвращает новое значение."""
+        with self._lock:
+            value = change(copy.deepcopy(self.data.get(name)))
+            self._record({'op': 'set', 'name': name, 'value': value})
+        return value
+
+    def _record(self, record: dict) -> None:
+        with self._lock:
+            data = copy_path(self._snapshot.data, record)
+            apply_mutation(data, record)
+            self._snapshot = Snapshot(self._snapshot.version + 1, data)
+            self._views.touch(record, self._snapshot.version)
+            # в журнал в том же порядке, в каком публикуются версии
+            self.writer.submit(record)
+
+    def _write_batch(self, batch: list) -> None:
+        """Дописывает пачку записей в журнал одним write + fsync (поток-писатель)."""
+        lines = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in batch)
+        started = time.perf_counter()
+        with self._io_lock:
+            if self._log is None:
+                self._log = open(self.journal_path, 'a', encoding='utf-8')
+            size = self._log.tell()
+            try:
+                self._log.write(lines)
+                self._log.flush()
+                os.fsync(self._log.fileno())
+            except OSError:
+                # пачку запишут повторно: срезаем недописанный хвост, иначе
+                # оборванная строка склеится со следующей
+                log, self._log = self._log, None
+                try:
+                    log.close()
+                except OSError:
+                    pass
+                try:
+                    os.truncate(self.journal_path, size)
+                except OSError:
+                    pass
+                raise
+            # пачка /import считается по числу изменений: большой журнал пора сжать
+            self._records += sum(len(r['records']) if r['op'] == 'batch' else 1 for r in batch)
+            need_compact = self._records >= self.compact_every
+        WRITE_SECONDS.labels('journal').observe(time.perf_counter() - started)
+        BYTES_WRITTEN.labels('journal').inc(len(lines.encode('utf-8')))
+        if need_compact:
+            self.compact()
+
+    def sync(self) -> None:
+        """Дожидается записи на диск всех сделанных изменений."""
+        self.writer.flush()
+
+    def compact(self) -> None:
+        """Пишет текущее состояние в снимок (через временный файл) и обнуляет журнал."""
+        data = self.data  # версия неизменна, блокировка не нужна
+        to_save = json.dumps({k: data.get(k) for k in SNAPSHOT_KEYS if k in data},
+                             ensure_ascii=False, indent=2)
+        started = time.perf_counter()
+        with self._io_lock:
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(to_save)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            _fsync_dir(os.path.dirname(os.path.abspath(self.snapshot_path)))
+
+            if self._log is not None:
+                self._log.close()
+            self._log = open(self.journal_path, 'w', encoding='utf-8')
+            os.fsync(self._log.fileno())
+            self._records = 0
+        WRITE_SECONDS.labels('snapshot').observe(time.perf_counter() - started)
+        BYTES_WRITTEN.labels('snapshot').inc(len(to_save.encode('utf-8')))
+
+    def close(self) -> None:
+        """Дописывает накопленные изменения и закрывает журнал."""
+        self.writer.close()
+        with self._io_lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+def _fsync_dir(path: str) -> None:
+    """fsync каталога, чтобы rename пережил сбой питания (не везде поддерживается)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,391 @@
+"""Хранение расписания в SQLite (STORAGE_BACKEND=sqlite).
+
+Записи лежат в таблицах с первичными ключами (day, time), (time) и
+(date, time), поэтому выборка одного дня или одной записи идёт по
+индексу и в память не поднимается всё расписание. Настройки (группы,
+тексты) — в таблице settings в виде JSON.
+
+Разовый перенос существующих данных из schedule_data.json (и журнала):
+
+    python storage_sqlite.py
+"""
+import copy
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from schedule_index import WEEKDAYS
+from storage import WRITE_SECONDS, CoalescingWriter, JournalStore, ViewCache
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS weekly (
+    day TEXT NOT NULL,
+    time TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (day, time)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily (
+    time TEXT NOT NULL PRIMARY KEY,
+    text TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS one_off (
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (date, time)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rule (
+    rule TEXT NOT NULL PRIMARY KEY,
+    text TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT NOT NULL PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+# Ключи messages_storage, которые хранятся в settings
+SETTINGS_KEYS = ('scheduled_text', 'scheduled_time', 'send_message_text', 'group_id', 'groups',
+                 'group_timezones', 'dead_letters', 'file_ids',
+                 'group_titles', 'scheduler_hwm')
+
+
+class SQLiteStore:
+    """Тот же интерфейс, что у `JournalStore`, но поверх SQLite в режиме WAL.
+
+    Изменения пишутся фоновым `CoalescingWriter`: пачка за окно `window`
+    уходит в базу одной транзакцией. Пока пачка не записана, её изменения
+    лежат в памяти (`_pending_*`) и чтение накладывает их поверх базы —
+    read-your-writes без ожидания диска. Читает отдельное соединение: в
+    режиме WAL ему не мешает транзакция писателя. Номер версии растёт с
+    каждым изменением, по нему кэшируются производные данные (`cached`).
+    """
+
+    def __init__(self, path: str, window: float = 0.5):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._read_lock = threading.RLock()
+        # Поставленные в очередь, но ещё не записанные изменения; у каждого
+        # номер, чтобы после записи пачки убрать только вошедшие в неё
+        self._pending_lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._pending_settings = {}  # имя -> (номер, значение)
+        self._pending_entries = {}   # ключ -> (номер, текст или None, если удалена)
+        self._pending_clears = {}    # вид -> номер
+        self.writer = CoalescingWriter(self._write_batch, window, name='sqlite-writer')
+        self._versions = itertools.count(1)
+        self._version = 0
+        self._views = ViewCache()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def cached(self, name: str, build, fields=None):
+        """`build()` один раз на версию расписания (или только ключей `fields`);
+        до следующего изменения — из кэша."""
+        return self._views.get(name, self._version, build, fields)
+
+    def load(self, defaults: dict) -> None:
+        """При первом запуске (пустая база) заполняет её значениями по умолчанию."""
+        if not self._select('SELECT 1 FROM settings LIMIT 1'):
+            self.import_data(defaults)
+
+    def import_data(self, data: dict, replace: bool = False) -> None:
+        """Записывает словарь в формате messages_storage одной транзакцией.
+
+        replace=True сначала удаляет всё, что было в базе.
+        """
+        self.writer.flush()
+        with self._lock, self._transaction():
+            self._version = next(self._versions)
+            self._views.reset(self._version)
+            if replace:
+                for table in ('weekly', 'daily', 'one_off', 'rule', 'settings'):
+                    self._db.execute(f'DELETE FROM {table}')
+            for name in SETTINGS_KEYS:
+                if name in data:
+                    self._set(name, data[name])
+            for day, slots in data.get('weekly_schedule', {}).items():
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO weekly (day, time, text) VALUES (?, ?, ?)',
+                    [(day, t, text) for t, text in slots.items()])
+            self._db.executemany(
+                'INSERT OR REPLACE INTO daily (time, text) VALUES (?, ?)',
+                list(data.get('daily_schedule', {}).items()))
+            for date_str, slots in data.get('one_off', {}).items():
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO one_off (date, time, text) VALUES (?, ?, ?)',
+                    [(date_str, t, text) for t, text in slots.items()])
+            self._db.executemany(
+                'INSERT OR REPLACE INTO rule (rule, text) VALUES (?, ?)',
+                list(data.get('rule_schedule', {}).items()))
+
+    def _transaction(self, begin: str = 'BEGIN'):
+        return _Transaction(self._db, begin)
+
+    def _select(self, sql: str, params=()) -> list:
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def _pending(self) -> tuple:
+        """Копия незаписанных изменений: (настройки, записи, очищенные виды).
+
+        Берётся до чтения базы: если пачка запишется между ними, её
+        изменения окажутся и там, и там, но не потеряются.
+        """
+        with self._pending_lock:
+            return dict(self._pending_settings), dict(self._pending_entries), dict(self._pending_clears)
+
+    def get(self, name: str, default=None):
+        with self._pending_lock:
+            pending = self._pending_settings.get(name)
+        if pending is not None:
+            return copy.deepcopy(pending[1])
+        rows = self._select('SELECT value FROM settings WHERE name = ?', (name,))
+        return default if not rows else json.loads(rows[0][0])
+
+    def entries(self) -> list:
+        _, pending, clears = self._pending()
+        with self._read_lock, _Transaction(self._reader):
+            keys = [('weekly', d, t) for d, t in self._select('SELECT day, time FROM weekly')]
+            keys += [('daily', t) for (t,) in self._select('SELECT time FROM daily')]
+            keys += [('one_off', d, t) for d, t in self._select('SELECT date, time FROM one_off')]
+            keys += [('rule', r) for (r,) in self._select('SELECT rule FROM rule')]
+        if not pending and not clears:
+            return keys
+        keys = [key for key in keys if key[0] not in clears and key not in pending]
+        return keys + [key for key, (_, text) in pending.items() if text is not None]
+
+    def text(self, key: tuple):
+        kind = key[0]
+        _, pending, clears = self._pending()
+        if key in pending:
+            return pending[key][1]
+        if kind in clears:
+            return None
+        if kind == 'weekly':
+            rows = self._select('SELECT text FROM weekly WHERE day = ? AND time = ?', key[1:])
+        elif kind == 'daily':
+            rows = self._select('SELECT text FROM daily WHERE time = ?', key[1:])
+        elif kind == 'rule':
+            rows = self._select('SELECT text FROM rule WHERE rule = ?', key[1:])
+        else:
+            rows = self._select('SELECT text FROM one_off WHERE date = ? AND time = ?', key[1:])
+        return None if not rows else rows[0][0]
+
+    def _listing(self, prefix: tuple, sql: str, params=()) -> list:
+        """[(последняя часть ключа, текст)] записей с ключом `prefix + (x,)`, по x."""
+        _, pending, clears = self._pending()
+        rows = [] if prefix[0] in clears else self._select(sql, params)
+        changed = [(key[-1], text) for key, (_, text) in pending.items() if key[:-1] == prefix]
+        if not changed:
+            return rows
+        merged = dict(rows)
+        for last, text in changed:
+            if text is None:
+                merged.pop(last, None)
+            else:
+                merged[last] = text
+        return sorted(merged.items())
+
+    def day_entries(self, day: str) -> list:
+        return self._listing(('weekly', day),
+                             'SELECT time, text FROM weekly WHERE day = ? ORDER BY time', (day,))
+
+    def daily_entries(self) -> list:
+        return self._listing(('daily',), 'SELECT time, text FROM daily ORDER BY time')
+
+    def rule_entries(self) -> list:
+        return self._listing(('rule',), 'SELECT rule, text FROM rule ORDER BY rule')
+
+    def add(self, key: tuple, text: str) -> None:
+        self._submit({'op': 'add', 'key': list(key), 'text': text})
+
+    def remove(self, key: tuple) -> None:
+        self._submit({'op': 'remove', 'key': list(key)})
+
+    def clear(self, kind: str) -> None:
+        """Очищает все записи вида 'weekly', 'daily', 'one_off' или 'rule'."""
+        if kind not in ('weekly', 'daily', 'one_off', 'rule'):
+            raise ValueError(f"неизвестный вид записей: {kind}")
+        self._submit({'op': 'clear', 'kind': kind})
+
+    def set(self, name: str, value) -> None:
+        self._submit({'op': 'set', 'name': name, 'value': value})
+
+    def batch(self, records: list) -> None:
+        """Несколько изменений одной транзакцией."""
+        self._submit({'op': 'batch', 'records': records})
+
+    def update(self, name: str, change):
+        """Записывает `change(текущее значение настройки)` одной транзакцией
+        BEGIN IMMEDIATE: изменения из других процессов (шардов) между чтением
+        и записью невозможны и не теряются. Возвращает новое значение."""
+        self.writer.flush()
+        with self._lock, self._transaction('BEGIN IMMEDIATE'):
+            row = self._db.execute('SELECT value FROM settings WHERE name = ?', (name,)).fetchone()
+            value = change(None if row is None else json.loads(row[0]))
+            self._set(name, value)
+            self._version = next(self._versions)
+            self._views.touch({'op': 'set', 'name': name}, self._version)
+        return value
+
+    def _submit(self, record: dict) -> None:
+        with self._pending_lock:
+            # номера в том же порядке, что и очередь писателя
+            record = dict(record, seq=next(self._seq))
+            self._overlay(record, record['seq'])
+            self.writer.submit(record)
+        # новый номер — уже после постановки записи: кэш, собранный
+        # по старому номеру, будет пересобран
+        self._version = next(self._versions)
+        self._views.touch(record, self._version)
+
+    def _write_batch(self, batch: list) -> None:
+        """Применяет пачку изменений одной транзакцией (поток-писатель)."""
+        started = time.perf_counter()
+        with self._lock, self._transaction():
+            for record in batch:
+                self._apply(record)
+        WRITE_SECONDS.labels('sqlite').observe(time.perf_counter() - started)
+        # уже в базе: больше не накладываем. Снимаем только номера этой пачки —
+        # упавшая пачка ещё в очереди писателя и остаётся в наложении
+        written = {record['seq'] for record in batch}
+        with self._pending_lock:
+            self._pending_settings = {k: v for k, v in self._pending_settings.items() if v[0] not in written}
+            self._pending_entries = {k: v for k, v in self._pending_entries.items() if v[0] not in written}
+            self._pending_clears = {k: v for k, v in self._pending_clears.items() if v not in written}
+
+    def _overlay(self, record: dict, seq: int) -> None:
+        """Запоминает изменение до записи в базу (под `_pending_lock`)."""
+        op = record['op']
+        if op == 'set':
+            self._pending_settings[record['name']] = (seq, record['value'])
+        elif op == 'batch':
+            for item in record['records']:
+                self._overlay(item, seq)
+        elif op == 'clear':
+            self._pending_clears[record['kind']] = seq
+            self._pending_entries = {key: value for key, value in self._pending_entries.items()
+                                     if key[0] != record['kind']}
+        else:
+            self._pending_entries[tuple(record['key'])] = (seq, record['text'] if op == 'add' else None)
+
+    def _apply(self, record: dict) -> None:
+        op = record['op']
+        if op == 'set':
+            self._set(record['name'], record['value'])
+            return
+        if op == 'batch':
+            for item in record['records']:
+                self._apply(item)
+            return
+        if op == 'clear':
+            self._db.execute(f"DELETE FROM {record['kind']}")
+            return
+
+        kind, *path = record['key']
+        if op == 'add':
+            if kind == 'weekly':
+                self._db.execute('INSERT OR REPLACE INTO weekly (day, time, text) VALUES (?, ?, ?)', (*path, record['text']))
+            elif kind == 'daily':
+                self._db.execute('INSERT OR REPLACE INTO daily (time, text) VALUES (?, ?)', (*path, record['text']))
+            elif kind == 'rule':
+                self._db.execute('INSERT OR REPLACE INTO rule (rule, text) VALUES (?, ?)', (*path, record['text']))
+            else:
+                self._db.execute('INSERT OR REPLACE INTO one_off (date, time, text) VALUES (?, ?, ?)', (*path, record['text']))
+        else:
+            if kind == 'weekly':
+                self._db.execute('DELETE FROM weekly WHERE day = ? AND time = ?', path)
+            elif kind == 'daily':
+                self._db.execute('DELETE FROM daily WHERE time = ?', path)
+            elif kind == 'rule':
+                self._db.execute('DELETE FROM rule WHERE rule = ?', path)
+            else:
+                self._db.execute('DELETE FROM one_off WHERE date = ? AND time = ?', path)
+
+    def _set(self, name: str, value) -> None:
+        self._db.execute('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)',
+                         (name, json.dumps(value, ensure_ascii=False)))
+
+    def sync(self) -> None:
+        """Дожидается записи в базу всех сделанных изменений."""
+        self.writer.flush()
+
+    def refresh(self) -> None:
+        """Базу изменил другой процесс (шард): кэш производных данных устарел."""
+        self._version = next(self._versions)
+        self._views.reset(self._version)
+
+    def compact(self) -> None:
+        """Переносит WAL в основной файл базы."""
+        started = time.perf_counter()
+        with self._lock:
+            self._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        WRITE_SECONDS.labels('checkpoint').observe(time.perf_counter() - started)
+
+    def close(self) -> None:
+        """Дописывает накопленные изменения и закрывает базу."""
+        self.writer.close()
+        with self._lock:
+            self._db.close()
+        with self._read_lock:
+            self._reader.close()
+
+
+class _Transaction:
+    """BEGIN ... COMMIT/ROLLBACK для соединения в режиме autocommit."""
+
+    def __init__(self, db, begin: str = 'BEGIN'):
+        self._db = db
+        self._begin = begin
+
+    def __enter__(self):
+        self._db.execute(self._begin)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def migrate_from_json(json_path: str, journal_path: str, db_path: str) -> int:
+    """Заменяет содержимое базы SQLite снимком + журналом JSON-хранилища.
+
+    Возвращает число перенесённых записей расписания.
+    """
+    source = JournalStore(json_path, journal_path)
+    try:
+        data = source.load({'weekly_schedule': {day: {} for day in WEEKDAYS}})
+    finally:
+        # только читали, но поток-писатель уже запущен
+        source.close()
+    store = SQLiteStore(db_path)
+    try:
+        store.import_data(data, replace=True)
+        store.compact()
+        return len(store.entries())
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    from config import JOURNAL_FILE, SCHEDULE_FILE, SQLITE_FILE
+
+    logging.basicConfig(level=logging.INFO)
+    count = migrate_from_json(SCHEDULE_FILE, JOURNAL_FILE, SQLITE_FILE)
+    print(f"✅ Перенесено записей расписания: {count} → {SQLITE_FILE}")
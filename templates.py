@@ -0,0 +1,87 @@
+"""Шаблоны текстов расписания.
+
+В тексте записи можно использовать подстановки:
+
+    {date}         дата отправки (19.10.2026) по часам группы
+    {weekday}      день недели (Понедельник)
+    {time}         время записи (09:00)
+    {group_title}  название группы — запоминается, когда в группе пишут боту
+
+Фигурные скобки как текст — `{{` и `}}`. Рассылки идут с parse_mode='HTML':
+текст шаблона экранируется один раз при разборе (`compile_template`,
+кэш по исходному тексту), значения подстановок — при отправке. Готовые
+тексты кэшируются (`render`, LRU по шаблону и значениям), так что
+отправка одной записи во все группы разбирает и собирает текст один раз.
+"""
+import html
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
+
+FIELDS = ('date', 'weekday', 'time', 'group_title')
+WEEKDAY_NAMES = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')
+
+_TOKEN = re.compile(r'\{\{|\}\}|\{(\w+)\}')
+
+
+class Template(NamedTuple):
+    """Разобранный шаблон: части — готовый HTML или имя подстановки (в кортеже)."""
+    source: str
+    parts: tuple
+    fields: frozenset
+
+
+@lru_cache(maxsize=4096)
+def compile_template(source: str, strict: bool = False) -> Template:
+    """Разбирает шаблон; strict=True — неизвестная подстановка это ValueError.
+
+    Без strict (тексты, сохранённые раньше) `{что-то}` остаётся текстом.
+    """
+    parts, literal, fields = [], [], set()
+    pos = 0
+    for match in _TOKEN.finditer(source):
+        literal.append(source[pos:match.start()])
+        pos = match.end()
+        token, name = match.group(0), match.group(1)
+        if name is None:
+            literal.append(token[0])
+        elif name in FIELDS:
+            if literal:
+                parts.append(html.escape(''.join(literal), quote=False))
+                literal = []
+            parts.append((name,))
+            fields.add(name)
+        elif strict:
+            raise ValueError(f"неизвестная подстановка {{{name}}}, доступны: "
+                             + ', '.join(f"{{{field}}}" for field in FIELDS))
+        else:
+            literal.append(token)
+    literal.append(source[pos:])
+    if any(literal):
+        parts.append(html.escape(''.join(literal), quote=False))
+    return Template(source, tuple(part for part in parts if part), frozenset(fields))
+
+
+def context(ts: float, tz=None, **values) -> dict:
+    """Значения подстановок для срабатывания в момент `ts` в поясе `tz`."""
+    when = datetime.fromtimestamp(ts, tz)
+    return dict(date=when.strftime('%d.%m.%Y'), weekday=WEEKDAY_NAMES[when.weekday()],
+                time=when.strftime('%H:%M'), **values)
+
+
+def uses(source: str, field: str) -> bool:
+    return field in compile_template(source).fields
+
+
+@lru_cache(maxsize=4096)
+def _render(source: str, values: tuple) -> str:
+    values = dict(values)
+    return ''.join(part if isinstance(part, str) else html.escape(values.get(part[0], ''), quote=False)
+                   for part in compile_template(source).parts)
+
+
+def render(source: str, values: dict) -> str:
+    """HTML по шаблону; в ключ кэша входят только используемые подстановки."""
+    fields = compile_template(source).fields
+    return _render(source, tuple((name, str(values.get(name, ''))) for name in FIELDS if name in fields))
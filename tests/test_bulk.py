@@ -0,0 +1,130 @@
+import io
+from datetime import datetime
+
+import pytest
+
+import bulk
+from storage import JournalStore
+
+NOW = datetime(2026, 10, 19, 12, 0)
+
+CSV = (
+    '\ufeffkind,when,text\n'
+    'weekly,monday 09:00,Доброе утро!\n'
+    'daily,12:00,"Обед, потом работа"\n'
+    'one_off,2026-10-20 18:00,Собрание\n'
+    'rule,0 9 * * 1-5,По будням\n'
+)
+
+ENTRIES = {
+    ('weekly', 'monday', '09:00'): 'Доброе утро!',
+    ('daily', '12:00'): 'Обед, потом работа',
+    ('one_off', '2026-10-20', '18:00'): 'Собрание',
+    ('rule', '0 9 * * 1-5'): 'По будням',
+}
+
+
+def load(text: str, limit: int = 1000) -> bulk.ImportResult:
+    return bulk.load(io.StringIO(text), NOW, '/nonexistent', limit)
+
+
+@pytest.mark.parametrize('kind, when, key', [
+    ('weekly', 'Monday  9:05', ('weekly', 'monday', '09:05')),
+    ('weekly', 'понедельник 09:00', ('weekly', 'monday', '09:00')),
+    ('DAILY', '07:30', ('daily', '07:30')),
+    ('one_off', '2026-10-20 18:00', ('one_off', '2026-10-20', '18:00')),
+    ('rule', 'FREQ=DAILY;BYHOUR=9', ('rule', 'DTSTART=20261019T120000;FREQ=DAILY;BYHOUR=9')),
+])
+def test_parse_key(kind, when, key):
+    assert bulk.parse_key(kind, when, NOW) == key
+
+
+@pytest.mark.parametrize('kind, when', [
+    ('weekly', 'someday 09:00'), ('daily', '25:00'), ('daily', 'monday 09:00'),
+    ('one_off', '2026-13-01 10:00'), ('monthly', '1 09:00'), ('rule', '0 9 * * 9'),
+])
+def test_parse_key_errors(kind, when):
+    with pytest.raises(ValueError):
+        bulk.parse_key(kind, when, NOW)
+
+
+def test_csv():
+    result = load(CSV)
+    assert result.entries == ENTRIES
+    assert (result.rows, result.errors, result.error_count) == (4, [], 0)
+
+
+def test_csv_reports_rows_with_errors():
+    result = load('kind,when,text\ndaily,12:00,Обед\ndaily,99:00,Ночь\nhourly,1,x\ndaily,13:00,\n')
+    assert result.entries == {('daily', '12:00'): 'Обед'}
+    assert result.error_count == 3
+    assert [number for number, _ in result.errors] == [3, 4, 5]
+
+
+def test_csv_requires_columns():
+    with pytest.raises(ValueError, match='text'):
+        load('kind,when\ndaily,12:00\n')
+
+
+def test_json_array_across_chunks(monkeypatch):
+    monkeypatch.setattr(bulk, 'CHUNK_SIZE', 7)
+    rows = ',\n'.join(
+        f'{{"kind": "{key[0]}", "when": "{bulk.key_when(key)[1]}", "text": "{text}"}}'
+        for key, text in ENTRIES.items())
+    result = load(f'  [\n{rows}\n]\n')
+    assert result.entries == ENTRIES
+    assert result.rows == 4
+
+
+def test_json_array_element_must_be_object():
+    result = load('[{"kind": "daily", "when": "12:00", "text": "Обед"}, 5]')
+    assert result.entries == {('daily', '12:00'): 'Обед'}
+    assert result.errors == [(2, 'ожидался объект')]
+
+
+def test_json_array_truncated():
+    with pytest.raises(ValueError):
+        load('[{"kind": "daily", "when": "12:00", "text": "Об')
+
+
+def test_json_array_malformed_element_is_not_buffered(monkeypatch):
+    monkeypatch.setattr(bulk, 'CHUNK_SIZE', 16)
+    monkeypatch.setattr(bulk, 'MAX_ITEM_SIZE', 64)
+    reads = []
+
+    class Endless(io.StringIO):
+        def read(self, size=-1):
+            reads.append(size)
+            return super().read(size) or 'x' * size
+
+    with pytest.raises(ValueError, match='записи 2'):
+        bulk.load(Endless('[{"kind": "daily", "when": "12:00", "text": "a"}, {oops'), NOW, '', 1000)
+    assert len(reads) < 20
+
+
+def test_json_lines():
+    result = load('{"kind": "daily", "when": "12:00", "text": "Обед"}\n\nне json\n[1]\n')
+    assert result.entries == {('daily', '12:00'): 'Обед'}
+    assert [number for number, _ in result.errors] == [3, 4]
+
+
+def test_later_duplicate_wins():
+    result = load('kind,when,text\ndaily,12:00,Первый\ndaily,12:00,Второй\n')
+    assert result.entries == {('daily', '12:00'): 'Второй'}
+    assert result.rows == 2
+
+
+def test_row_limit():
+    with pytest.raises(ValueError, match='больше 2'):
+        load(CSV, limit=2)
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'json'])
+def test_export_round_trip(tmp_path, fmt):
+    store = JournalStore(str(tmp_path / 'schedule.json'), str(tmp_path / 'journal.log'))
+    store.load({'weekly_schedule': {}})
+    store.batch([{'op': 'add', 'key': list(key), 'text': text} for key, text in ENTRIES.items()])
+    out = io.StringIO()
+    assert bulk.export(store, out, fmt) == len(ENTRIES)
+    store.close()
+    assert load(out.getvalue()).entries == ENTRIES
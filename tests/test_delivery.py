@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+import requests
+from telebot import apihelper
+
+from delivery import DeliveryEngine, RetryPolicy, classify_error
+
+
+def api_error(code: int, retry_after: int = None) -> apihelper.ApiTelegramException:
+    result_json = {'ok': False, 'error_code': code, 'description': f'Ошибка {code}'}
+    if retry_after is not None:
+        result_json['parameters'] = {'retry_after': retry_after}
+    return apihelper.ApiTelegramException('sendMessage', None, result_json)
+
+
+def test_classify_error():
+    assert classify_error(api_error(429, 7)) == ('retry', 7)
+    assert classify_error(api_error(502)) == ('retry', None)
+    assert classify_error(api_error(400)) == ('fatal', None)
+    assert classify_error(api_error(403)) == ('fatal', None)
+    assert classify_error(requests.exceptions.ConnectionError()) == ('retry', None)
+    assert classify_error(ValueError()) == ('fatal', None)
+
+
+def test_retry_policy_waits_as_telegram_asks():
+    policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=60)
+    assert policy.delay(api_error(429, 7), 1) == 7.0
+    assert policy.delay(api_error(429, 7), 3) is None
+
+
+def test_retry_policy_backoff_is_bounded():
+    policy = RetryPolicy(max_attempts=10, base_delay=1, max_delay=5)
+    for attempt in range(1, 10):
+        delay = policy.delay(api_error(500), attempt)
+        assert 0 <= delay <= min(5, 2 ** (attempt - 1))
+    assert policy.delay(api_error(500), 10) is None
+
+
+def test_retry_policy_gives_up_on_fatal():
+    assert RetryPolicy().delay(api_error(400), 1) is None
+
+
+def test_engine_retries_after_429():
+    calls = []
+    lock = threading.Lock()
+
+    def send(chat_id, text):
+        with lock:
+            calls.append(chat_id)
+            first = calls.count(chat_id) == 1
+        if chat_id == 1 and first:
+            raise api_error(429, 0)
+        return f'ok {chat_id}'
+
+    engine = DeliveryEngine(send, workers=2, global_rate=1000, chat_per_minute=6000, chat_burst=10,
+                            retry=RetryPolicy(max_attempts=3, base_delay=0.01))
+    try:
+        futures = engine.broadcast([1, 2], 'Привет')
+        assert [f.result(timeout=5) for f in futures] == ['ok 1', 'ok 2']
+        assert sorted(calls) == [1, 1, 2]
+    finally:
+        engine.shutdown()
+
+
+def test_engine_fails_after_fatal_error():
+    def send(chat_id, text):
+        raise api_error(403)
+
+    engine = DeliveryEngine(send, workers=1, global_rate=1000, chat_per_minute=6000,
+                            retry=RetryPolicy(max_attempts=3, base_delay=0.01))
+    try:
+        with pytest.raises(apihelper.ApiTelegramException):
+            engine.submit(1, 'Привет').result(timeout=5)
+    finally:
+        engine.shutdown()
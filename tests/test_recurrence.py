@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+import recurrence
+
+
+def test_cron_weekdays_skip_weekend():
+    rule = recurrence.parse('0 9 * * 1-5')
+    # пятница, 23.10.2026, после 09:00 — следующее в понедельник
+    assert rule.next_after(datetime(2026, 10, 23, 9, 0)) == datetime(2026, 10, 26, 9, 0)
+    assert rule.next_after(datetime(2026, 10, 23, 8, 59)) == datetime(2026, 10, 23, 9, 0)
+
+
+def test_next_after_is_strictly_later():
+    rule = recurrence.parse('*/30 8-18 * * *')
+    assert rule.next_after(datetime(2026, 10, 19, 8, 30)) == datetime(2026, 10, 19, 9, 0)
+    assert rule.next_after(datetime(2026, 10, 19, 18, 30)) == datetime(2026, 10, 20, 8, 0)
+
+
+def test_cron_last_day_of_month():
+    rule = recurrence.parse('0 12 L * *')
+    assert rule.next_after(datetime(2026, 2, 1)) == datetime(2026, 2, 28, 12, 0)
+    assert rule.next_after(datetime(2028, 2, 1)) == datetime(2028, 2, 29, 12, 0)
+
+
+def test_rrule_last_friday_of_month():
+    rule = recurrence.parse('FREQ=MONTHLY;BYDAY=-1FR;BYHOUR=18;BYMINUTE=0')
+    assert rule.occurrences(datetime(2026, 10, 1), 3) == [
+        datetime(2026, 10, 30, 18, 0),
+        datetime(2026, 11, 27, 18, 0),
+        datetime(2026, 12, 25, 18, 0),
+    ]
+
+
+def test_rrule_interval_counts_from_dtstart():
+    rule = recurrence.parse('DTSTART=20261019T090000;FREQ=DAILY;INTERVAL=2')
+    assert rule.occurrences(datetime(2026, 10, 19), 3) == [
+        datetime(2026, 10, 19, 9, 0),
+        datetime(2026, 10, 21, 9, 0),
+        datetime(2026, 10, 23, 9, 0),
+    ]
+
+
+def test_rrule_count_and_until_exhaust():
+    counted = recurrence.parse('DTSTART=20261019T090000;FREQ=WEEKLY;BYDAY=MO,WE;COUNT=3')
+    assert counted.occurrences(datetime(2026, 10, 1), 10) == [
+        datetime(2026, 10, 19, 9, 0),
+        datetime(2026, 10, 21, 9, 0),
+        datetime(2026, 10, 26, 9, 0),
+    ]
+    assert counted.next_after(datetime(2026, 10, 26, 9, 0)) is None
+
+    until = recurrence.parse('DTSTART=20261019T090000;FREQ=DAILY;UNTIL=20261020T235959')
+    assert until.occurrences(datetime(2026, 10, 1), 10) == [
+        datetime(2026, 10, 19, 9, 0),
+        datetime(2026, 10, 20, 9, 0),
+    ]
+
+
+def test_normalize_adds_dtstart():
+    now = datetime(2026, 10, 19, 14, 7)
+    assert recurrence.normalize('rrule:freq=daily;byhour=9', now) == 'DTSTART=20261019T140700;FREQ=DAILY;BYHOUR=9'
+    assert recurrence.normalize('0  9 * *  1-5', now) == '0 9 * * 1-5'
+
+
+@pytest.mark.parametrize('spec', ['', '61 * * * *', '0 9 * * 8', 'FREQ=SECONDLY', 'FREQ=DAILY;BYHOUR=25'])
+def test_invalid_rules(spec):
+    with pytest.raises(ValueError):
+        recurrence.parse(spec)
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import pytest
+
+from router import Command, CommandRouter, parse_command
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('/start', Command('start', '')),
+    ('/add_daily 09:00 Доброе утро', Command('add_daily', '09:00 Доброе утро')),
+    ('/status@my_bot 2', Command('status', '2')),
+    ('/add_daily\n09:00 Текст\nв две строки', Command('add_daily', '09:00 Текст\nв две строки')),
+    ('/remove_daily\t09:00 ', Command('remove_daily', '09:00')),
+    ('/export   json', Command('export', 'json')),
+])
+def test_parse_command(text, expected):
+    assert parse_command(text) == expected
+
+
+@pytest.mark.parametrize('text', [None, '', 'привет', ' /start', '/', '/@bot', '/ start'])
+def test_not_a_command(text):
+    assert parse_command(text) is None
+
+
+def message(text=None, caption=None):
+    return SimpleNamespace(text=text, caption=caption)
+
+
+def test_router_resolves_handler_and_args():
+    def fallback(message, args):
+        pass
+
+    router = CommandRouter(fallback=fallback)
+
+    @router.command('import', 'load')
+    def import_schedule(message, args):
+        pass
+
+    assert router.resolve(message('/load replace')) == (import_schedule, 'replace')
+    # у документа команда в подписи
+    assert router.resolve(message(caption='/import replace')) == (import_schedule, 'replace')
+    assert router.resolve(message('/unknown x')) == (fallback, '')
+    assert router.resolve(message('просто текст')) == (fallback, '')
+    assert sorted(router.commands()) == ['import', 'load']
+
+
+def test_router_rejects_duplicates():
+    router = CommandRouter({'start': print})
+    with pytest.raises(ValueError):
+        router.register('/start', print)
@@ -0,0 +1,113 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from clock import VirtualClock
+from schedule_index import ScheduleIndex
+from scheduler import Scheduler, next_occurrence
+from storage import JournalStore
+from timezones import tzinfo
+
+BERLIN = tzinfo('Europe/Berlin')
+
+
+def utc(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JournalStore(str(tmp_path / 'schedule.json'), str(tmp_path / 'journal.log'))
+    store.load({'weekly_schedule': {}})
+    yield store
+    store.close()
+
+
+def run(scheduler, clock, until: float, done: bool = True) -> list:
+    """Двигает часы до `until`; [(ключ, момент срабатывания)]."""
+    fired = []
+    while clock.time() < until:
+        due, delay = scheduler.step()
+        for key, ts, zone in due:
+            fired.append((key, ts))
+            if done:
+                scheduler.done(key)
+        clock.advance(max(delay, 1))
+    return fired
+
+
+def test_nonexistent_time_fires_after_spring_forward():
+    # 29.03.2026 в Берлине 02:00 → 03:00: «воскресенье 02:30» — в 03:30 CEST
+    slot = ScheduleIndex.slots_for(('weekly', 'sunday', '02:30'))[0]
+    assert next_occurrence(slot, utc(2026, 3, 28, 12), BERLIN) == utc(2026, 3, 29, 1, 30)
+
+
+def test_repeated_time_fires_once_on_fall_back():
+    # 25.10.2026 03:00 → 02:00: из двух 02:30 берётся первое (CEST)
+    slot = ScheduleIndex.slots_for(('weekly', 'sunday', '02:30'))[0]
+    first = next_occurrence(slot, utc(2026, 10, 24, 12), BERLIN)
+    assert first == utc(2026, 10, 25, 0, 30)
+    # следующее — уже через неделю
+    assert next_occurrence(slot, first + 60, BERLIN) == utc(2026, 11, 1, 1, 30)
+
+
+def test_rule_slot_keeps_wall_time_across_dst():
+    slot = ('r', '0 9 * * *')
+    assert next_occurrence(slot, utc(2026, 10, 24, 0), BERLIN) == utc(2026, 10, 24, 7)
+    assert next_occurrence(slot, utc(2026, 10, 24, 8), BERLIN) == utc(2026, 10, 25, 8)
+
+
+def test_scheduler_fires_daily_at_local_time_across_dst(store):
+    store.add(('daily', '09:00'), 'Доброе утро')
+    store.add(('rule', '30 2 * * *'), 'Ночью')
+    clock = VirtualClock(utc(2026, 10, 23, 22))
+    scheduler = Scheduler(store, clock=clock, zones=lambda: ('Europe/Berlin',))
+    fired = run(scheduler, clock, utc(2026, 10, 26, 22))
+
+    daily = [ts for key, ts in fired if key == ('daily', '09:00')]
+    assert daily == [utc(2026, 10, 24, 7), utc(2026, 10, 25, 8), utc(2026, 10, 26, 8)]
+    assert all(datetime.fromtimestamp(ts, BERLIN).strftime('%H:%M') == '09:00' for ts in daily)
+    # 02:30 бывает дважды 25.10, но правило срабатывает один раз
+    night = [ts for key, ts in fired if key[0] == 'rule']
+    assert night == [utc(2026, 10, 24, 0, 30), utc(2026, 10, 25, 0, 30), utc(2026, 10, 26, 1, 30)]
+
+
+@pytest.mark.parametrize('cleanup_fired', [True, False])
+def test_exhausted_rule_is_removed(store, cleanup_fired):
+    key = ('rule', 'DTSTART=20261019T090000;FREQ=DAILY;COUNT=2')
+    store.add(key, 'Дважды')
+    store.add(('daily', '10:00'), 'Каждый день')
+    clock = VirtualClock(datetime(2026, 10, 19, 8, 0))
+    scheduler = Scheduler(store, clock=clock, cleanup_fired=cleanup_fired, misfire_grace=3600)
+    fired = run(scheduler, clock, datetime(2026, 10, 21, 12, 0).timestamp())
+
+    assert [datetime.fromtimestamp(ts) for k, ts in fired if k == key] == [
+        datetime(2026, 10, 19, 9, 0), datetime(2026, 10, 20, 9, 0)]
+    assert store.text(key) is None
+    assert store.text(('daily', '10:00')) == 'Каждый день'
+
+
+def test_one_off_kept_for_shards_until_grace(store):
+    key = ('one_off', '2026-10-19', '09:00')
+    store.add(key, 'Один раз')
+    clock = VirtualClock(datetime(2026, 10, 19, 8, 0))
+    scheduler = Scheduler(store, clock=clock, cleanup_fired=False, misfire_grace=3600)
+    run(scheduler, clock, datetime(2026, 10, 19, 9, 30).timestamp())
+    # соседние шарды ещё могут её отправлять
+    assert store.text(key) == 'Один раз'
+    run(scheduler, clock, datetime(2026, 10, 20, 12, 0).timestamp())
+    assert store.text(key) is None
+
+
+def test_fired_entry_not_resent_after_hard_kill(store):
+    store.add(('daily', '09:00'), 'Доброе утро')
+    clock = VirtualClock(datetime(2026, 10, 19, 8, 59))
+    scheduler = Scheduler(store, clock=clock, checkpoint=3600)
+    scheduler.step()
+    clock.advance(60)
+    assert [key for key, ts, zone in scheduler.step()[0]] == [('daily', '09:00')]
+
+    # процесс убит без stop(): отметка уже сохранена при срабатывании
+    clock.advance(120)
+    restarted = Scheduler(store, clock=clock, checkpoint=3600)
+    assert restarted.step()[0] == []
@@ -0,0 +1,186 @@
+import json
+
+import pytest
+
+from dead_letters import DeadLetters
+from storage import JournalStore
+from storage_sqlite import SQLiteStore
+
+DEFAULTS = {'weekly_schedule': {'monday': {}}, 'daily_schedule': {}, 'groups': []}
+
+
+def journal(tmp_path, **kwargs) -> JournalStore:
+    store = JournalStore(str(tmp_path / 'schedule.json'), str(tmp_path / 'journal.log'), **kwargs)
+    store.load(DEFAULTS)
+    return store
+
+
+def fill(store) -> None:
+    store.add(('weekly', 'monday', '09:00'), 'Утро')
+    store.add(('daily', '12:00'), 'Обед')
+    store.add(('rule', '0 9 * * 1-5'), 'Будни')
+    store.remove(('daily', '12:00'))
+    store.set('groups', [-100])
+    store.batch([
+        {'op': 'add', 'key': ['one_off', '2026-10-20', '18:00'], 'text': 'Собрание'},
+        {'op': 'add', 'key': ['daily', '08:00'], 'text': 'Зарядка'},
+    ])
+
+
+def state(store) -> dict:
+    return {
+        'entries': sorted(store.entries()),
+        'texts': {key: store.text(key) for key in store.entries()},
+        'monday': list(map(tuple, store.day_entries('monday'))),
+        'daily': list(map(tuple, store.daily_entries())),
+        'rules': list(map(tuple, store.rule_entries())),
+        'groups': store.get('groups'),
+    }
+
+
+EXPECTED = {
+    'entries': sorted([('weekly', 'monday', '09:00'), ('daily', '08:00'), ('rule', '0 9 * * 1-5'),
+                       ('one_off', '2026-10-20', '18:00')]),
+    'texts': {('weekly', 'monday', '09:00'): 'Утро', ('daily', '08:00'): 'Зарядка',
+              ('rule', '0 9 * * 1-5'): 'Будни', ('one_off', '2026-10-20', '18:00'): 'Собрание'},
+    'monday': [('09:00', 'Утро')],
+    'daily': [('08:00', 'Зарядка')],
+    'rules': [('0 9 * * 1-5', 'Будни')],
+    'groups': [-100],
+}
+
+
+def test_journal_replay(tmp_path):
+    store = journal(tmp_path)
+    fill(store)
+    assert state(store) == EXPECTED
+    store.close()
+
+    assert not (tmp_path / 'schedule.json').exists()
+    assert state(journal(tmp_path)) == EXPECTED
+
+
+def test_journal_skips_torn_last_line(tmp_path):
+    store = journal(tmp_path)
+    fill(store)
+    store.close()
+    with open(tmp_path / 'journal.log', 'a', encoding='utf-8') as f:
+        f.write('{"op": "add", "key": ["daily", "2')
+    assert state(journal(tmp_path)) == EXPECTED
+
+
+def test_journal_compaction(tmp_path):
+    store = journal(tmp_path, compact_every=3)
+    fill(store)
+    store.sync()
+    store.close()
+
+    snapshot = json.loads((tmp_path / 'schedule.json').read_text(encoding='utf-8'))
+    assert snapshot['weekly_schedule']['monday'] == {'09:00': 'Утро'}
+    # после сжатия в журнале осталось меньше записей, чем изменений
+    assert len((tmp_path / 'journal.log').read_text(encoding='utf-8').splitlines()) < 6
+    assert state(journal(tmp_path)) == EXPECTED
+
+
+def test_journal_compact_then_replay(tmp_path):
+    store = journal(tmp_path)
+    store.add(('daily', '07:00'), 'Рано')
+    store.sync()
+    store.compact()
+    assert (tmp_path / 'journal.log').read_text(encoding='utf-8') == ''
+    fill(store)
+    store.remove(('daily', '07:00'))
+    store.close()
+    assert state(journal(tmp_path)) == EXPECTED
+
+
+def test_snapshot_versions_are_immutable(tmp_path):
+    store = journal(tmp_path)
+    before = store.snapshot()
+    store.add(('weekly', 'monday', '10:00'), 'Позже')
+    assert before.data['weekly_schedule']['monday'] == {}
+    assert store.version == before.version + 1
+    store.close()
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / 'schedule.db')
+
+
+def test_sqlite_reads_pending_writes(sqlite_path):
+    store = SQLiteStore(sqlite_path, window=60)
+    store.load(DEFAULTS)
+    fill(store)
+    # окно писателя ещё не истекло: читаем из незаписанных изменений
+    assert store.writer.dirty
+    assert state(store) == EXPECTED
+    store.clear('daily')
+    assert store.daily_entries() == []
+    assert store.text(('daily', '08:00')) is None
+    store.add(('daily', '06:00'), 'Совсем рано')
+    assert store.daily_entries() == [('06:00', 'Совсем рано')]
+    store.close()
+
+    reopened = SQLiteStore(sqlite_path)
+    assert list(map(tuple, reopened.daily_entries())) == [('06:00', 'Совсем рано')]
+    assert reopened.get('groups') == [-100]
+    reopened.close()
+
+
+def test_sqlite_failed_batch_is_retried(sqlite_path, monkeypatch):
+    store = SQLiteStore(sqlite_path, window=60)
+    store.load(DEFAULTS)
+    apply = store._apply
+    failures = iter([True])
+
+    def flaky(record):
+        if next(failures, False):
+            raise OSError('disk I/O error')
+        apply(record)
+
+    monkeypatch.setattr(store, '_apply', flaky)
+    store.add(('daily', '07:00'), 'Первая')
+    store.sync()
+    # пачка упала: изменение ждёт повтора и по-прежнему видно
+    assert store.writer.dirty
+    assert store.text(('daily', '07:00')) == 'Первая'
+    store.add(('daily', '08:00'), 'Вторая')
+    store.sync()
+    assert not store.writer.dirty
+    store.close()
+
+    reopened = SQLiteStore(sqlite_path)
+    assert list(map(tuple, reopened.daily_entries())) == [('07:00', 'Первая'), ('08:00', 'Вторая')]
+    reopened.close()
+
+
+def test_dead_letter_ids_are_not_reused(tmp_path):
+    store = journal(tmp_path)
+    # старый формат: просто список
+    store.set('dead_letters', [{'id': 4, 'text': 'old'}])
+    letters = DeadLetters(store)
+    assert letters.add(1, 'a')['id'] == 5
+    assert [letter['text'] for letter in letters.take()] == ['old', 'a']
+    assert letters.add(1, 'b')['id'] == 6
+    store.close()
+
+    reopened = journal(tmp_path)
+    assert DeadLetters(reopened).add(1, 'c')['id'] == 7
+    reopened.close()
+
+
+def test_sqlite_update_is_shared_between_processes(sqlite_path):
+    first, second = SQLiteStore(sqlite_path), SQLiteStore(sqlite_path)
+    first.load(DEFAULTS)
+    letters_a, letters_b = DeadLetters(first, limit=3), DeadLetters(second, limit=3)
+    letters_a.add(1, 'a')
+    letters_b.add(2, 'b')
+    letters_a.add(3, 'c')
+    assert [letter['id'] for letter in letters_b.list()] == [1, 2, 3]
+    assert [letter['text'] for letter in letters_a.take([2])] == ['b']
+    letters_b.add(4, 'd')
+    letters_b.add(5, 'e')
+    assert [letter['text'] for letter in letters_a.list()] == ['c', 'd', 'e']
+    first.close()
+    second.close()
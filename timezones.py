@@ -0,0 +1,36 @@
+"""Часовые пояса групп.
+
+Пояс группы — имя IANA ('Europe/Moscow') в настройке 'group_timezones'
+({str(group_id): имя}). Группы без пояса живут по поясу по умолчанию
+(TIMEZONE, пустая строка — локальное время сервера). Запись расписания
+«понедельник 09:00» срабатывает в 09:00 по часам каждой группы.
+"""
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+@lru_cache(maxsize=None)
+def tzinfo(name: str):
+    """ZoneInfo по имени; для '' — None (локальное время сервера)."""
+    return ZoneInfo(name) if name else None
+
+
+def is_valid(name: str) -> bool:
+    try:
+        tzinfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def group_zone(store, group_id, default: str = '') -> str:
+    return (store.get('group_timezones') or {}).get(str(group_id), default)
+
+
+def groups_by_zone(store, default: str = '') -> dict:
+    """{пояс: [группы]} для всех групп рассылки."""
+    zones = {}
+    timezones = store.get('group_timezones') or {}
+    for group_id in store.get('groups') or []:
+        zones.setdefault(timezones.get(str(group_id), default), []).append(group_id)
+    return zones
@@ -0,0 +1,196 @@
+"""Приём обновлений Telegram через вебхук (RUN_MODE=webhook).
+
+Встроенный HTTP-сервер принимает POST с обновлением, проверяет заголовок
+`X-Telegram-Bot-Api-Secret-Token` и кладёт тело в ограниченную очередь.
+Рабочие потоки разбирают обновления и передают их в те же обработчики,
+что и при polling. Если очередь заполнена, сервер отвечает 503 с
+Retry-After — Telegram повторит доставку позже (backpressure).
+
+GET /stats (с тем же секретным заголовком) отдаёт JSON со статистикой:
+обновлений в секунду, p50/p99 времени обработки, глубина очереди,
+отклонено из-за переполнения.
+"""
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Больше этого тело обновления не бывает; защищаемся от мусорных запросов
+MAX_BODY = 1024 * 1024
+
+
+class UpdateStats:
+    """Пропускная способность и задержки обработки обновлений.
+
+    Задержки хранятся в скользящем окне из последних `window` обновлений,
+    по нему считаются перцентили.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._started = time.monotonic()
+        self.handled = 0
+        self.errors = 0
+        self.rejected = 0
+
+    def record(self, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self.handled += 1
+            if not ok:
+                self.errors += 1
+
+    def reject(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def percentile(self, p: float) -> float:
+        """p-й перцентиль задержки в секундах (0, если данных нет)."""
+        with self._lock:
+            data = sorted(self._latencies)
+        if not data:
+            return 0.0
+        return data[min(len(data) - 1, int(len(data) * p / 100))]
+
+    def summary(self) -> dict:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            'handled': self.handled,
+            'errors': self.errors,
+            'rejected': self.rejected,
+            'updates_per_sec': round(self.handled / elapsed, 2),
+            'p50_ms': round(self.percentile(50) * 1000, 2),
+            'p99_ms': round(self.percentile(99) * 1000, 2),
+        }
+
+    def log(self) -> None:
+        s = self.summary()
+        logger.info(f"📊 Обновлений: {s['handled']} ({s['updates_per_sec']}/с), "
+                    f"p50 {s['p50_ms']} мс, p99 {s['p99_ms']} мс, "
+                    f"ошибок {s['errors']}, отклонено {s['rejected']}")
+
+
+class WebhookServer:
+    """HTTP-сервер вебхука с ограниченной очередью и пулом обработчиков.
+
+    `dispatch(updates)` — как `TeleBot.process_new_updates`; вызывается из
+    рабочих потоков по одному обновлению.
+    """
+
+    def __init__(self, dispatch, host: str = '0.0.0.0', port: int = 8443,
+                 path: str = '/webhook', secret: str = '', queue_size: int = 100,
+                 workers: int = 4, stats: UpdateStats = None):
+        self._dispatch = dispatch
+        self.path = path
+        self.secret = secret
+        self.stats = stats or UpdateStats()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._workers = [
+            threading.Thread(target=self._work, name=f'webhook-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def address(self) -> tuple:
+        """(host, port), на которых реально слушает сервер (port=0 — любой свободный)."""
+        return self._httpd.server_address[:2]
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def serve_forever(self) -> None:
+        """Запускает обработчики и принимает запросы до `shutdown()`."""
+        for worker in self._workers:
+            worker.start()
+        host, port = self.address
+        logger.info(f"🌐 Вебхук слушает http://{host}:{port}{self.path}")
+        self._httpd.serve_forever()
+
+    def shutdown(self) -> None:
+        """Перестаёт принимать запросы и дорабатывает уже принятые обновления."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.join()
+
+    def offer(self, body: bytes) -> bool:
+        """Кладёт тело обновления в очередь; False, если очередь заполнена."""
+        try:
+            self._queue.put_nowait(body)
+            return True
+        except queue.Full:
+            self.stats.reject()
+            return False
+
+    def _work(self) -> None:
+        while True:
+            body = self._queue.get()
+            if body is None:
+                return
+            try:
+                update = types.Update.de_json(body.decode('utf-8'))
+                self._dispatch([update])
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки обновления из вебхука: {e}")
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._reply(404)
+                if not self._authorized():
+                    return self._reply(403)
+                length = int(self.headers.get('Content-Length') or 0)
+                if not 0 < length <= MAX_BODY:
+                    return self._reply(400)
+                body = self.rfile.read(length)
+                try:
+                    json.loads(body)
+                except ValueError:
+                    return self._reply(400)
+                if not server.offer(body):
+                    return self._reply(503, headers={'Retry-After': '1'})
+                self._reply(200)
+
+            def do_GET(self):
+                if self.path != '/stats':
+                    return self._reply(404)
+                if not self._authorized():
+                    return self._reply(403)
+                stats = dict(server.stats.summary(), queue_depth=server.queue_depth())
+                self._reply(200, json.dumps(stats).encode(), {'Content-Type': 'application/json'})
+
+            def _authorized(self) -> bool:
+                token = self.headers.get(SECRET_HEADER, '')
+                return not server.secret or hmac.compare_digest(token, server.secret)
+
+            def _reply(self, code: int, body: bytes = b'', headers: dict = None):
+                self.send_response(code)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # каждый запрос не логируем: при нагрузке это тысячи строк
+                pass
+
+        return Handler